@@ -0,0 +1,57 @@
+# 元帳のExcel出力のベンチマーク
+# 商品の元帳を simple_ledger_to_excel で1ファイルずつ書き出す場合と、
+# LedgersExcelExporterで1つのブック（write_only）に書き出す場合を比較する
+# LedgersParallelExporterで元帳ごとのファイルを並列に書き出す場合（2回目は変更なし）も比較する
+#
+# python -m benchmarks.bench_export [--records 100000] [--items 1000] [--sample 20] [--workers 4]
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from qtyaccounting.exporttools import LedgersExcelExporter,LedgersParallelExporter
+from benchmarks.bench_tb import make_ledgers
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records",type=int,default=100000)
+    parser.add_argument("--items",type=int,default=1000)
+    parser.add_argument("--sample",type=int,default=20,help="simple_ledger_to_excelで書き出す元帳の数（全体の時間は推定）")
+    parser.add_argument("--workers",type=int,default=os.cpu_count(),help="LedgersParallelExporterのプロセス数")
+    args = parser.parse_args()
+
+    lgs = make_ledgers(args.records,args.items)
+    exporter = LedgersExcelExporter(lgs)
+    keys = exporter.get_ledger_keys()
+    print("records:",len(lgs.records),"ledgers:",len(keys))
+
+    with tempfile.TemporaryDirectory() as directory:
+        sample = keys[:args.sample]
+        start = time.perf_counter()
+        for key in sample:
+            lgs.simple_ledger_to_excel(*key,filename=os.path.join(directory,exporter.get_ledger_name(*key)+".xlsx"))
+        elapsed = time.perf_counter()-start
+        print("%-40s %8.3f s (estimated %.1f s for %d ledgers)" % ("simple_ledger_to_excel x %d" % len(sample),elapsed,elapsed*len(keys)/len(sample),len(keys)))
+
+        start = time.perf_counter()
+        exporter.export(os.path.join(directory,"Ledgers.xlsx"),ledger_keys=keys)
+        print("%-40s %8.3f s" % ("LedgersExcelExporter.export (1 book)",time.perf_counter()-start))
+
+        for max_workers in sorted(set((1,args.workers))):
+            ledger_directory = os.path.join(directory,"ledgers_%d" % max_workers)
+            for run in ("",", unchanged"):
+                start = time.perf_counter()
+                statuses = LedgersParallelExporter(lgs,max_workers=max_workers).export(ledger_directory,ledger_keys=keys)
+                written = sum(1 for status in statuses.values() if status=="written")
+                print("%-40s %8.3f s (%d written)" % ("LedgersParallelExporter x %d%s" % (max_workers,run),time.perf_counter()-start,written))
+
+        # 書き出し中に増えたメモリ（索引・試算表は作成済み）
+        for n_keys in (len(keys)//10,len(keys)):
+            tracemalloc.start()
+            exporter.export(os.path.join(directory,"Ledgers.xlsx"),ledger_keys=keys[:n_keys])
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("%-40s %8.1f MiB" % ("peak memory (%d ledgers)" % n_keys,peak/1024/1024))
+
+if __name__ == '__main__':
+    main()
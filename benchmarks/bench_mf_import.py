@@ -0,0 +1,70 @@
+# マネーフォワードのCSVから仕訳の辞書を作るまでのベンチマーク
+# CSV全体をLarkで解析する場合（MfCSVToCSVTree + CSVTreeToJournalDic）と、
+# csvモジュールで分割して摘要の<<...>>のみLarkで解析する場合（MfCSVToJournalDic）を比較する
+# Larkの全体解析は遅くメモリも使うので --lark-rows 行までで比較し、MfCSVToJournalDicのみ --rows 行で計る
+#
+# python -m benchmarks.bench_mf_import [--rows 1000000] [--lark-rows 50000] [--annotated 0.3]
+import argparse
+import os
+import random
+import tempfile
+import time
+from qtyaccounting.mftools import MfCSVToCSVTree,CSVTreeToJournalDic,MfCSVToJournalDic
+
+mf_csv_header = ["取引No","取引日","借方勘定科目","借方補助科目","借方部門","借方取引先","借方税区分","借方インボイス","借方金額(円)","借方税額","貸方勘定科目","貸方補助科目","貸方部門","貸方取引先","貸方税区分","貸方インボイス","貸方金額(円)","貸方税額","摘要","仕訳メモ","タグ","MF仕訳タイプ","決算整理仕訳","作成日時","作成者","最終更新日時","最終更新者"]
+
+def make_mf_csv_text(n_rows,annotated=0.3,n_items=100,seed=0):
+    # 1〜3行の仕訳　摘要欄の annotated の割合に<<...>>を書く
+    rnd = random.Random(seed)
+    lines = [",".join('"%s"' % heading for heading in mf_csv_header)]
+    entry_id = 0
+    while len(lines) <= n_rows:
+        entry_id += 1
+        day = "2023/%02d/%02d" % (1+rnd.randrange(12),1+rnd.randrange(28))
+        kind = "開始仕訳" if entry_id == 1 else ""
+        adjusting = "1" if rnd.random() < 0.01 else ""
+        memo = "メモ%d" % rnd.randrange(10) if rnd.random() < 0.2 else ""
+        tag = "タグA|タグB" if rnd.random() < 0.1 else ""
+        for _ in range(rnd.randint(1,3)):
+            item = "I%d" % rnd.randrange(n_items)
+            quantity = rnd.randint(1,20)
+            amount = quantity*rnd.randint(90,130)
+            tekiyou = "売上 %d" % rnd.randrange(1000)
+            if rnd.random() < annotated:
+                if rnd.random() < 0.5:
+                    tekiyou = "入荷<<Dr #%s *%d個 $P%d Cr ?E>> 伝票%d" % (item,quantity,rnd.randrange(50),rnd.randrange(1000))
+                else:
+                    tekiyou = "<<T10:00:00+09:00 Dr ?E Cr #%s @%d *%d個 &天気::晴れ ##売上計上>>" % (item,amount//quantity,quantity)
+            cells = [str(entry_id),day,"商品","","本社","","対象外","",str(amount),"0","普通預金","口座%d" % rnd.randrange(3),"","得意先 %d" % rnd.randrange(20),"課税売上 10%","",str(amount),str(amount//11),tekiyou,memo,tag,kind,adjusting,"2023/8/1 23:02:23","中谷 賢一","",""]
+            lines.append(",".join('"%s"' % cell for cell in cells))
+    return "\n".join(lines[:n_rows+1])+"\n"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows",type=int,default=1000000)
+    parser.add_argument("--lark-rows",type=int,default=50000)
+    parser.add_argument("--annotated",type=float,default=0.3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for n_rows in sorted(set([min(args.lark_rows,args.rows),args.rows])):
+            filename = os.path.join(directory,"mf_%d.csv" % n_rows)
+            with open(filename,"w",encoding="shift_jis",newline="\r\n") as f:
+                f.write(make_mf_csv_text(n_rows,args.annotated))
+            print("rows: %d  %.1f MiB" % (n_rows,os.path.getsize(filename)/1024/1024))
+
+            start = time.perf_counter()
+            journal_dic = MfCSVToJournalDic().translate_file(filename)
+            elapsed = time.perf_counter()-start
+            print("%-50s %8.3f s  entries: %d" % ("MfCSVToJournalDic.translate_file",elapsed,len(journal_dic["journal"])))
+
+            if n_rows <= args.lark_rows:
+                start = time.perf_counter()
+                journal_dic_lark = CSVTreeToJournalDic().visit(MfCSVToCSVTree().translate_file(filename))
+                elapsed_lark = time.perf_counter()-start
+                print("%-50s %8.3f s  same: %s" % ("MfCSVToCSVTree + CSVTreeToJournalDic",elapsed_lark,journal_dic_lark == journal_dic))
+                del journal_dic_lark
+            del journal_dic
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# 月次の帳票一式（ReportBatch）のベンチマーク
+# 試算表・取引先別・担当者別・memo別の試算表（当月・期首から）と商品の元帳を
+# 個別に *_to_df で作成する場合と、Ledgers.run_reportsでまとめて作成する場合を比較する
+#
+# python -m benchmarks.bench_reports [--records 200000] [--items 300]
+import argparse
+import random
+import time
+import pandas as pd
+from qtyaccounting.qtytools import Ledgers
+
+def make_ledgers(n_records,n_items,seed=0):
+    # 取引先・担当者・memo(部門)付きのrecordを直接作る
+    rnd = random.Random(seed)
+    lgs = Ledgers()
+    lgs.accInfo.set_item_info("商品","","",side="Dr")
+    lgs.accInfo.set_item_info("預金","","",side="Dr")
+    lgs.accInfo.set_item_info("売上原価","","",side="Dr")
+    partners = ["P%d" % i for i in range(50)]
+    persons = ["S%d" % i for i in range(10)]
+    sections = ["営業%d課" % i for i in range(5)]
+    records = lgs.records
+    for i in range(n_items):
+        records.append({"datetime":"2022-01-01","account":"商品","sub_account":"","item":"I%d" % i,"memo":{"KIND":"OPENING"},"dr_quantity":10,"dr_amount":1000,"cr_quantity":None,"cr_amount":None})
+    for entry_id in range(n_items,n_records,2):
+        day = "2022-%02d-%02d" % (1+entry_id*12//n_records,1+entry_id%28)
+        item = "I%d" % rnd.randrange(n_items)
+        quantity = rnd.randint(1,20)
+        amount = quantity*rnd.randint(90,130)
+        header = {"partner":rnd.choice(partners),"person_in_charge":rnd.choice(persons)}
+        memo = {"部門":rnd.choice(sections)}
+        if rnd.random() < 0.5:
+            records.append({"datetime":day,"account":"商品","sub_account":"","item":item,"memo":memo,"dr_quantity":quantity,"dr_amount":amount,"cr_quantity":None,"cr_amount":None,**header})
+            records.append({"datetime":day,"account":"預金","sub_account":"","item":"","memo":memo,"dr_quantity":None,"dr_amount":None,"cr_quantity":1,"cr_amount":amount,**header})
+        else:
+            records.append({"datetime":day,"account":"売上原価","sub_account":"","item":item,"memo":memo,"dr_quantity":1,"dr_amount":amount,"cr_quantity":None,"cr_amount":None,**header})
+            records.append({"datetime":day,"account":"商品","sub_account":"","item":item,"memo":memo,"dr_quantity":None,"dr_amount":None,"cr_quantity":quantity,"cr_amount":amount,**header})
+    return lgs
+
+def make_specs(n_items):
+    specs = []
+    for start_datetime in ("2022-12-01","2022-01-01"):
+        period = {"start_datetime":start_datetime,"end_datetime":"2023-01-01"}
+        specs += [{"report":"tb",**period},{"report":"tb_partner_vs_end",**period},{"report":"tb_person_in_charge_vs_end",**period},{"report":"tb_memo_vs_end","memo_key":"部門",**period}]
+    for i in range(n_items):
+        specs.append({"report":"simple_ledger","account":"商品","sub_account":"","item":"I%d" % i})
+    return specs
+
+def run_individually(lgs,specs):
+    dfs = []
+    for spec in specs:
+        report = spec["report"]
+        start_datetime = spec.get("start_datetime",None)
+        end_datetime = spec.get("end_datetime",None)
+        if report=="tb":
+            dfs.append(lgs.tb_to_df(start_datetime,end_datetime))
+        elif report=="tb_partner_vs_end":
+            dfs.append(lgs.tb_partner_vs_end_to_df(start_datetime,end_datetime))
+        elif report=="tb_person_in_charge_vs_end":
+            dfs.append(lgs.tb_person_in_charge_vs_end_to_df(start_datetime,end_datetime))
+        elif report=="tb_memo_vs_end":
+            dfs.append(lgs.tb_memo_vs_end_to_df(spec["memo_key"],start_datetime,end_datetime))
+        elif report=="simple_ledger":
+            dfs.append(lgs.simple_ledger_to_df(spec["account"],spec["sub_account"],spec["item"]))
+    return dfs
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records",type=int,default=200000)
+    parser.add_argument("--items",type=int,default=300)
+    args = parser.parse_args()
+
+    lgs = make_ledgers(args.records,args.items)
+    specs = make_specs(args.items)
+    print("records:",len(lgs.records),"reports:",len(specs))
+
+    lgs.report_cache.clear()
+    start = time.perf_counter()
+    dfs = run_individually(lgs,specs)
+    print("%-40s %8.3f s" % ("individual *_to_df",time.perf_counter()-start))
+
+    lgs.report_cache.clear()
+    start = time.perf_counter()
+    batch = lgs.run_reports(specs)
+    print("%-40s %8.3f s" % ("run_reports",time.perf_counter()-start))
+    same = all(df.equals(batch_df) for df,batch_df in zip(dfs,batch.dfs.values()))
+    print("run_reports == individual:",same)
+
+    timings_df = batch.timings_to_df()
+    print(timings_df[timings_df["kind"]=="scan"].to_string(index=False))
+    reports_df = timings_df[timings_df["kind"]=="report"]
+    print(reports_df.head(8).to_string(index=False))
+    print("%-40s %8.3f s" % ("reports total (%d)" % len(reports_df),reports_df["seconds"].sum()))
+
+if __name__ == '__main__':
+    main()
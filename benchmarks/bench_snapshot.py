@@ -0,0 +1,58 @@
+# recalc_all後のLedgersを復元するまでのベンチマーク
+# 仕訳のテキストを構文解析してrecalc_allする場合と、LedgersSnapshotで保存・復元する場合を比較する
+#
+# python -m benchmarks.bench_snapshot [--entries 20000] [--items 100]
+import argparse
+import os
+import random
+import tempfile
+import time
+from qtyaccounting.qtytools import QTYJournalToTree,InterpretJournalTree
+from qtyaccounting.storetools import LedgersSnapshot
+
+def make_journal_text(n_entries,n_items,seed=0):
+    # 開始仕訳・商品の仕入・売上原価（?A）の仕訳
+    rnd = random.Random(seed)
+    lines = ["<<2022-01-01 &KIND::OPENING"]
+    for i in range(n_items):
+        lines.append("Dr 商品#I%d *10個 1000" % i)
+    lines.append("Cr 資本金 %d>>" % (1000*n_items))
+    for entry_id in range(n_entries):
+        day = "2022-%02d-%02d" % (1+entry_id*12//n_entries,1+entry_id%28)
+        item = "I%d" % rnd.randrange(n_items)
+        if rnd.random() < 0.5:
+            quantity = rnd.randint(1,20)
+            amount = quantity*rnd.randint(90,130)
+            lines.append("<<%s $P%d\nDr 商品#%s *%d個 %d\nCr 預金 %d>>" % (day,rnd.randrange(50),item,quantity,amount,amount))
+        else:
+            lines.append("<<%s $P%d\nDr 売上原価#%s ?E\nCr 商品#%s *%d個 ?A>>" % (day,rnd.randrange(50),item,item,rnd.randint(1,5)))
+    return "\n".join(lines)+"\n"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries",type=int,default=20000)
+    parser.add_argument("--items",type=int,default=100)
+    args = parser.parse_args()
+
+    journal_text = make_journal_text(args.entries,args.items)
+    start = time.perf_counter()
+    lgs = InterpretJournalTree().get_ledgers(QTYJournalToTree().translate(journal_text))
+    print("%-40s %8.3f s" % ("parse + recalc_all",time.perf_counter()-start))
+    # 索引・試算表のキャッシュも作っておく
+    lgs.get_tb_index()
+    lgs.get_record_df()
+    tb = lgs.get_tb()
+    print("records:",len(lgs.records))
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot = LedgersSnapshot(os.path.join(directory,"Ledgers.qtysnap"))
+        start = time.perf_counter()
+        snapshot.save(lgs)
+        print("%-40s %8.3f s %8.1f MiB" % ("LedgersSnapshot.save",time.perf_counter()-start,os.path.getsize(snapshot.filename)/1024/1024))
+        start = time.perf_counter()
+        restored = snapshot.load()
+        print("%-40s %8.3f s" % ("LedgersSnapshot.load",time.perf_counter()-start))
+        print("restored == original:",restored.records==lgs.records and restored.get_tb()==tb)
+
+if __name__ == '__main__':
+    main()
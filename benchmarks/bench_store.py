@@ -0,0 +1,60 @@
+# 保存したLedgersを開いて試算表を作るまでのベンチマーク
+# SQLiteLedgersStore（SQL）・MappedLedgersFile（mmap・NumPy）と、それぞれのload_ledgersでLedgersを復元する場合を比較する
+# 子プロセスで開いた場合に増えたRSS（/proc/self/statm）も表示する
+#
+# python -m benchmarks.bench_store [--records 200000] [--items 300]
+import argparse
+import os
+import tempfile
+import time
+import multiprocessing
+from qtyaccounting.storetools import SQLiteLedgersStore,MappedLedgersFile
+from benchmarks.bench_reports import make_ledgers
+
+def get_rss():
+    # 現在のRSS（MiB）　Linuxのみ
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1])*os.sysconf("SC_PAGE_SIZE")/1024/1024
+
+def open_and_get_tb(args):
+    # 子プロセス：開く -> 試算表 -> (秒,増えたRSS MiB)
+    store_class,filename,load = args
+    rss = get_rss()
+    start = time.perf_counter()
+    store = store_class(filename)
+    if load:
+        tb = store.load_ledgers().get_tb("2022-12-01","2023-01-01")
+    else:
+        tb = store.get_tb("2022-12-01","2023-01-01")
+    elapsed = time.perf_counter()-start
+    rss = get_rss()-rss
+    store.close()
+    return elapsed,rss
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records",type=int,default=200000)
+    parser.add_argument("--items",type=int,default=300)
+    args = parser.parse_args()
+
+    lgs = make_ledgers(args.records,args.items)
+    print("records:",len(lgs.records))
+    with tempfile.TemporaryDirectory() as directory:
+        stores = [(SQLiteLedgersStore,os.path.join(directory,"Ledgers.sqlite3")),(MappedLedgersFile,os.path.join(directory,"Ledgers.qtylgrs"))]
+        for store_class,filename in stores:
+            start = time.perf_counter()
+            with store_class(filename) as store:
+                store.save(lgs)
+            print("%-40s %8.3f s %8.1f MiB" % (store_class.__name__+".save",time.perf_counter()-start,os.path.getsize(filename)/1024/1024))
+
+        # 親プロセスのメモリを含めないように spawn で子プロセスを作る
+        context = multiprocessing.get_context("spawn")
+        for store_class,filename in stores:
+            for load in (False,True):
+                with context.Pool(1,maxtasksperchild=1) as pool:
+                    elapsed,rss = pool.map(open_and_get_tb,[(store_class,filename,load)])[0]
+                name = store_class.__name__+(".load_ledgers + get_tb" if load else " get_tb")
+                print("%-40s %8.3f s  RSS +%8.1f MiB" % (name,elapsed,rss))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# 試算表(Ledgers.get_tb)のベンチマーク
+# 以前のget_tb（recordごとに日付を変換し、sideを取得する）と比較する
+# TBIndex(get_tb_indexed)・tb_periods_to_dfで月次の試算表を求める場合と比較する
+#
+# python -m benchmarks.bench_tb [--records 1000000] [--items 10000]
+import argparse
+import datetime
+import random
+import time
+from qtyaccounting.qtytools import Ledgers
+
+def make_ledgers(n_records,n_items,seed=0):
+    # 仕入（商品/預金）と売上原価（売上原価/商品）のrecordを直接作る
+    rnd = random.Random(seed)
+    lgs = Ledgers()
+    lgs.accInfo.set_item_info("商品","","",side="Dr")
+    lgs.accInfo.set_item_info("預金","","",side="Dr")
+    lgs.accInfo.set_item_info("売上原価","","",side="Dr")
+    records = lgs.records
+    for i in range(n_items):
+        memo = {"KIND":"OPENING"}
+        records.append({"datetime":"2022-01-01","account":"商品","sub_account":"","item":"I%d" % i,"memo":memo,"dr_quantity":10,"dr_amount":1000,"cr_quantity":None,"cr_amount":None})
+    for entry_id in range(n_items,n_records,2):
+        day = "2022-%02d-%02dT%02d:00:00" % (1+entry_id*12//n_records,1+entry_id%28,entry_id%24)
+        item = "I%d" % rnd.randrange(n_items)
+        quantity = rnd.randint(1,20)
+        amount = quantity*rnd.randint(90,130)
+        memo = {}
+        if rnd.random() < 0.5:
+            records.append({"datetime":day,"account":"商品","sub_account":"","item":item,"memo":memo,"dr_quantity":quantity,"dr_amount":amount,"cr_quantity":None,"cr_amount":None})
+            records.append({"datetime":day,"account":"預金","sub_account":"","item":"","memo":memo,"dr_quantity":None,"dr_amount":None,"cr_quantity":1,"cr_amount":amount})
+        else:
+            records.append({"datetime":day,"account":"売上原価","sub_account":"","item":item,"memo":memo,"dr_quantity":1,"dr_amount":amount,"cr_quantity":None,"cr_amount":None})
+            records.append({"datetime":day,"account":"商品","sub_account":"","item":item,"memo":memo,"dr_quantity":None,"dr_amount":None,"cr_quantity":quantity,"cr_amount":amount})
+    return lgs
+
+def get_tb_reference(lgs,start_datetime=None,end_datetime=None):
+    # 以前のget_tb
+    tb = {}
+    dt_start_datetime = datetime.datetime.fromisoformat(start_datetime) if start_datetime is not None else None
+    dt_end_datetime = datetime.datetime.fromisoformat(end_datetime) if end_datetime is not None else None
+    fields = (("dr_quantity","quantity",1),("dr_amount","amount",1),("cr_quantity","quantity",-1),("cr_amount","amount",-1))
+    for record in lgs.records:
+        key = (record["account"],record["sub_account"],record["item"])
+        dt_datetime_rec = datetime.datetime.fromisoformat(record["datetime"])
+        memo = record["memo"]
+        opening = "KIND" in memo and memo["KIND"]=="OPENING"
+        if key not in tb:
+            tb.update({key:{"opening_quantity":0,"opening_amount":0,"before_start_sum_dr_quantity":0,"before_start_sum_dr_amount":0,"before_start_sum_cr_quantity":0,"before_start_sum_cr_amount":0,"sum_dr_quantity":0,"sum_dr_amount":0,"sum_cr_quantity":0,"sum_cr_amount":0}})
+        side = lgs.accInfo.get_item_side(*key)
+        for name,kind,sign in fields:
+            value = record[name]
+            if (type(value) is int) or (type(value) is float):
+                if opening:
+                    if side == "Dr":
+                        tb[key]["opening_"+kind] += sign*value
+                    if side == "Cr":
+                        tb[key]["opening_"+kind] -= sign*value
+                elif (start_datetime is not None) and (dt_datetime_rec<dt_start_datetime):
+                    tb[key]["before_start_sum_"+name] += value
+                elif (end_datetime is None) or (dt_datetime_rec<dt_end_datetime):
+                    tb[key]["sum_"+name] += value
+        t = tb[key]
+        if side == "Dr":
+            t["start_quantity"]=t["opening_quantity"]+t["before_start_sum_dr_quantity"]-t["before_start_sum_cr_quantity"]
+            t["start_amount"]=t["opening_amount"]+t["before_start_sum_dr_amount"]-t["before_start_sum_cr_amount"]
+            t["end_quantity"]=t["start_quantity"]+t["sum_dr_quantity"]-t["sum_cr_quantity"]
+            t["end_amount"]=t["start_amount"]+t["sum_dr_amount"]-t["sum_cr_amount"]
+        elif side == "Cr":
+            t["start_quantity"]=t["opening_quantity"]+t["before_start_sum_cr_quantity"]-t["before_start_sum_dr_quantity"]
+            t["start_amount"]=t["opening_amount"]+t["before_start_sum_cr_amount"]-t["before_start_sum_dr_amount"]
+            t["end_quantity"]=t["start_quantity"]+t["sum_cr_quantity"]-t["sum_dr_quantity"]
+            t["end_amount"]=t["start_amount"]+t["sum_cr_amount"]-t["sum_dr_amount"]
+    tb_lst = sorted(tb.items(),key = lambda x:lgs.accInfo.get_item_disp_cat(*x[0]))
+    return dict(tb_lst)
+
+def bench(name,func,*args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter()-start
+    print("%-40s %8.3f s" % (name,elapsed))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records",type=int,default=1000000)
+    parser.add_argument("--items",type=int,default=10000)
+    args = parser.parse_args()
+
+    lgs = make_ledgers(args.records,args.items)
+    print("records:",len(lgs.records))
+    for period in ((None,None),("2022-04-01","2022-10-01")):
+        ref = bench("reference %s" % (period,),get_tb_reference,lgs,*period)
+        tb = bench("get_tb %s" % (period,),lgs.get_tb,*period)
+        print("get_tb == reference:",tb==ref)
+
+    # TBIndexによる期間別の試算表（月次12回）
+    periods = [("2022-%02d-01" % month,"2022-%02d-01" % (month+1)) for month in range(1,12)]+[("2022-12-01",None)]
+    bench("get_tb_index (build)",lgs.get_tb_index)
+    start = time.perf_counter()
+    tbs = [lgs.get_tb_indexed(*period) for period in periods]
+    print("%-40s %8.3f s" % ("get_tb_indexed x %d" % len(periods),time.perf_counter()-start))
+    start = time.perf_counter()
+    same = all(lgs.get_tb(*period)==tb for period,tb in zip(periods,tbs))
+    print("%-40s %8.3f s" % ("get_tb x %d" % len(periods),time.perf_counter()-start))
+    print("get_tb_indexed == get_tb:",same)
+
+    # 月次の期間別試算表を一度の走査で求める
+    boundaries = [period[0] for period in periods]+["2023-01-01"]
+    bench("tb_periods_to_df (12 months)",lgs.tb_periods_to_df,boundaries)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# 総平均法の払出し金額の計算(recalc_all)のベンチマーク
+# valuation_backend="python"（Ledger.get_out_price_pa）と"numpy"（Ledgers.get_out_prices_pa）を比較する
+# 移動平均法はどちらのbackendでもItemQueueMAで計算するので、参考として"python"の時間のみ表示する
+#
+# python -m benchmarks.bench_valuation [--postings 1000000] [--items 10000] [--pa-postings 20000]
+#
+# 総平均法の"python"は払出しのたびに全recordを走査する（postings**2に比例する）ので、
+# --pa-postings の件数で比較する
+import argparse
+import copy
+import random
+import time
+from qtyaccounting.qtytools import Ledgers
+
+def make_entries(n_postings,n_items,account,seed=0):
+    # 受入と払出し(OP_AUTO_AMOUNT)を、在庫がマイナスにならないように作る
+    rnd = random.Random(seed)
+    stocks = [0]*n_items
+    entries = []
+    for entry_id in range(n_postings):
+        day = "2022-%02d-%02d" % (1+entry_id*12//n_postings,1+entry_id%28)
+        item = rnd.randrange(n_items)
+        header = {"datetime":day,"entry_id":entry_id}
+        if stocks[item] < 5 or rnd.random() < 0.5:
+            quantity = rnd.randint(1,20)
+            amount = quantity*rnd.randint(90,130)
+            stocks[item] += quantity
+            entries.append({"entry_header":header,"debit":[{"account":account,"item":"I%d" % item,"quantity":quantity,"amount":amount,"order_id":0,"line_no":0}]})
+        else:
+            quantity = rnd.randint(1,stocks[item])
+            stocks[item] -= quantity
+            entries.append({"entry_header":header,"credit":[{"account":account,"item":"I%d" % item,"quantity":quantity,"amount":"OP_AUTO_AMOUNT","order_id":0,"line_no":0}]})
+    return entries
+
+def make_ledgers(entries,account,method):
+    lgs = Ledgers()
+    lgs.accInfo.set_item_info(account,"","",side="Dr",method=method)
+    for entry in copy.deepcopy(entries):
+        lgs.register(entry)
+    return lgs
+
+def bench(entries,account,method,backends):
+    results = {}
+    for backend in backends:
+        lgs = make_ledgers(entries,account,method)
+        start = time.perf_counter()
+        lgs.recalc_all(valuation_backend=backend)
+        elapsed = time.perf_counter()-start
+        results[backend] = lgs.records
+        print("%-3s %-6s postings:%8d  recalc_all: %8.3f s" % (method,backend,len(lgs.records),elapsed))
+    if len(results)==2:
+        same = results["python"]==results["numpy"]
+        print("%-3s python == numpy: %s" % (method,same))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--postings",type=int,default=1000000)
+    parser.add_argument("--items",type=int,default=10000)
+    parser.add_argument("--pa-postings",type=int,default=20000)
+    args = parser.parse_args()
+
+    entries = make_entries(args.postings,args.items,"貯蔵品")
+    bench(entries,"貯蔵品","MA",["python"])
+    entries = make_entries(args.pa_postings,min(args.items,args.pa_postings//10),"商品",seed=1)
+    bench(entries,"商品","PA",["python","numpy"])
+    entries = make_entries(args.postings,args.items,"商品",seed=1)
+    bench(entries,"商品","PA",["numpy"])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,741 @@
+# Copyright (c) 2022 Kenichi Nakatani
+# This file is part of QTYAccounting.
+# QTYAccounting is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# QTYAccounting is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with QTYAccounting. If not, see <https://www.gnu.org/licenses/>.
+import os
+import io
+import re
+import csv
+import gzip
+import zipfile
+import hashlib
+import math
+import json
+import datetime
+from decimal import Decimal
+from fractions import Fraction
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor,as_completed
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font,Border,Side,Alignment
+from .qtytools import Ledgers,FixedPoint,RecordColumns
+from .storetools import from_json_value
+
+class ExcelSheetWriter:
+    """
+    1つのブック（又はディレクトリ内のシートごとのブック）にシートを書き出す
+    openpyxlのwrite_onlyモードで行ごとに書き出すので、シートの大きさ・数によらずメモリは一定
+    """
+    invalid_chars = '[]:*?/\\'
+    max_sheet_name = 31
+
+    def __init__(self,filename=None,directory=None):
+        # directoryを指定した場合は、シートごとに <directory>/<シート名>.xlsx に書き出す
+        # どちらも指定しない場合は カレントディレクトリの Ledgers.xlsx
+        if filename is None and directory is None:
+            filename = os.path.join(Path().resolve(),"Ledgers.xlsx")
+        self.filename = filename
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory,exist_ok=True)
+            self.workbook = None
+        else:
+            self.workbook = Workbook(write_only=True)
+        self.sheet_names = {} ## 名前 -> シート名（31文字以内・重複しない）
+        self.filenames = [] ## 書き出したファイル
+        border_side = Side(style="thin")
+        self.header_font = Font(bold=True)
+        self.header_border = Border(left=border_side,right=border_side,top=border_side,bottom=border_side)
+        self.header_alignment = Alignment(horizontal="center",vertical="top")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+    def get_sheet_name(self,name):
+        # Excelで使えない文字を_にし、31文字に切り詰める　重複する場合は~2,~3..を付ける
+        sheet_name = "".join("_" if c in self.invalid_chars else c for c in name)[:self.max_sheet_name]
+        used = set(self.sheet_names.values())
+        count = 1
+        base_name = sheet_name
+        while sheet_name in used:
+            count += 1
+            suffix = "~%d" % count
+            sheet_name = base_name[:self.max_sheet_name-len(suffix)]+suffix
+        self.sheet_names[name] = sheet_name
+        return sheet_name
+
+    def make_header_cell(self,worksheet,value):
+        cell = WriteOnlyCell(worksheet,value=value)
+        cell.font = self.header_font
+        cell.border = self.header_border
+        cell.alignment = self.header_alignment
+        return cell
+
+    def to_cell_value(self,value):
+        # NaN・Noneは空欄　数値・文字列以外は文字列にする
+        if value is None:
+            return None
+        if type(value) is float and math.isnan(value):
+            return None
+        if type(value) is int or type(value) is float or type(value) is str or type(value) is bool:
+            return value
+        if hasattr(value,"item"):
+            #numpyの数値
+            return self.to_cell_value(value.item())
+        return str(value)
+
+    def add_sheet(self,name,header,rows,index_label=None):
+        # header 列名のリスト　rows 行（値のリスト）のiterable
+        # index_labelを指定した場合は、pandasのto_excelと同じく先頭の列に行番号（0から）を付ける
+        sheet_name = self.get_sheet_name(name)
+        if self.directory is not None:
+            workbook = Workbook(write_only=True)
+        else:
+            workbook = self.workbook
+        worksheet = workbook.create_sheet(title=sheet_name)
+        header_cells = [self.make_header_cell(worksheet,column) for column in header]
+        if index_label is not None:
+            header_cells.insert(0,self.make_header_cell(worksheet,index_label))
+        worksheet.append(header_cells)
+        to_cell_value = self.to_cell_value
+        #行番号のセル　appendするとすぐに書き出されるので、同じセルの値を変えて使う（スタイルの設定は遅い）
+        index_cell = self.make_header_cell(worksheet,0) if index_label is not None else None
+        n_rows = 0
+        for row in rows:
+            values = [to_cell_value(value) for value in row]
+            if index_cell is not None:
+                index_cell.value = n_rows
+                values.insert(0,index_cell)
+            worksheet.append(values)
+            n_rows += 1
+        if self.directory is not None:
+            filename = os.path.join(self.directory,sheet_name+".xlsx")
+            workbook.save(filename)
+            self.filenames.append(filename)
+        return n_rows
+
+    def write_df(self,name,df):
+        # DataFrameをシートにする（ReportBatch.writeのwriterとして使える）
+        # indexは先頭の列（MultiIndexの場合は列に分ける）
+        index_names = [index_name if index_name is not None else "" for index_name in df.index.names]
+        header = index_names+[str(column) for column in df.columns]
+        if df.index.nlevels > 1:
+            rows = (list(index)+list(values) for index,values in zip(df.index,df.itertuples(index=False,name=None)))
+        else:
+            rows = ([index]+list(values) for index,values in zip(df.index,df.itertuples(index=False,name=None)))
+        return self.add_sheet(name,header,rows)
+
+    def close(self):
+        if self.workbook is not None:
+            if len(self.sheet_names)==0:
+                #シートがないブックは保存できない
+                self.workbook.create_sheet()
+            self.workbook.save(self.filename)
+            self.filenames.append(self.filename)
+            self.workbook = None
+
+class LedgersExcelExporter:
+    """
+    Ledgersの元帳・試算表を、1つのブックのシート（又はディレクトリ）として書き出す
+    元帳はLedgers.recordsから1行ずつ書き出し、DataFrameを作らない
+    シート名・列は simple_ledger_to_excel、tb_to_excel、tb_*_vs_end_to_excel と同じ
+    """
+    ledger_key_list = ["entry_id","datetime","amount","amount_unit","dr_amount","cr_amount","remarks"]
+    item_ledger_key_list = ["entry_id","datetime","quantity","quantity_unit","amount","amount_unit","dr_quantity","dr_amount","cr_quantity","cr_amount","remarks"]
+    tb_key_list = ["account","sub_account","item","start_quantity","start_amount","sum_dr_quantity","sum_dr_amount","sum_cr_quantity","sum_cr_amount","end_quantity","end_amount"]
+
+    def __init__(self,ledgers):
+        self.ledgers = ledgers
+        self.filenames = [] ## exportで書き出したファイル
+
+    def get_ledger_name(self,account,sub_account=None,item=None):
+        #simple_ledger_to_excelと同じ
+        name = account
+        if sub_account is not None:
+            name += "_"+sub_account
+        if item is not None:
+            name += "_"+item
+        method = self.ledgers.accInfo.get_item_method(account,sub_account,item)
+        if method is not None:
+            name += "_"+method
+        return name
+
+    def get_ledger_keys(self):
+        # recordがあるすべての (account,sub_account,item)（表示カテゴリ順）
+        lgs = self.ledgers
+        keys = [key for key in lgs.get_record_index().items.keys() if None not in key]
+        return sorted(keys,key=lambda key: lgs.accInfo.get_item_disp_cat(*key))
+
+    def iter_ledger_rows(self,account,sub_account=None,item=None):
+        # simple_ledger_to_dfと同じ列の行を、recordから1行ずつ返す
+        lgs = self.ledgers
+        key_list = self.ledger_key_list if item is None else self.item_ledger_key_list
+        fixed_point = lgs.fixed_point
+        records = lgs.records
+        for pos in lgs.get_record_positions(account,sub_account,item):
+            record = records[pos]
+            row = [record.get(key,None) for key in key_list]
+            if fixed_point is not None:
+                for i,key in enumerate(key_list):
+                    if key=="dr_quantity" or key=="cr_quantity":
+                        row[i] = fixed_point.from_quantity(row[i])
+                    elif key=="dr_amount" or key=="cr_amount":
+                        row[i] = fixed_point.from_amount(row[i])
+            yield row
+
+    def add_ledger(self,sheet_writer,account,sub_account=None,item=None):
+        name = self.get_ledger_name(account,sub_account,item)
+        key_list = self.ledger_key_list if item is None else self.item_ledger_key_list
+        return sheet_writer.add_sheet(name,key_list,self.iter_ledger_rows(account,sub_account,item),index_label=name)
+
+    def add_tb(self,sheet_writer,start_datetime=None,end_datetime=None,rec_cond_func=None,name="TB"):
+        # tb_to_dfと同じ列
+        tb = self.ledgers.get_tb(start_datetime,end_datetime,rec_cond_func)
+        rows = ([k[0],k[1],k[2]]+[v.get(key,None) for key in self.tb_key_list[3:]] for k,v in tb.items())
+        return sheet_writer.add_sheet(name,self.tb_key_list,rows,index_label=name)
+
+    def export(self,filename=None,directory=None,ledger_keys=None,tb=True,partner=False,person_in_charge=False,memo_keys=(),start_datetime=None,end_datetime=None):
+        # 試算表と元帳を書き出す
+        # ledger_keys (account,sub_account,item)のリスト　Noneの場合はrecordがあるすべての項目
+        #  sub_account・itemがNoneの場合は総勘定元帳・補助元帳
+        # partner,person_in_charge,memo_keys 取引先別・担当者別・memo別の期末残高（tb_*_vs_end_to_df）も書き出す
+        # 戻り値 {名前:シート名}
+        lgs = self.ledgers
+        if ledger_keys is None:
+            ledger_keys = self.get_ledger_keys()
+        with ExcelSheetWriter(filename,directory) as sheet_writer:
+            if tb:
+                self.add_tb(sheet_writer,start_datetime,end_datetime)
+            if partner:
+                sheet_writer.write_df("TB_partner_vs_end",lgs.tb_partner_vs_end_to_df(start_datetime,end_datetime))
+            if person_in_charge:
+                sheet_writer.write_df("TB_person_in_charge_vs_end",lgs.tb_person_in_charge_vs_end_to_df(start_datetime,end_datetime))
+            for memo_key in memo_keys:
+                sheet_writer.write_df("TB_memo_vs_end_"+memo_key,lgs.tb_memo_vs_end_to_df(memo_key,start_datetime,end_datetime))
+            for key in ledger_keys:
+                self.add_ledger(sheet_writer,*key)
+        self.filenames = sheet_writer.filenames
+        return sheet_writer.sheet_names
+
+STABLE_ZIP_DATE_TIME = (1980,1,1,0,0,0)
+STABLE_CORE_DATETIME = "1980-01-01T00:00:00Z"
+
+def make_stable_xlsx(data):
+    # openpyxlで保存したxlsx（zip）の作成・更新日時を固定値にする（同じ内容なら同じバイト列）
+    with zipfile.ZipFile(io.BytesIO(data)) as source:
+        output = io.BytesIO()
+        with zipfile.ZipFile(output,"w",zipfile.ZIP_DEFLATED) as target:
+            for info in source.infolist():
+                content = source.read(info.filename)
+                if info.filename == "docProps/core.xml":
+                    content = re.sub(rb"(<dcterms:(created|modified)[^>]*>)[^<]*(</dcterms:)",rb"\g<1>"+STABLE_CORE_DATETIME.encode("ascii")+rb"\g<3>",content)
+                target.writestr(zipfile.ZipInfo(info.filename,date_time=STABLE_ZIP_DATE_TIME),content,compress_type=zipfile.ZIP_DEFLATED)
+    return output.getvalue()
+
+def write_ledger_books(tasks):
+    # LedgersParallelExporterの子プロセスで実行する
+    # tasks [(filename,name,header,rows),...]　-> [(filename,"written"|"unchanged",行数),...]
+    results = []
+    for filename,name,header,rows in tasks:
+        buffer = io.BytesIO()
+        with ExcelSheetWriter(buffer) as sheet_writer:
+            n_rows = sheet_writer.add_sheet(name,header,rows,index_label=name)
+        data = make_stable_xlsx(buffer.getvalue())
+        status = "written"
+        if os.path.exists(filename) and os.path.getsize(filename) == len(data):
+            with open(filename,"rb") as f:
+                if f.read() == data:
+                    status = "unchanged"
+        if status == "written":
+            with open(filename,"wb") as f:
+                f.write(data)
+        results.append((filename,status,n_rows))
+    return results
+
+class LedgersParallelExporter:
+    """
+    (account,sub_account,item)ごとの元帳を、simple_ledger_to_excelと同じ名前のファイルに書き出す
+    recordsは索引で一度だけ項目ごとに分け、ファイルの作成はプロセスプールで並列に行う
+    ファイルは同じ内容なら同じバイト列になり、前回と同じ場合は書き込まない（更新日時も変わらない）
+    ディレクトリのmanifest_filenameに各ファイルの内容のハッシュを保存し、前回と同じ元帳はファイルを作成しない
+    """
+    manifest_filename = "ledgers_manifest.json"
+
+    def __init__(self,ledgers,max_workers=None,chunk_size=8,progress=None):
+        # max_workers プロセス数（Noneの場合はCPU数、1の場合はこのプロセスで順に実行）
+        # chunk_size 1つのタスクで作成するファイルの数
+        # progress 1ファイルごとに progress(完了数,ファイル数,filename,status) を呼ぶ
+        self.exporter = LedgersExcelExporter(ledgers)
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+    def get_ledger_filename(self,directory,account,sub_account=None,item=None):
+        return os.path.join(directory,self.exporter.get_ledger_name(account,sub_account,item)+".xlsx")
+
+    def get_digest(self,name,header,rows):
+        return hashlib.sha256(repr((name,header,rows)).encode("utf-8")).hexdigest()
+
+    def load_manifest(self,directory):
+        # {ファイル名:{"digest":内容のハッシュ,"size":ファイルの大きさ}}
+        filename = os.path.join(directory,self.manifest_filename)
+        if not os.path.exists(filename):
+            return {}
+        with open(filename,encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_manifest(self,directory,manifest):
+        with open(os.path.join(directory,self.manifest_filename),"w",encoding="utf-8") as f:
+            json.dump(manifest,f,ensure_ascii=False,indent=0,sort_keys=True)
+
+    def make_tasks(self,directory,ledger_keys,manifest,digests,unchanged):
+        # 項目ごとの行を作り、chunk_sizeずつのタスクにする
+        # 前回と同じ内容でファイルがある場合はunchangedに追加する
+        exporter = self.exporter
+        task = []
+        for key in ledger_keys:
+            name = exporter.get_ledger_name(*key)
+            header = exporter.ledger_key_list if key[2] is None else exporter.item_ledger_key_list
+            rows = list(exporter.iter_ledger_rows(*key))
+            filename = self.get_ledger_filename(directory,*key)
+            basename = os.path.basename(filename)
+            digest = self.get_digest(name,header,rows)
+            digests[basename] = digest
+            entry = manifest.get(basename,None)
+            if entry is not None and entry.get("digest",None) == digest and os.path.exists(filename) and os.path.getsize(filename) == entry.get("size",None):
+                unchanged.append((filename,"unchanged",len(rows)))
+                continue
+            task.append((filename,name,header,rows))
+            if len(task) >= self.chunk_size:
+                yield task
+                task = []
+        if task:
+            yield task
+
+    def export(self,directory=None,ledger_keys=None):
+        # 戻り値 {filename:"written"|"unchanged"}
+        if directory is None:
+            directory = Path().resolve()
+        os.makedirs(directory,exist_ok=True)
+        if ledger_keys is None:
+            ledger_keys = self.exporter.get_ledger_keys()
+        total = len(ledger_keys)
+        statuses = {}
+        manifest = self.load_manifest(directory)
+        digests = {} ## ファイル名 -> 内容のハッシュ
+        unchanged = [] ## ファイルを作成しなかった元帳の結果
+        def add_results(results):
+            for filename,status,n_rows in results:
+                statuses[filename] = status
+                if self.progress is not None:
+                    self.progress(len(statuses),total,filename,status)
+        tasks = self.make_tasks(directory,ledger_keys,manifest,digests,unchanged)
+        if self.max_workers == 1:
+            for task in tasks:
+                add_results(write_ledger_books(task))
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(write_ledger_books,task) for task in tasks]
+                for future in as_completed(futures):
+                    add_results(future.result())
+        add_results(unchanged)
+        for filename in statuses:
+            basename = os.path.basename(filename)
+            manifest[basename] = {"digest":digests[basename],"size":os.path.getsize(filename)}
+        self.save_manifest(directory,manifest)
+        return statuses
+
+def import_pyarrow():
+    # pyarrowはParquet・Arrowで書き出す場合だけ読み込む（pip install pyarrow）
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.ipc
+    except ImportError as e:
+        raise ImportError("pyarrow is required for Parquet/Arrow export. Install it with 'pip install pyarrow'.") from e
+    return pyarrow
+
+class LedgersArrowIO:
+    """
+    Ledgersのrecords・試算表・元帳をParquet又はArrow IPC（.arrow .feather .ipc）のファイルに書き出す
+    数値はint64/float64、日付はtimestamp、文字列は辞書符号化（dictionary）した列にする
+    recordsのファイルからは、構文解析・recalc_allをせずにLedgersを読み込める（load_ledgers）
+    """
+    metadata_key = b"qtyaccounting"
+    format_version = 1
+    string_keys = ["account","sub_account","item","partner","person_in_charge","quantity_unit","amount_unit","remarks"]
+    int_keys = ["entry_id","counts_dr_cr","order_id","line_no"]
+    number_keys = ["price","quantity","amount","dr_quantity","dr_amount","cr_quantity","cr_amount"]
+    fixed_point_keys = {"dr_quantity":"quantity","cr_quantity":"quantity","dr_amount":"amount","cr_amount":"amount"}
+    always_keys = ["item","sub_account","dr_quantity","dr_amount","cr_quantity","cr_amount"] ## fill_qaで必ず設定されるkey
+
+    def __init__(self,ledgers=None):
+        self.ledgers = ledgers
+        self.pa = import_pyarrow()
+
+    def get_format(self,filename,format=None):
+        if format is not None:
+            return format
+        suffix = Path(filename).suffix.lower()
+        if suffix in (".arrow",".feather",".ipc"):
+            return "arrow"
+        return "parquet"
+
+    def string_array(self,values):
+        return self.pa.array(values,type=self.pa.string()).dictionary_encode()
+
+    def number_arrays(self,name,values):
+        # 数値の列　すべてint（又はNone）ならint64、それ以外はfloat64
+        # 数値でない値（OP_***など）は <name>_op の文字列の列にする
+        pa = self.pa
+        numbers = []
+        ops = []
+        for value in values:
+            if value is None or type(value) is int or type(value) is float:
+                numbers.append(value)
+                ops.append(None)
+            elif isinstance(value,(Decimal,Fraction)):
+                numbers.append(float(value))
+                ops.append(None)
+            else:
+                numbers.append(None)
+                ops.append(str(value))
+        if all(value is None or type(value) is int for value in numbers):
+            arrays = {name:pa.array(numbers,type=pa.int64())}
+        else:
+            arrays = {name:pa.array([float(value) if value is not None else None for value in numbers],type=pa.float64())}
+        if any(op is not None for op in ops):
+            arrays[name+"_op"] = self.string_array(ops)
+        return arrays
+
+    def timestamp_array(self,values):
+        # ISO 8601 format　の文字列をtimestampにする（タイムゾーンは除く）
+        datetimes = []
+        for value in values:
+            if value is None:
+                datetimes.append(None)
+            else:
+                datetimes.append(datetime.datetime.fromisoformat(value).replace(tzinfo=None))
+        return self.pa.array(datetimes,type=self.pa.timestamp("us"))
+
+    @classmethod
+    def ledgers_to_metadata(cls,lgs,kind):
+        # スキーマのメタデータ（JSON）に保存する　AccountInfo・FixedPoint・global_header・start_date・end_date
+        fixed_point = lgs.fixed_point
+        metadata = {"format_version":cls.format_version,"kind":kind}
+        metadata["item_info"] = [[list(key),info] for key,info in lgs.accInfo.item_info.items()]
+        if fixed_point is not None:
+            metadata["fixed_point"] = {"amount_scale":fixed_point.amount_scale,"quantity_scale":fixed_point.quantity_scale,"rounding":fixed_point.rounding}
+        else:
+            metadata["fixed_point"] = None
+        metadata["global_header"] = lgs.global_header
+        metadata["start_date"] = lgs.start_date
+        metadata["end_date"] = lgs.end_date
+        return metadata
+
+    @classmethod
+    def metadata_to_ledgers(cls,metadata):
+        # ledgers_to_metadataのメタデータからLedgers（recordsは空）を作成する
+        fixed_point_info = metadata.get("fixed_point",None)
+        fixed_point = FixedPoint(**fixed_point_info) if fixed_point_info is not None else None
+        lgs = Ledgers(fixed_point=fixed_point)
+        lgs.accInfo.item_info = {tuple(key):info for key,info in metadata.get("item_info",[])}
+        lgs.accInfo.version += 1
+        lgs.global_header = from_json_value(metadata.get("global_header",{}))
+        lgs.start_date = metadata.get("start_date",None)
+        lgs.end_date = metadata.get("end_date",None)
+        return lgs
+
+    def get_metadata(self,kind):
+        metadata = self.ledgers_to_metadata(self.ledgers,kind)
+        return {self.metadata_key:json.dumps(metadata,ensure_ascii=False).encode("utf-8")}
+
+    def from_fixed_point(self,name,value):
+        fixed_point = self.ledgers.fixed_point
+        kind = self.fixed_point_keys.get(name,None)
+        if fixed_point is None or kind is None:
+            return value
+        if kind=="quantity":
+            return fixed_point.from_quantity(value)
+        return fixed_point.from_amount(value)
+
+    def records_to_table(self,records=None):
+        # recordsの列　memoはkeyごとの列 memo_str:<key>　memo_number:<key>　memo_number_unit:<key> にする
+        # datetimeはtimestampの列と、元の文字列の列(datetime_str)
+        pa = self.pa
+        if records is None:
+            records = self.ledgers.records
+        arrays = {}
+        datetime_strs = [record.get("datetime",None) for record in records]
+        arrays["datetime"] = self.timestamp_array(datetime_strs)
+        arrays["datetime_str"] = self.string_array(datetime_strs)
+        for name in self.int_keys:
+            arrays[name] = pa.array([record.get(name,None) for record in records],type=pa.int64())
+        for name in self.string_keys:
+            arrays[name] = self.string_array([record.get(name,None) for record in records])
+        for name in self.number_keys:
+            arrays.update(self.number_arrays(name,[self.from_fixed_point(name,record.get(name,None)) for record in records]))
+        memo_keys = []
+        for record in records:
+            for k in record.get("memo",{}):
+                if k not in memo_keys:
+                    memo_keys.append(k)
+        for k in memo_keys:
+            memo_values = [record.get("memo",{}).get(k,None) for record in records]
+            strs = [value if type(value) is str else None for value in memo_values]
+            if any(value is not None for value in strs):
+                arrays["memo_str:"+k] = self.string_array(strs)
+            numbers = [value[0] if type(value) is tuple else None for value in memo_values]
+            if any(value is not None for value in numbers):
+                arrays.update(self.number_arrays("memo_number:"+k,numbers))
+                arrays["memo_number_unit:"+k] = self.string_array([value[1] if type(value) is tuple else None for value in memo_values])
+        table = pa.table(arrays)
+        return table.replace_schema_metadata(self.get_metadata("records"))
+
+    def tb_to_table(self,start_datetime=None,end_datetime=None,rec_cond_func=None):
+        # tb_to_dfと同じ列
+        tb = self.ledgers.get_tb(start_datetime,end_datetime,rec_cond_func)
+        keys = list(tb.keys())
+        arrays = {}
+        for i,name in enumerate(("account","sub_account","item")):
+            arrays[name] = self.string_array([key[i] for key in keys])
+        for name in LedgersExcelExporter.tb_key_list[3:]:
+            arrays.update(self.number_arrays(name,[tb[key].get(name,None) for key in keys]))
+        return self.pa.table(arrays).replace_schema_metadata(self.get_metadata("tb"))
+
+    def ledger_to_table(self,account,sub_account=None,item=None):
+        # simple_ledger_to_dfと同じ列（datetimeはtimestamp）
+        lgs = self.ledgers
+        key_list = LedgersExcelExporter.ledger_key_list if item is None else LedgersExcelExporter.item_ledger_key_list
+        records = lgs.get_records(account,sub_account,item)
+        arrays = {}
+        for name in key_list:
+            values = [record.get(name,None) for record in records]
+            if name=="datetime":
+                arrays[name] = self.timestamp_array(values)
+            elif name in self.int_keys:
+                arrays[name] = self.pa.array(values,type=self.pa.int64())
+            elif name in self.number_keys:
+                arrays.update(self.number_arrays(name,[self.from_fixed_point(name,value) for value in values]))
+            else:
+                arrays[name] = self.string_array(values)
+        return self.pa.table(arrays).replace_schema_metadata(self.get_metadata("ledger"))
+
+    def write_table(self,table,filename,format=None):
+        if self.get_format(filename,format)=="arrow":
+            with self.pa.ipc.new_file(filename,table.schema) as writer:
+                writer.write_table(table)
+        else:
+            self.pa.parquet.write_table(table,filename)
+        return filename
+
+    def read_table(self,filename,format=None):
+        if self.get_format(filename,format)=="arrow":
+            with self.pa.ipc.open_file(filename) as reader:
+                return reader.read_all()
+        return self.pa.parquet.read_table(filename)
+
+    def save_records(self,filename,format=None):
+        return self.write_table(self.records_to_table(),filename,format)
+
+    def save_tb(self,filename,start_datetime=None,end_datetime=None,rec_cond_func=None,format=None):
+        return self.write_table(self.tb_to_table(start_datetime,end_datetime,rec_cond_func),filename,format)
+
+    def save_ledger(self,filename,account,sub_account=None,item=None,format=None):
+        return self.write_table(self.ledger_to_table(account,sub_account,item),filename,format)
+
+    def load_ledgers(self,filename,format=None):
+        # save_recordsで書き出したファイルからLedgersを作成する（recalc_allは不要）
+        table = self.read_table(filename,format)
+        metadata = json.loads((table.schema.metadata or {}).get(self.metadata_key,b"{}").decode("utf-8"))
+        if metadata.get("kind",None)!="records":
+            raise ValueError("load_ledgers: '%s' is not a records file." % filename)
+        lgs = self.metadata_to_ledgers(metadata)
+        fixed_point = lgs.fixed_point
+        self.ledgers = lgs
+        # 列ごとに、recordのどこに入れるかを先に決める
+        fields = [] ## (key,値のリスト,Noneでもkeyを作るか)
+        ops = [] ## (key,OP_***のリスト)
+        memo_strs = [] ## (memoのkey,値のリスト)
+        memo_numbers = [] ## (memoのkey,数値のリスト,単位のリスト)
+        for name in table.column_names:
+            if name=="datetime" or name.startswith("memo_number_unit:"):
+                continue
+            values = table.column(name).to_pylist()
+            if name=="datetime_str":
+                fields.append(("datetime",values,False))
+            elif name.startswith("memo_str:"):
+                memo_strs.append((name[len("memo_str:"):],values))
+            elif name.startswith("memo_number:"):
+                memo_key = name[len("memo_number:"):]
+                memo_numbers.append((memo_key,values,table.column("memo_number_unit:"+memo_key).to_pylist()))
+            elif name.endswith("_op"):
+                ops.append((name[:-len("_op")],values))
+            else:
+                kind = self.fixed_point_keys.get(name,None)
+                if fixed_point is not None and kind=="quantity":
+                    values = [fixed_point.to_quantity(value) for value in values]
+                elif fixed_point is not None and kind=="amount":
+                    values = [fixed_point.to_amount(value) for value in values]
+                fields.append((name,values,name in self.always_keys))
+        records = []
+        for i in range(table.num_rows):
+            record = {}
+            for name,values,always in fields:
+                value = values[i]
+                if value is not None or always:
+                    record[name] = value
+            for name,values in ops:
+                if values[i] is not None:
+                    record[name] = values[i]
+            memo = {}
+            memo_str = {}
+            memo_number = {}
+            memo_number_unit = {}
+            for memo_key,values in memo_strs:
+                if values[i] is not None:
+                    memo[memo_key] = values[i]
+                    memo_str[memo_key] = values[i]
+            for memo_key,values,units in memo_numbers:
+                if values[i] is not None:
+                    memo[memo_key] = (values[i],units[i])
+                    memo_number[memo_key] = values[i]
+                    memo_number_unit[memo_key] = units[i]
+            record["memo"] = memo
+            record["memo_str"] = memo_str
+            record["memo_number"] = memo_number
+            if len(memo_number_unit)>0:
+                record["memo_number_unit"] = memo_number_unit
+            records.append(record)
+        lgs.records = records
+        lgs.version += 1
+        return lgs
+
+class LedgersCSVExporter:
+    """
+    Ledgersのrecords・元帳のrecord・試算表をCSV（又はTSV）に書き出す
+    chunk_size行ずつ書き出すので、recordsの数によらずメモリは一定
+    ファイル名が .tsv（.tsv.gz）の場合はタブ区切り、.gz の場合（又はcompress=True）はgzipで圧縮する
+    """
+
+    def __init__(self,ledgers,chunk_size=10000,delimiter=None,encoding="utf-8",compress=None):
+        self.ledgers = ledgers
+        self.chunk_size = chunk_size
+        self.delimiter = delimiter ## Noneの場合はファイル名で決める
+        self.encoding = encoding
+        self.compress = compress ## Noneの場合はファイル名で決める
+
+    def open(self,filename):
+        compress = self.compress
+        if compress is None:
+            compress = str(filename).endswith(".gz")
+        if compress:
+            return gzip.open(filename,"wt",encoding=self.encoding,newline="")
+        return open(filename,"w",encoding=self.encoding,newline="")
+
+    def get_delimiter(self,filename):
+        if self.delimiter is not None:
+            return self.delimiter
+        name = str(filename)
+        if name.endswith(".gz"):
+            name = name[:-3]
+        if name.endswith(".tsv"):
+            return "\t"
+        return ","
+
+    def to_csv_value(self,value):
+        # None・NaNは空欄
+        if value is None:
+            return ""
+        if type(value) is float and math.isnan(value):
+            return ""
+        return value
+
+    def write_rows(self,filename,header,rows):
+        # rowsをchunk_size行ずつ書き出す　戻り値 書き出した行数
+        n_rows = 0
+        to_csv_value = self.to_csv_value
+        with self.open(filename) as f:
+            writer = csv.writer(f,delimiter=self.get_delimiter(filename))
+            writer.writerow(header)
+            chunk = []
+            for row in rows:
+                chunk.append([to_csv_value(value) for value in row])
+                if len(chunk) >= self.chunk_size:
+                    writer.writerows(chunk)
+                    n_rows += len(chunk)
+                    chunk = []
+            writer.writerows(chunk)
+            n_rows += len(chunk)
+        return n_rows
+
+    def get_memo_keys(self,records):
+        # get_record_dfと同じ順（memo_strのkey、memo_numberのkeyの順に、はじめて現れた順）
+        memo_str_keys = {}
+        memo_number_keys = {}
+        for record in records:
+            memo_str = record.get("memo_str",None)
+            if memo_str:
+                for k in memo_str:
+                    memo_str_keys[k] = True
+            memo_number = record.get("memo_number",None)
+            if memo_number:
+                for k in memo_number:
+                    memo_number_keys[k] = True
+        return list(memo_str_keys),list(memo_number_keys)
+
+    def iter_record_rows(self,records,memo_str_keys,memo_number_keys):
+        # get_record_dfの1行分（dictの列は文字列表現）
+        fixed_point = self.ledgers.fixed_point
+        key_list = RecordColumns.key_list
+        for record in records:
+            row = []
+            for key in key_list:
+                value = record.get(key,None)
+                if fixed_point is not None:
+                    if key=="dr_quantity" or key=="cr_quantity":
+                        value = fixed_point.from_quantity(value)
+                    elif key=="dr_amount" or key=="cr_amount":
+                        value = fixed_point.from_amount(value)
+                if type(value) is dict:
+                    value = str(value)
+                row.append(value)
+            memo_str = record.get("memo_str",None) or {}
+            row += [memo_str.get(k,None) for k in memo_str_keys]
+            memo_number = record.get("memo_number",None) or {}
+            row += [memo_number.get(k,None) for k in memo_number_keys]
+            yield row
+
+    def save_records(self,filename,records=None):
+        # recordsをget_record_dfと同じ列の順で書き出す（recordsを省略した場合はすべて）
+        if records is None:
+            records = self.ledgers.records
+        memo_str_keys,memo_number_keys = self.get_memo_keys(records)
+        header = RecordColumns.key_list+memo_str_keys+memo_number_keys
+        return self.write_rows(filename,header,self.iter_record_rows(records,memo_str_keys,memo_number_keys))
+
+    def save_ledger_records(self,filename,account,sub_account=None,item=None):
+        # get_recordsのrecordを書き出す
+        return self.save_records(filename,self.ledgers.get_records(account,sub_account,item))
+
+    def save_tb(self,filename,start_datetime=None,end_datetime=None,rec_cond_func=None):
+        # tb_to_dfと同じ列
+        tb = self.ledgers.get_tb(start_datetime,end_datetime,rec_cond_func)
+        rows = ([k[0],k[1],k[2]]+[v.get(key,None) for key in LedgersExcelExporter.tb_key_list[3:]] for k,v in tb.items())
+        return self.write_rows(filename,LedgersExcelExporter.tb_key_list,rows)
+
+    def save_tb_grouped(self,filename,tb_grouped,group_names=("group",)):
+        # {group:tb}（get_tb_grouped、get_tb_with_partnerなど）を group×項目ごとに1行で書き出す
+        # groupがtupleの場合（tb_cubeなど）はgroup_namesの列に分ける
+        tb_key_list = LedgersExcelExporter.tb_key_list
+        def iter_rows():
+            for group,tb in tb_grouped.items():
+                group_values = list(group) if type(group) is tuple else [group]
+                for k,v in tb.items():
+                    yield group_values+[k[0],k[1],k[2]]+[v.get(key,None) for key in tb_key_list[3:]]
+        return self.write_rows(filename,list(group_names)+tb_key_list,iter_rows())
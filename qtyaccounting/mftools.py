@@ -4,7 +4,9 @@
 # QTYAccounting is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 # You should have received a copy of the GNU General Public License along with QTYAccounting. If not, see <https://www.gnu.org/licenses/>.
 import os
-from .qtytools import InterpretBaseTree,JournalDicToText,QTYJournalToTree,InterpretJournalTree,QTYJournalDicToTree
+import io
+import csv
+from .qtytools import InterpretBaseTree,JournalDicToText,QTYJournalToTree,InterpretJournalTree,QTYJournalDicToTree,InterpretJournalDic
 from pathlib import Path
 from lark import Lark
 
@@ -64,6 +66,11 @@ class  CSVTreeToJournalDic(InterpretBaseTree):
         journal_dic = self.visit(csv_tree)
         journal_text = JournalDicToText().get_text_from_journal_dic(journal_dic)
         return journal_text
+
+    def save_journal_text(self,csv_tree,filename=None):
+        #仕訳ごとにファイルに書き出す
+        journal_dic = self.visit(csv_tree)
+        return JournalDicToText().save_journal_text(journal_dic,filename)
     
     def get_heading(self,index):
         if index < len(self.csv_header):
@@ -178,17 +185,20 @@ class  CSVTreeToJournalDic(InterpretBaseTree):
         
     def start(self,tree):
         #start: header _NL row+
-        data =[]
         #header
         self.csv_header = self.visit(tree.children[0])
 
         #row
+        return self.get_journal_dic_from_rows(self.visit(c) for c in tree.children[1:])
+
+    def get_journal_dic_from_rows(self,row_dics):
+        #取引Noが同じ行をまとめて仕訳にする
+        data =[]
         last_entry_id=None
         entry_dic = {"entry_header":{"entry_id":None},"body":[],"entry_footer":{}}
         something_in_entry_dic = False
         
-        for c in tree.children[1:]:
-            row_dic = self.visit(c)
+        for row_dic in row_dics:
             #print(row_dic)
             entry_id = row_dic["entry_header"]["entry_id"]
             if entry_id is None:
@@ -218,7 +228,7 @@ class  CSVTreeToJournalDic(InterpretBaseTree):
         
     def row(self,tree):
         #row: ("\"" [contents tekiyou contents] "\"" _SEPARATOR?)+ _NL
-        row_dic = {"entry_header":{"entry_id":None,"datetime":None,"memo":{}},"body":[{"debit":{"account":None,"sub_account":None,"amount":None,"memo":{}}},{"credit":{"account":None,"sub_account":None,"amount":None,"memo":{}}}],"entry_footer":{}}
+        cells = []
         num_heading = len(tree.children) // 3
         #print("num_heading",num_heading)
         for i in range(0,num_heading):
@@ -228,60 +238,67 @@ class  CSVTreeToJournalDic(InterpretBaseTree):
             assert c1 is None or c1.data=="tekiyou"
             c2 =  tree.children[i*3+2]
             assert c2 is None or c2.data=="contents"
+            cells.append(tuple(None if c is None else self.visit(c) for c in (c0,c1,c2)))
+        return self.get_row_dic(cells)
+
+    def get_row_dic(self,cells):
+        #cells: 欄ごとの (摘要の前の文字列,摘要の辞書,摘要の後の文字列)　空欄は (None,None,None)
+        row_dic = {"entry_header":{"entry_id":None,"datetime":None,"memo":{}},"body":[{"debit":{"account":None,"sub_account":None,"amount":None,"memo":{}}},{"credit":{"account":None,"sub_account":None,"amount":None,"memo":{}}}],"entry_footer":{}}
+        for i,(c0,c1,c2) in enumerate(cells):
             heading = self.get_heading(i)
             #print()
             if heading=="取引No":
                 assert i == 0
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     row_dic["entry_header"]["entry_id"]=content
                     row_dic["entry_header"]["memo"]["取引No"]=content
             elif heading=="取引日":
                 assert i == 1
                 if c0 is not None:
                     #print("c0",c0)
-                    content = self.visit(c0)
+                    content = c0
                     #print("content",content)
                     datetime_str = content.replace('/', '-')
                     row_dic["entry_header"]["datetime"]=datetime_str
             elif heading=="借方勘定科目":
                 assert i == 2
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     row_dic["body"][0]["debit"]["account"]=content
             elif heading=="借方補助科目":
                 assert i == 3
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     row_dic["body"][0]["debit"]["sub_account"]=content
             elif heading=="借方部門":
                 assert i == 4
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     content = self.safe_trans(content)
                     row_dic["body"][0]["debit"]["memo"]["借方部門"]=content
             elif heading=="借方取引先":
                 assert i == 5
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     content = self.safe_trans(content)
                     row_dic["body"][0]["debit"]["partner"]=content
             elif heading=="借方税区分":
                 assert i == 6
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     content = self.safe_trans(content)
                     row_dic["body"][0]["debit"]["memo"]["借方税区分"]=content
             elif heading=="借方インボイス":
                 assert i == 7
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     content = self.safe_trans(content)
                     row_dic["body"][0]["debit"]["memo"]["借方インボイス"]=content
             elif heading=="借方金額(円)":
                 assert i == 8
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     if "." in content:
                         contnt_number = float(content)
                     else:
@@ -295,47 +312,47 @@ class  CSVTreeToJournalDic(InterpretBaseTree):
             elif heading=="借方税額":
                 assert i == 9
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     content_int = int(content)
                     row_dic["body"][0]["debit"]["memo"]["借方税額"]=content_int
                     row_dic["body"][0]["debit"]["memo"]["借方税額単位"]="円"             
             elif heading=="貸方勘定科目":
                 assert i == 10
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     row_dic["body"][1]["credit"]["account"]=content
             elif heading=="貸方補助科目":
                 assert i == 11
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     row_dic["body"][1]["credit"]["sub_account"]=content
             elif heading=="貸方部門":
                 assert i == 12
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     content = self.safe_trans(content)
                     row_dic["body"][1]["credit"]["memo"]["貸方部門"]=content
             elif heading=="貸方取引先":
                 assert i == 13
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     row_dic["body"][1]["credit"]["partner"]=content
             elif heading=="貸方税区分":
                 assert i == 14
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     content = self.safe_trans(content)
                     row_dic["body"][1]["credit"]["memo"]["貸方税区分"]=content
             elif heading=="貸方インボイス":
                 assert i == 15
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     content = self.safe_trans(content)
                     row_dic["body"][0]["debit"]["memo"]["貸方インボイス"]=content
             elif heading=="貸方金額(円)":
                 assert i == 16
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     if "." in content:
                         contnt_number = float(content)
                     else:
@@ -348,7 +365,7 @@ class  CSVTreeToJournalDic(InterpretBaseTree):
             elif heading=="貸方税額":
                 assert i == 17
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     content_int = int(content)
                     row_dic["body"][1]["credit"]["memo"]["貸方税額"]=content_int
                     row_dic["body"][1]["credit"]["memo"]["貸方税額単位"]="円"
@@ -357,18 +374,18 @@ class  CSVTreeToJournalDic(InterpretBaseTree):
                 assert i == 18
                 remarks =""
                 if c0 is not None:
-                    remarks0 = self.visit(c0)
+                    remarks0 = c0
                     if remarks0 is not None:
                         remarks += remarks0
 
                 if c1 is not None:    
-                    tekiyou = self.visit(c1)
+                    tekiyou = c1
                     if tekiyou is not None:
                         #print("tekiyou",tekiyou)
                         row_dic= self.mearge_tekiyou(row_dic,tekiyou)
                         
                 if c2 is not None:            
-                    remarks2 = self.visit(c2)
+                    remarks2 = c2
                     if remarks2 is not None:
                         remarks += remarks2
                 remarks = self.safe_trans(remarks)        
@@ -381,18 +398,18 @@ class  CSVTreeToJournalDic(InterpretBaseTree):
                 #仕訳メモ は仕訳全体に対するものだが、各行に同じ内容が記載される
                 remarks =""
                 if c0 is not None:
-                    remarks0 = self.visit(c0)
+                    remarks0 = c0
                     if remarks0 is not None:
                         remarks += remarks0
 
                 if c1 is not None:    
-                    tekiyou = self.visit(c1)
+                    tekiyou = c1
                     if tekiyou is not None:
                         #print("tekiyou",tekiyou)
                         row_dic= self.mearge_tekiyou(row_dic,tekiyou)
                         
                 if c2 is not None:            
-                    remarks2 = self.visit(c2)
+                    remarks2 = c2
                     if remarks2 is not None:
                         remarks += remarks2
                         
@@ -404,7 +421,7 @@ class  CSVTreeToJournalDic(InterpretBaseTree):
                 #タグ は仕訳全体に対するものだが、各行に同じ内容が記載される
                 #タグがある場合は、キーがタグ名のメモを作成し、値を"1"とする。
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     if content is not None and len(content)>0:
                         tags = content.split("|")
                         for tag in tags:
@@ -413,40 +430,40 @@ class  CSVTreeToJournalDic(InterpretBaseTree):
             elif heading=="MF仕訳タイプ":
                 assert i == 21
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     if content=="開始仕訳":
                         row_dic["entry_header"]["memo"]["KIND"]="OPENING"
             elif heading=="決算整理仕訳":
                 assert i == 22
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     if content=="1":
                         row_dic["entry_header"]["memo"]["KIND"]="ADJUSTING"
             elif heading=="作成日時":
                 assert i == 23
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     content = self.safe_trans(content)
                     row_dic["entry_header"]["memo"]["作成日時"]=content
             elif heading=="作成者":
                 assert i == 24
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     row_dic["entry_header"]["memo"]["作成者"]=content
             elif heading=="最終更新日時":
                 assert i == 25
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     content = self.safe_trans(content)
                     row_dic["entry_header"]["memo"]["最終更新日時"]=content
             elif heading=="最終更新者":
                 assert i == 26
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     row_dic["entry_header"]["memo"]["最終更新者"]=content
             else:
                 if c0 is not None:
-                    content = self.visit(c0)
+                    content = c0
                     row_dic["entry_header"]["memo"][heading]=content
         #print(row_dic)
         return row_dic
@@ -522,6 +539,79 @@ class  CSVTreeToJournalDic(InterpretBaseTree):
             return ""
         return tree.children[0].value
 
+class MfCSVToJournalDic(CSVTreeToJournalDic):
+    """
+    マネーフォワードのCSVファイルから仕訳の辞書を作成する（CSVTreeToJournalDicと同じ結果）
+    行と欄の分割は標準のcsvモジュールで行い、Larkでは摘要欄の<<...>>の部分のみを解析する
+    """
+    tekiyou_ignore_str = r"""
+        %ignore WS3
+        """
+
+    def __init__(self):
+        super().__init__()
+        self.tekiyou_parser_lalr = Lark(MfCSVToCSVTree.tekiyou_def_str+self.tekiyou_ignore_str+QTYJournalToTree.lark_def_str+QTYJournalToTree.datetime_def_str,start ="tekiyou",parser='lalr',maybe_placeholders=True)
+        self.tekiyou_trees = {} ## 摘要の文字列 -> 構文木（同じ摘要は一度だけ解析する）
+        self.max_tekiyou_trees = 10000 ## 構文木を残す数の上限　超えたら捨てる
+
+    def get_tekiyou(self,tekiyou_text):
+        #<<...>> -> {"tekiyou_entry":...}
+        #構文木は使い回し、辞書は毎回作る（行ごとに書き換えられるため）
+        tekiyou_tree = self.tekiyou_trees.get(tekiyou_text,None)
+        if tekiyou_tree is None:
+            tekiyou_tree = self.tekiyou_parser_lalr.parse(tekiyou_text)
+            if len(self.tekiyou_trees) >= self.max_tekiyou_trees:
+                self.tekiyou_trees.clear()
+            self.tekiyou_trees[tekiyou_text] = tekiyou_tree
+        return self.visit(tekiyou_tree)
+
+    def get_cells(self,fields):
+        #欄ごとに (摘要の前の文字列,摘要の辞書,摘要の後の文字列)　空欄は (None,None,None)
+        cells = []
+        for field in fields:
+            if len(field)==0:
+                cells.append((None,None,None))
+                continue
+            start = field.find("<<")
+            if start < 0:
+                cells.append((field,{"tekiyou_entry":None},""))
+                continue
+            end = field.find(">>",start)
+            end = len(field) if end < 0 else end+2
+            next_start = field.find("<<",end)
+            if next_start >= 0:
+                #<<...>>が2つ以上ある欄は、CSV全体をLarkで解析する場合と同じくエラー（2つ目の<<でUnexpectedToken）にする
+                self.get_tekiyou(field[start:end]+field[next_start:])
+            cells.append((field[:start],self.get_tekiyou(field[start:end]),field[end:]))
+        return cells
+
+    def iter_row_dics(self,csv_lines):
+        reader = csv.reader(csv_lines)
+        self.csv_header = next(reader,[])
+        for fields in reader:
+            if len(fields)==0:
+                #空行
+                continue
+            yield self.get_row_dic(self.get_cells(fields))
+
+    def translate(self,csv_text):
+        return self.get_journal_dic_from_rows(self.iter_row_dics(io.StringIO(csv_text,newline="")))
+
+    def translate_file(self,filename=None):
+        if filename is None:
+            filename = os.path.join(Path().resolve(), MfCSVToCSVTree.default_mf_csv_filename)
+        with open(filename, 'r', newline="", encoding='shift_jis') as f:
+            journal_dic = self.get_journal_dic_from_rows(self.iter_row_dics(f))
+        return journal_dic
+
+    def get_journal_text_from_file(self,filename=None):
+        journal_dic = self.translate_file(filename)
+        return JournalDicToText().get_text_from_journal_dic(journal_dic)
+
+    def save_journal_text_from_file(self,filename=None,journal_filename=None):
+        journal_dic = self.translate_file(filename)
+        return JournalDicToText().save_journal_text(journal_dic,journal_filename)
+
 def main():
     #sample_file_name = "mfsample.csv"
     #file_path  = os.path.join(Path().resolve(), sample_file_name)
@@ -532,15 +622,18 @@ def main():
     #csv_tree　-> journal_dic  -> ledgers
     journal_dic = CSVTreeToJournalDic().visit(csv_tree)
     #print(journal_dic)
-    journal_tree = QTYJournalDicToTree().translate(journal_dic)
-    print(journal_tree)
+    ledgers = InterpretJournalDic().get_ledgers(journal_dic)
+
+    #csv_tree　-> journal_dic  -> journal_tree -> ledgers
+    #journal_tree = QTYJournalDicToTree().translate(journal_dic)
+    #print(journal_tree)
 
     #csv_tree　-> journal_text  -> ledgers
     #journal_text = CSVTreeToJournalDic().get_journal_text(csv_tree)
     #print(journal_text)
     #journal_tree = QTYJournalToTree().translate(journal_text)
 
-    ledgers =InterpretJournalTree().get_ledgers(journal_tree)
+    #ledgers =InterpretJournalTree().get_ledgers(journal_tree)
     #df = ledgers.simple_ledger_to_df("商品","","Tシャツ")
     #print(df)
     #ledgers.simple_ledger_to_excel("商品","","Tシャツ")
@@ -548,4 +641,4 @@ def main():
     ledgers.tb_to_excel(start_datetime="2022-05-01",end_datetime="2023-01-01")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -5,18 +5,29 @@
 # You should have received a copy of the GNU General Public License along with QTYAccounting. If not, see <https://www.gnu.org/licenses/>.
 
 import os
+import sys
 import csv
 import json
 import pandas as pd
+import numpy as np
 import datetime
+import calendar
+import time
 from lark import Lark
 from lark import Transformer
 from lark import Tree,Token
-from itertools import zip_longest
+from itertools import zip_longest,accumulate,chain
 from lark.visitors import Interpreter
 from pathlib import Path
-from collections import deque
+from collections import OrderedDict
+from array import array
+from bisect import bisect_left,bisect_right
+from operator import neg,add,gt
+from functools import reduce
 from ast import literal_eval
+from decimal import Decimal,ROUND_HALF_UP,ROUND_HALF_DOWN,ROUND_HALF_EVEN,ROUND_DOWN,ROUND_UP,ROUND_FLOOR,ROUND_CEILING
+from fractions import Fraction
+from math import frexp,ldexp,log2
 
 class QTYJournalToTree:
     """
@@ -414,6 +425,74 @@ class CalculateTree(Transformer):
         value = children[0].value
         return value
     
+class JournalJSONLines:
+    # journal_dicをJSON Lines（1行に1つのjournal_entryまたはtext）で保存・読み込みするためのクラス
+    # 保存時に各行の先頭のバイト位置の索引（<filename>.idx　int64の配列、最後はファイルの大きさ）を作成する
+    def __init__(self,filename=None):
+        if filename is None:
+            filename = os.path.join(Path().resolve(),"QTYjournalDic.jsonl")
+        self.filename = filename
+        self.index_filename = filename+".idx"
+        self.offsets = None ## 各行の先頭のバイト位置（最後はファイルの大きさ）
+
+    def write(self,elements):
+        # elements journal_dic["journal"]の要素（journal_entryのdictまたはtext）のiterable　順に1行ずつ書き出す
+        offsets = [0]
+        with open(self.filename,"wb") as f:
+            for element in elements:
+                line = (json.dumps(element,ensure_ascii=False)+"\n").encode("utf-8")
+                f.write(line)
+                offsets.append(offsets[-1]+len(line))
+        np.array(offsets,dtype=np.int64).tofile(self.index_filename)
+        self.offsets = offsets
+        return len(offsets)-1
+
+    def get_offsets(self):
+        # 索引を読み込む　索引がない・ファイルの大きさが違う場合は、ファイルを読んで作り直す
+        if self.offsets is None:
+            size = os.path.getsize(self.filename)
+            offsets = None
+            if os.path.exists(self.index_filename):
+                offsets = np.fromfile(self.index_filename,dtype=np.int64).tolist()
+                if not offsets or offsets[-1] != size:
+                    offsets = None
+            if offsets is None:
+                offsets = [0]
+                with open(self.filename,"rb") as f:
+                    for line in f:
+                        offsets.append(offsets[-1]+len(line))
+                np.array(offsets,dtype=np.int64).tofile(self.index_filename)
+            self.offsets = offsets
+        return self.offsets
+
+    def __len__(self):
+        return len(self.get_offsets())-1
+
+    def iter_elements(self,start=0,stop=None):
+        # start番目からstop番目の前までの要素を順に読み込む（start>0の場合は索引で位置を移動する）
+        with open(self.filename,"rb") as f:
+            if start > 0:
+                offsets = self.get_offsets()
+                if start >= len(offsets)-1:
+                    return
+                f.seek(offsets[start])
+            for i,line in enumerate(f,start):
+                if stop is not None and i >= stop:
+                    break
+                if line.strip():
+                    yield json.loads(line)
+
+    def __getitem__(self,i):
+        # i番目の要素（索引で位置を移動して1行だけ読む）
+        offsets = self.get_offsets()
+        if i < 0:
+            i += len(offsets)-1
+        if i < 0 or i >= len(offsets)-1:
+            raise IndexError("JournalJSONLines: index %d out of range" % i)
+        with open(self.filename,"rb") as f:
+            f.seek(offsets[i])
+            return json.loads(f.read(offsets[i+1]-offsets[i]))
+
 class QTYJournalTreeToDic(CalculateTree):
     # Journalやjournal_entryを変換するためのクラス
     def __init__(self):
@@ -423,6 +502,7 @@ class QTYJournalTreeToDic(CalculateTree):
         #self.debit_line_no = 0 #行番号
         #self.credit_line_no = 0 #行番号
         self.default_json_filename="QTYjournalDic.json"
+        self.default_jsonl_filename="QTYjournalDic.jsonl"
         
     def save_json(self,tree_journal,filename=None):
         
@@ -434,6 +514,20 @@ class QTYJournalTreeToDic(CalculateTree):
         
         with open(filename, 'w', newline=None,encoding='utf-8') as f:
             json.dump(journal_dic,f,ensure_ascii=False,indent=2)
+
+    def iter_journal_elements(self,tree_journal):
+        # journalの子（journal_entry・text）を1つずつ変換する（journal全体のdictは作らない）
+        for child in tree_journal.children:
+            if isinstance(child,Tree):
+                yield self.transform(child)
+            else:
+                yield child
+
+    def save_jsonl(self,tree_journal,filename=None):
+        # JSON Lines形式で保存する（1行に1つのjournal_entryまたはtext）　書き出した行数を返す
+        if filename is None:
+            filename = os.path.join(Path().resolve(), self.default_jsonl_filename)
+        return JournalJSONLines(filename).write(self.iter_journal_elements(tree_journal))
             
     #    def load_json(self,filename=None):
     #        if filename is None:
@@ -596,6 +690,7 @@ class AccountInfo:
         self.default_side ="Dr" # 借方・貸方を指定しない場合
         self.default_prop={"method":"LPC","side":"Dr","tax_cat":"UNDEFINED","disp_cat":"UNDEFINED"}
         self.item_info = {}
+        self.version = 0 ## 設定を変更するたびに増える（Ledgersのキャッシュの無効化に使用）
         #key:(account,sub_account,item) sub_accountを指定しない場合は"" itemを指定しない場合は""
         #value:{"side":side,"method":method,"tax_cat":tax_cat,"disp_cat":disp_cat} 
         self.load()
@@ -690,10 +785,12 @@ class AccountInfo:
         if disp_cat is not None:
             updated_info = {"disp_cat":disp_cat}
             self.item_info[(account,sub_account,item)].update(updated_info)
+        self.version += 1
         #print(self.item_info)
         
     def remove_item_info_all(self,account,sub_account,item):
         self.item_info[(account,sub_account,item)]={}
+        self.version += 1
 
     def load(self,filename=None):
         if filename is None:
@@ -730,13 +827,14 @@ class AccountInfo:
                 writer.writerow({'account':account, 'sub_account':sub_account,'item':item,'side':item_info.get("side",''),'method':item_info.get("method",''),'tax_cat':item_info.get("tax_cat",''),'disp_cat':item_info.get("disp_cat",'')})
 
 class Ledger:
-    def __init__(self,account,sub_account=None,item=None,records=None):
+    def __init__(self,account,sub_account=None,item=None,records=None,fixed_point=None):
         #account is required.
             self.account = account
             self.sub_account = sub_account
             self.item = item
             self.records = records
             self.accInfo = AccountInfo()
+            self.fixed_point = fixed_point ## FixedPoint 指定した場合、払出し価格はFractionで返す
     def get_all_in_quantity(self):
         #入庫数量の合計を返す  
         
@@ -825,7 +923,10 @@ class Ledger:
         #print("all_out_quantity",all_out_quantity)
         
         stock_quantity = all_in_quantity - all_out_quantity
-        stock_amount = stock_quantity*last_in_amount/last_in_quantity
+        if self.fixed_point is None:
+            stock_amount = stock_quantity*last_in_amount/last_in_quantity
+        else:
+            stock_amount = stock_quantity*Fraction(last_in_amount,last_in_quantity)
 
         out_amount = all_in_amount-stock_amount
         out_quantity = all_in_quantity - stock_quantity
@@ -833,7 +934,10 @@ class Ledger:
         if out_quantity==0:
             return None
 
-        out_price = out_amount/out_quantity
+        if self.fixed_point is None:
+            out_price = out_amount/out_quantity
+        else:
+            out_price = Fraction(out_amount)/out_quantity
 
         return out_price
 
@@ -846,7 +950,10 @@ class Ledger:
         if all_in_quantity==0:
             return None
         
-        out_price = all_in_amount/all_in_quantity
+        if self.fixed_point is None:
+            out_price = all_in_amount/all_in_quantity
+        else:
+            out_price = Fraction(all_in_amount,all_in_quantity)
                                 
         #all_out_quantity = self.get_all_out_quantity()
 
@@ -862,17 +969,163 @@ class Ledger:
         #out_price = out_amount/out_quantity
         return out_price
 
+class CostFlowIndex:
+    # 払出し(issue)と、その払出しに充てられた受入(receipt)の対応
+    # issue,receiptは整数の参照（Ledgers.recalc_allではrecordのindex）
+    # 数量、金額は在庫の向き（ItemQueueFIFO,ItemQueueMAに入れた符号）で記録する
+    #
+    # 先入先出法：取り出した層ごとに(issue,receipt,数量,金額)を記録する
+    #   recalc_allはrecordの順に処理するので、issueの昇順に並ぶ
+    #   receiptの順の並びは、get_issuesで必要になったときに作る
+    # 移動平均法：払出しのたびに全ての受入への按分を記録すると件数が膨らむので、
+    #   在庫に対する払出しの割合(fraction)と、それまでの残存割合の積(survival)だけを記録する
+    #   受入rのうち払出しiに充てられた割合 = survival_i / survival_r * fraction_i
+    #   在庫を全て払い出した場合は、そこで区切る（それ以前の受入は、以後の払出しに充てられない）
+    #   survivalは長い履歴でアンダーフローしないように、仮数と指数(frexp)に分けて持つ
+    #   survival_i / survival_r < ma_min_share の受入は、払出しに充てられていないものとして扱う
+    #   fractionが0以上1以下の間はsurvivalが減るだけなので、その範囲を二分探索して読み飛ばす
+    #   （fraction<0の払出しがあると、それより前の受入は読み飛ばさない）
+    ma_min_share_exp = -64 ## ma_min_share = 2**ma_min_share_exp
+    def __init__(self):
+        self.fifo_issues=array('q')
+        self.fifo_receipts=array('q')
+        self.fifo_quantities=[]
+        self.fifo_amounts=[]
+        self.fifo_by_receipt=array('q') ## fifo_*のindexをreceiptの順に並べたもの
+        self.fifo_receipts_sorted=array('q')
+        self.ma_state={} ## key:(account,sub_account,item) value:[survivalの仮数,survivalの指数,区切り後の最初の受入の位置,survivalが減るだけになった最初の受入の位置]
+        self.ma_receipts={} ## key:(account,sub_account,item) value:{"ref":,"quantity":,"amount":,"mantissa":,"exponent":,"neg_log2":}
+        self.ma_issues={} ## key:(account,sub_account,item) value:{"ref":,"mantissa":,"exponent":,"neg_log2":,"fraction":,"start":,"mono":,"end":}
+        self.ma_receipt_refs=array('q')
+        self.ma_receipt_locs=[] ## (key,位置)
+        self.ma_issue_refs=array('q')
+        self.ma_issue_locs=[] ## (key,位置)
+
+    def add_fifo(self,issue,consumed):
+        # consumed: FIFOLayersから取り出した層の[(receipt,数量,金額)]
+        for (receipt,quantity,amount) in consumed:
+            if receipt is None:
+                continue
+            self.fifo_issues.append(issue)
+            self.fifo_receipts.append(receipt)
+            self.fifo_quantities.append(quantity)
+            self.fifo_amounts.append(amount)
+
+    def put_ma(self,key,receipt,quantity,amount):
+        state = self.ma_state.setdefault(key,[0.5,1,0,0])
+        receipts = self.ma_receipts.setdefault(key,{"ref":array('q'),"quantity":[],"amount":[],"mantissa":[],"exponent":array('q'),"neg_log2":[]})
+        self.ma_receipt_refs.append(receipt)
+        self.ma_receipt_locs.append((key,len(receipts["ref"])))
+        receipts["ref"].append(receipt)
+        receipts["quantity"].append(quantity)
+        receipts["amount"].append(amount)
+        receipts["mantissa"].append(state[0])
+        receipts["exponent"].append(state[1])
+        receipts["neg_log2"].append(-state[1]-log2(state[0]))
+
+    def get_ma(self,key,issue,fraction):
+        # fraction: 払出し前の在庫数量に対する払出し数量の割合（1以下）
+        state = self.ma_state.get(key,None)
+        if state is None:
+            return
+        n_receipts = len(self.ma_receipts[key]["ref"])
+        issues = self.ma_issues.setdefault(key,{"ref":array('q'),"mantissa":[],"exponent":array('q'),"neg_log2":[],"fraction":[],"start":array('q'),"mono":array('q'),"end":array('q')})
+        self.ma_issue_refs.append(issue)
+        self.ma_issue_locs.append((key,len(issues["ref"])))
+        issues["ref"].append(issue)
+        issues["mantissa"].append(state[0])
+        issues["exponent"].append(state[1])
+        issues["neg_log2"].append(-state[1]-log2(state[0]))
+        issues["fraction"].append(fraction)
+        issues["start"].append(state[2])
+        issues["mono"].append(state[3])
+        issues["end"].append(n_receipts)
+        survival = state[0]*(1-fraction)
+        if fraction >= 1 or survival <= 0:
+            #全て払い出した場合は区切る
+            state[:] = [0.5,1,n_receipts,n_receipts]
+        else:
+            mantissa,exponent = frexp(survival)
+            state[0] = mantissa
+            state[1] += exponent
+            if fraction < 0:
+                #survivalが増えたので、これまでの受入は読み飛ばさない
+                state[3] = n_receipts
+
+    def get_ma_share(self,issues,k,receipts,r):
+        # 受入rのうち払出しkに充てられた割合
+        return ldexp(issues["mantissa"][k]/receipts["mantissa"][r],issues["exponent"][k]-receipts["exponent"][r])*issues["fraction"][k]
+
+    def get_receipts(self,issue):
+        # 払出しissueに充てられた受入の[(receipt,数量,金額)]
+        res = []
+        lo = bisect_left(self.fifo_issues,issue)
+        hi = bisect_right(self.fifo_issues,issue)
+        for j in range(lo,hi):
+            res.append((self.fifo_receipts[j],self.fifo_quantities[j],self.fifo_amounts[j]))
+        lo = bisect_left(self.ma_issue_refs,issue)
+        hi = bisect_right(self.ma_issue_refs,issue)
+        for j in range(lo,hi):
+            key,pos = self.ma_issue_locs[j]
+            issues = self.ma_issues[key]
+            receipts = self.ma_receipts[key]
+            start = issues["start"][pos]
+            mono = max(start,issues["mono"][pos])
+            end = issues["end"][pos]
+            #mono以降の受入はsurvivalが減っていくだけなので、割合がma_min_share以上になる最初の受入を探す
+            first = bisect_left(receipts["neg_log2"],issues["neg_log2"][pos]+self.ma_min_share_exp,mono,end)
+            for r in chain(range(start,mono),range(first,end)):
+                share = self.get_ma_share(issues,pos,receipts,r)
+                res.append((receipts["ref"][r],receipts["quantity"][r]*share,receipts["amount"][r]*share))
+        return res
+
+    def get_issues(self,receipt):
+        # 受入receiptが充てられた払出しの[(issue,数量,金額)]
+        res = []
+        if len(self.fifo_by_receipt)!=len(self.fifo_receipts):
+            self.fifo_by_receipt = array('q',sorted(range(len(self.fifo_receipts)),key=self.fifo_receipts.__getitem__))
+            self.fifo_receipts_sorted = array('q',[self.fifo_receipts[j] for j in self.fifo_by_receipt])
+        lo = bisect_left(self.fifo_receipts_sorted,receipt)
+        hi = bisect_right(self.fifo_receipts_sorted,receipt)
+        for j in self.fifo_by_receipt[lo:hi]:
+            res.append((self.fifo_issues[j],self.fifo_quantities[j],self.fifo_amounts[j]))
+        lo = bisect_left(self.ma_receipt_refs,receipt)
+        hi = bisect_right(self.ma_receipt_refs,receipt)
+        for j in range(lo,hi):
+            key,pos = self.ma_receipt_locs[j]
+            issues = self.ma_issues.get(key,None)
+            if issues is None:
+                continue
+            receipts = self.ma_receipts[key]
+            #受入後の払出しのうち、区切りまでのもの
+            k = bisect_right(issues["end"],pos)
+            n_issues = len(issues["ref"])
+            while k < n_issues and issues["start"][k] <= pos:
+                if issues["mono"][k] <= pos and issues["neg_log2"][k]-receipts["neg_log2"][pos] > -self.ma_min_share_exp:
+                    #次にsurvivalが増える払出しまでは、割合がma_min_share未満なので読み飛ばす
+                    k = bisect_right(issues["mono"],pos,k)
+                    continue
+                share = self.get_ma_share(issues,k,receipts,pos)
+                res.append((issues["ref"][k],receipts["quantity"][pos]*share,receipts["amount"][pos]*share))
+                k += 1
+        return res
+
 class ItemQueueMA:
     # 移動平均法
-    def __init__(self):
+    def __init__(self,trace=None,fixed_point=None):
         self.quantity_amount={} ## key:(account,sub_account,item) value:(在庫数量,在庫金額)
+        self.trace=trace ## CostFlowIndex 払出しと受入の対応を記録する場合に指定
+        self.fixed_point=fixed_point ## FixedPoint 整数で計算する場合に指定
 
-    def put(self,account,sub_account,item,in_quantity,in_amount):
+    def put(self,account,sub_account,item,in_quantity,in_amount,ref=None):
         #数量、金額として、0やマイナスも許容している
+        #ref: 受入の参照（traceに記録する）
         if in_quantity is None:
             return
         if in_amount is None:
             return
+        if self.trace is not None and ref is not None:
+            self.trace.put_ma((account,sub_account,item),ref,in_quantity,in_amount)
         latest_quantity,latest_amouont = self.quantity_amount.get((account,sub_account,item),(None,None))
         if (latest_quantity is None) or (latest_amouont is None):
             latest_quantity = in_quantity
@@ -882,8 +1135,9 @@ class ItemQueueMA:
             latest_amouont += in_amount
         self.quantity_amount[(account,sub_account,item)]=(latest_quantity,latest_amouont)
 
-    def get(self,account,sub_account,item,out_quantity):
+    def get(self,account,sub_account,item,out_quantity,ref=None):
         # quantity: 取り出したい数量
+        # ref: 払出しの参照（traceに記録する）
         # 戻り値：（取り出した金額,取り出した数量）
         # 考え方　
         # 入っている数量が正の場合：取り出したい数量が入っている数量以下
@@ -907,13 +1161,22 @@ class ItemQueueMA:
             out_quantity = latest_quantity
             out_amount = latest_amouont
             self.quantity_amount[(account,sub_account,item)]=(0,0)
+            if self.trace is not None and ref is not None:
+                self.trace.get_ma((account,sub_account,item),ref,1)
             return out_quantity,out_amount
         if  out_quantity < latest_quantity <= 0:
             out_quantity = latest_quantity
             out_amount = latest_amouont
             self.quantity_amount[(account,sub_account,item)]=(0,0)
+            if self.trace is not None and ref is not None:
+                self.trace.get_ma((account,sub_account,item),ref,1)
             return out_quantity,out_amount        
-        out_amount = latest_amouont / latest_quantity * out_quantity
+        if self.fixed_point is None:
+            out_amount = latest_amouont / latest_quantity * out_quantity
+        else:
+            out_amount = self.fixed_point.div_round(latest_amouont * out_quantity,latest_quantity)
+        if self.trace is not None and ref is not None:
+            self.trace.get_ma((account,sub_account,item),ref,out_quantity/latest_quantity)
         
         latest_quantity -= out_quantity
         latest_amouont -= out_amount
@@ -936,27 +1199,246 @@ class ItemQueueMA:
         
         return out_quantity,out_amount
     
+class FIFOLayers:
+    # 先入先出法の在庫の層（１つの(account,sub_account,item)分）
+    # 層の数量・金額を並列の配列で保持し、headより前の層は払出し済みとする
+    # 一部だけ払い出した層は、残りの数量・金額でその場で書き換え、headとする
+    #
+    # 二分探索用に、層の累計を先頭に0を置いた配列（長さ 層の数+1）で保持する
+    # cum_quantities,cum_amounts: 整数の数量・金額のみの累計（整数でないものは0として累計）
+    # 累計の差は整数どうしの計算となるので、１層ずつ足し合わせた場合と結果が一致する
+    # 累計が使えるかどうかは、整数でない数量・金額、負・正の数量の層の最後のindexで判断する
+    #
+    # refs: 層ごとの受入の参照（Ledgers.recalc_allではrecordのindex）
+    # consumedをlistにしておくと、取り出した層の(ref,数量,金額)が追加される
+
+    # 払出し済みの層がこの数を超え、かつ全体の半分以上になったら詰める
+    compact_threshold = 1024
+    # 累計（二分探索）を使う前に、古い層から順に取り出してみる層の数
+    sequential_limit = 16
+
+    def __init__(self,fixed_point=None):
+        self.fixed_point=fixed_point ## FixedPoint 層を分割するときの丸め
+        self.quantities=[]
+        self.amounts=[]
+        self.refs=[]
+        self.consumed=None
+        self.cum_quantities=[0]
+        self.cum_amounts=[0]
+        self.last_not_int_quantity=-1
+        self.last_not_int_amount=-1
+        self.last_negative=-1
+        self.last_positive=-1
+        self.head=0
+
+    def __len__(self):
+        #払い出されていない層の数
+        return len(self.quantities)-self.head
+
+    def put(self,in_quantity,in_amount,ref=None):
+        # 累計はまとめて取り出すときに更新する(update_cum)
+        n = len(self.quantities)
+        self.quantities.append(in_quantity)
+        self.amounts.append(in_amount)
+        self.refs.append(ref)
+        if type(in_quantity) is not int:
+            self.last_not_int_quantity = n
+        if type(in_amount) is not int:
+            self.last_not_int_amount = n
+        if in_quantity < 0:
+            self.last_negative = n
+        elif in_quantity > 0:
+            self.last_positive = n
+
+    def update_cum(self):
+        # 累計が作られていない層の分を追加する
+        start = len(self.cum_quantities)-1
+        if start==len(self.quantities):
+            return
+        self.cum_quantities += accumulate([q if type(q) is int else 0 for q in self.quantities[start:]],initial=self.cum_quantities[-1])
+        self.cum_quantities.pop(start)
+        self.cum_amounts += accumulate([a if type(a) is int else 0 for a in self.amounts[start:]],initial=self.cum_amounts[-1])
+        self.cum_amounts.pop(start)
+
+    def get(self,quantity):
+        # ItemQueueFIFO.get と同じ（層が空でなく、quantityが0でない場合のみ呼ばれる）
+        # 数層で足りる場合は、累計を使わずに古い層から順に取り出す
+        result = self.get_sequential(quantity,self.sequential_limit)
+        if result is not None:
+            return result
+        k = self.find_last_layer(quantity)
+        if k is None:
+            return self.get_sequential(quantity)
+        head = self.head
+        n = len(self.quantities)
+        last = min(k,n-1)
+        if last==head:
+            sum_out_quantity = 0+self.quantities[head]
+        else:
+            sum_out_quantity = self.quantities[head] + (self.cum_quantities[last+1]-self.cum_quantities[head+1])
+        sum_out_amount = self.sum_amounts(last)
+        if k==n:
+            #足りない場合には、実際に取り出し可能な数量、金額を返す
+            self.move_head(n)
+            return (sum_out_quantity,sum_out_amount)
+        return self.split(k,quantity,sum_out_quantity,sum_out_amount)
+
+    def find_last_layer(self,quantity):
+        # 取り出しが終わる層のindexを二分探索で求める
+        # 全て取り出しても足りない場合は 層の数 を、二分探索が使えない場合はNoneを返す
+        # 二分探索が使えるのは、数量が整数で、head以降の数量の累計が単調な場合
+        head = self.head
+        n = len(self.quantities)
+        head_quantity = self.quantities[head]
+        if not self.is_integral(head_quantity) or self.last_not_int_quantity > head:
+            return None
+        if quantity > 0:
+            if head_quantity < 0 or self.last_negative > head:
+                return None
+            if head_quantity >= quantity:
+                return head
+            # cum_quantities[k+1] >= quantity - head_quantity + cum_quantities[head+1] となる最初のk
+            self.update_cum()
+            target = quantity - head_quantity + self.cum_quantities[head+1]
+            j = bisect_left(self.cum_quantities,target,head+2,n+1)
+        else:
+            if head_quantity > 0 or self.last_positive > head:
+                return None
+            if head_quantity <= quantity:
+                return head
+            # 数量の累計は単調減少なので、符号を反転して探す
+            self.update_cum()
+            target = quantity - head_quantity + self.cum_quantities[head+1]
+            j = bisect_left(self.cum_quantities,-target,head+2,n+1,key=neg)
+        return j-1
+
+    def sum_amounts(self,last):
+        # headからlast番目までの層の金額の合計
+        head = self.head
+        head_amount = self.amounts[head]
+        if last==head:
+            return 0+head_amount
+        if self.is_integral(head_amount) and self.last_not_int_amount <= head:
+            return head_amount + (self.cum_amounts[last+1]-self.cum_amounts[head+1])
+        # 端数がある場合は、１層ずつ足した場合と丸めが一致するよう、古い順に足す
+        return reduce(add,self.amounts[head+1:last+1],0+head_amount)
+
+    def get_sequential(self,quantity,limit=None):
+        # 古い層から１つずつ取り出す
+        # limitを指定した場合、limit層取り出しても終わらなければ何もせずにNoneを返す
+        sum_out_quantity = 0
+        sum_out_amount = 0
+        n = len(self.quantities)
+        k = self.head
+        if limit is not None and k+limit < n:
+            n_stop = k+limit
+        else:
+            n_stop = n
+        while k < n_stop:
+            sum_out_quantity += self.quantities[k]
+            sum_out_amount += self.amounts[k]
+            if  0 <= sum_out_quantity < quantity:
+                k += 1
+                continue
+            if  quantity < sum_out_quantity <= 0:
+                k += 1
+                continue
+            return self.split(k,quantity,sum_out_quantity,sum_out_amount)
+        if n_stop < n:
+            return None
+        #足りない場合には、実際に取り出し可能な数量、金額を返す
+        self.move_head(n)
+        return (sum_out_quantity,sum_out_amount)
+
+    def split(self,k,quantity,sum_out_quantity,sum_out_amount):
+        # k番目の層まで取り出した結果、取り出しすぎた分をk番目の層に戻す
+        if  quantity==sum_out_quantity:
+            self.move_head(k+1)
+            return (sum_out_quantity,sum_out_amount)
+        out_quantity = self.quantities[k]
+        out_amount = self.amounts[k]
+        over_out_quantity = sum_out_quantity - quantity
+        if self.fixed_point is None:
+            over_out_amount = out_amount/out_quantity*over_out_quantity
+        else:
+            over_out_amount = self.fixed_point.div_round(out_amount*over_out_quantity,out_quantity)
+        piece = None
+        if self.consumed is not None:
+            piece = (self.refs[k],out_quantity-over_out_quantity,out_amount-over_out_amount)
+        self.quantities[k] = over_out_quantity
+        self.amounts[k] = over_out_amount
+        self.move_head(k,piece)
+        sum_out_quantity -= over_out_quantity
+        sum_out_amount -=over_out_amount
+        return (sum_out_quantity,sum_out_amount)
+
+    def get_all(self):
+        sum_out_quantity = 0
+        sum_out_amount = 0
+        for k in range(self.head,len(self.quantities)):
+            sum_out_quantity += self.quantities[k]
+            sum_out_amount += self.amounts[k]
+        self.move_head(len(self.quantities))
+        return (sum_out_quantity,sum_out_amount)
+
+    def move_head(self,new_head,piece=None):
+        # new_headより前の層を払出し済みとする
+        # piece: 一部だけ取り出した層の(ref,数量,金額)
+        if self.consumed is not None:
+            for k in range(self.head,new_head):
+                self.consumed.append((self.refs[k],self.quantities[k],self.amounts[k]))
+            if piece is not None:
+                self.consumed.append(piece)
+        if new_head != self.head:
+            self.head = new_head
+            self.compact()
+
+    def compact(self):
+        # 払出し済みの層を捨てる（累計は差だけを使うので、そのまま切り詰めてよい）
+        head = self.head
+        if head <= self.compact_threshold or head*2 < len(self.quantities):
+            return
+        self.update_cum()
+        self.quantities = self.quantities[head:]
+        self.amounts = self.amounts[head:]
+        self.refs = self.refs[head:]
+        self.cum_quantities = self.cum_quantities[head:]
+        self.cum_amounts = self.cum_amounts[head:]
+        self.last_not_int_quantity -= head
+        self.last_not_int_amount -= head
+        self.last_negative -= head
+        self.last_positive -= head
+        self.head = 0
+
+    def is_integral(self,value):
+        if type(value) is int:
+            return True
+        return type(value) is float and value.is_integer()
+
 class ItemQueueFIFO:
     # 先入先出法
-    def __init__(self):
-        self.q={} ## key:(account,sub_account,item) value:queue which contains (quantity,amount)
+    def __init__(self,trace=None,fixed_point=None):
+        self.q={} ## key:(account,sub_account,item) value:FIFOLayers
+        self.trace=trace ## CostFlowIndex 払出しと受入の対応を記録する場合に指定
+        self.fixed_point=fixed_point ## FixedPoint 整数で計算する場合に指定
 
-    def put(self,account,sub_account,item,in_quantity,in_amount):
+    def put(self,account,sub_account,item,in_quantity,in_amount,ref=None):
         #数量、金額として、0やマイナスも許容している
+        #ref: 受入の参照（traceに記録する）
         if in_quantity is None:
             return
         if in_amount is None:
             return
         latest_q = self.q.get((account,sub_account,item),None)
         if latest_q is None:
-            self.q[(account,sub_account,item)]=deque()
-            self.q[(account,sub_account,item)].appendleft((in_quantity,in_amount))
-        else:
-            self.q[(account,sub_account,item)].appendleft((in_quantity,in_amount))
+            latest_q = FIFOLayers(self.fixed_point)
+            self.q[(account,sub_account,item)]=latest_q
+        latest_q.put(in_quantity,in_amount,ref)
 
-    def get(self,account,sub_account,item,quantity):
+    def get(self,account,sub_account,item,quantity,ref=None):
         # quantity: 取り出したい数量
-        # 戻り値：（取り出した金額,取り出した数量）
+        # ref: 払出しの参照（traceに記録する）
+        # 戻り値：（取り出した数量,取り出した金額）
         #古いものから取り出していく
         #取り出した数量合計の絶対値が、
         # 取り出したい数量[quantity]以上（取り出したい値が正の場合）または
@@ -964,60 +1446,879 @@ class ItemQueueFIFO:
         #取り出したい数量[out_quantity]が0の場合は、取り出した金額は0とする
         #何も入っていない場合には、 数量、金額ともに0を返す
         #足りない場合には、実際に取り出し可能な数量、金額を返す
-        
+
         #登録がない場合には、 数量、金額ともにNoneを返す
         latest_q = self.q.get((account,sub_account,item),None)
         if latest_q is None:
             return (None,None)
-        
+
         #取り出したい数量[quantity]が0の場合は、取り出した金額は0とする
         if quantity==0:
             return 0,0
-        
+
         #何も入っていない場合には、 数量、金額ともに0を返す
         if len(latest_q)==0:
             return (0,0)
-        
-        sum_out_quantity = 0
-        sum_out_amount = 0
-        while self.q[(account,sub_account,item)]:
-            try:
-                out_quantity,out_amount=self.q[(account,sub_account,item)].pop()
-            except IndexError:
-                return (sum_out_quantity,sum_out_amount)
-            sum_out_quantity += out_quantity
-            sum_out_amount += out_amount
-            if  0 <= sum_out_quantity < quantity:
-                continue
-            if  quantity < sum_out_quantity <= 0:
-                continue
-            if  quantity==sum_out_quantity:
-                return (sum_out_quantity,sum_out_amount)
-            over_out_quantity = sum_out_quantity - quantity
-            over_out_amount = out_amount/out_quantity*over_out_quantity
-            self.q[(account,sub_account,item)].append((over_out_quantity,over_out_amount))
-            sum_out_quantity -= over_out_quantity
-            sum_out_amount -=over_out_amount
-            return (sum_out_quantity,sum_out_amount)
-        
+
+        if self.trace is None or ref is None:
+            return latest_q.get(quantity)
+        latest_q.consumed = []
+        out_quantity,out_amount = latest_q.get(quantity)
+        self.trace.add_fifo(ref,latest_q.consumed)
+        latest_q.consumed = None
+        return (out_quantity,out_amount)
+
     def get_all(self,account,sub_account,item):
         #登録がない場合には、 数量、金額ともにNoneを返す
         latest_q = self.q.get((account,sub_account,item),None)
         if latest_q is None:
             return (None,None)
-        sum_out_quantity = 0
-        sum_out_amount = 0
-        while self.q[(account,sub_account,item)]:
-            try:
-                out_quantity,out_amount=self.q[(account,sub_account,item)].pop()
-            except IndexError:
-                return (sum_out_quantity,sum_out_amount)
-            sum_out_quantity += out_quantity
-            sum_out_amount += out_amount
-        return (sum_out_quantity,sum_out_amount)
+        return latest_q.get_all()
+
+class FixedPoint:
+    # 固定小数点（整数）で数量・金額を保持する場合の設定
+    # amount_scale: 金額の単位（1なら円単位、100なら1/100円単位）
+    # quantity_scale: 数量の単位（1000なら1/1000個単位）
+    # rounding: 払出し時などの端数処理（decimalの丸めモード ROUND_HALF_UP,ROUND_HALF_EVEN,ROUND_DOWN など）
+    #
+    # Ledgers(fixed_point=FixedPoint(...))とすると、recordのdr_quantity,dr_amount,cr_quantity,cr_amountは
+    # 登録時にscaleを掛けた整数に変換され、recalc_allの計算もすべて整数で行われる
+    # 端数が生じるのは払出し（先入先出法の層の分割、移動平均法、総平均法、最終仕入原価法）だけで、
+    # そこではroundingで丸める
+    # get_tb、*_to_df などの出力では、scaleで割り戻した値を返す
+    def __init__(self,amount_scale=1,quantity_scale=1,rounding=ROUND_HALF_UP):
+        if type(amount_scale) is not int or amount_scale <= 0:
+            raise ValueError('FixedPoint: amount_scale must be a positive int.')
+        if type(quantity_scale) is not int or quantity_scale <= 0:
+            raise ValueError('FixedPoint: quantity_scale must be a positive int.')
+        if rounding not in (ROUND_HALF_UP,ROUND_HALF_DOWN,ROUND_HALF_EVEN,ROUND_DOWN,ROUND_UP,ROUND_FLOOR,ROUND_CEILING):
+            raise ValueError('FixedPoint: rounding not supported.')
+        self.amount_scale = amount_scale
+        self.quantity_scale = quantity_scale
+        self.rounding = rounding
+
+    def to_scaled(self,value,scale):
+        # 数値はscaleを掛けて丸めた整数に、それ以外（演算子の文字列、None）はそのまま返す
+        if type(value) is int:
+            return value*scale
+        if type(value) is float:
+            return int((Decimal(repr(value))*scale).to_integral_value(rounding=self.rounding))
+        return value
+
+    def to_amount(self,value):
+        return self.to_scaled(value,self.amount_scale)
+
+    def to_quantity(self,value):
+        return self.to_scaled(value,self.quantity_scale)
+
+    def from_scaled(self,value,scale):
+        # scaleで割り戻す（割り切れる場合はint、割り切れない場合はfloat）
+        if type(value) is not int:
+            return value
+        if value % scale == 0:
+            return value // scale
+        return value / scale
+
+    def from_amount(self,value):
+        return self.from_scaled(value,self.amount_scale)
+
+    def from_quantity(self,value):
+        return self.from_scaled(value,self.quantity_scale)
+
+    def div_round(self,numerator,denominator):
+        # numerator / denominator をroundingで整数に丸める（整数のみで計算する）
+        if denominator == 0:
+            raise ZeroDivisionError('FixedPoint: division by zero.')
+        negative = (numerator < 0) != (denominator < 0)
+        q,r = divmod(abs(numerator),abs(denominator))
+        if r == 0:
+            pass
+        elif self.rounding == ROUND_HALF_UP:
+            if 2*r >= abs(denominator):
+                q += 1
+        elif self.rounding == ROUND_HALF_EVEN:
+            if 2*r > abs(denominator) or (2*r == abs(denominator) and q % 2 == 1):
+                q += 1
+        elif self.rounding == ROUND_HALF_DOWN:
+            if 2*r > abs(denominator):
+                q += 1
+        elif self.rounding == ROUND_UP:
+            q += 1
+        elif self.rounding == ROUND_CEILING:
+            if not negative:
+                q += 1
+        elif self.rounding == ROUND_FLOOR:
+            if negative:
+                q += 1
+        if negative:
+            return -q
+        return q
+
+    def round_fraction(self,value):
+        # Fraction（またはint）を整数に丸める
+        if type(value) is int:
+            return value
+        return self.div_round(value.numerator,value.denominator)
+
+    def from_tb(self,tb):
+        # get_tbの結果をscaleで割り戻す（tbを書き換えるので注意）
+        for v in tb.values():
+            for name,value in v.items():
+                if "quantity" in name:
+                    v[name] = self.from_quantity(value)
+                else:
+                    v[name] = self.from_amount(value)
+        return tb
+
+    def from_df(self,df):
+        # DataFrameのdr_quantity,dr_amount,cr_quantity,cr_amount列をscaleで割り戻す
+        for name in ("dr_quantity","cr_quantity"):
+            if name in df.columns:
+                df[name] = df[name].map(self.from_quantity).astype(object)
+        for name in ("dr_amount","cr_amount"):
+            if name in df.columns:
+                df[name] = df[name].map(self.from_amount).astype(object)
+        return df
+
+class TBKeyIndex:
+    # (account,sub_account,item)ひとつ分の日付順の累積和
+    # cums[0..3] dr_quantity,dr_amount,cr_quantity,cr_amount の累積和（先頭は0）
+    # cums[i][k] は datetimes[:k] のrecordの合計
+    # 開始仕訳(&KIND::OPENING)は日付によらないので opening に別に集計する
+    
+    def __init__(self,side):
+        self.side = side
+        self.records = []
+        self.opening = [0,0]
+        self.datetimes = []
+        self.cums = [[0],[0],[0],[0]]
+        self.has_operator = False ## OP_***が残っている場合True recalc_all後に作り直す
+        
+    def build(self,get_datetime):
+        if self.side == "Dr":
+            sign = 1
+        elif self.side == "Cr":
+            sign = -1
+        else:
+            sign = 0
+        opening = [0,0]
+        datetimes = []
+        rows = []
+        has_operator = False
+        for record in self.records:
+            values = (record.get("dr_quantity",None),record.get("dr_amount",None),record.get("cr_quantity",None),record.get("cr_amount",None))
+            for value in values:
+                if (type(value) is not int) and (type(value) is not float) and (value is not None):
+                    has_operator = True
+            #None（記載なし）・OP_***は集計しない
+            dr_quantity,dr_amount,cr_quantity,cr_amount = [value if (type(value) is int) or (type(value) is float) else 0 for value in values]
+            memo = record.get("memo",None)
+            if "KIND" in memo and memo["KIND"]=="OPENING":
+                #開始仕訳 sideが不明な場合は集計しない
+                if sign != 0:
+                    opening[0] += sign*dr_quantity
+                    opening[1] += sign*dr_amount
+                    opening[0] -= sign*cr_quantity
+                    opening[1] -= sign*cr_amount
+            else:
+                datetimes.append(get_datetime(record["datetime"]))
+                rows.append((dr_quantity,dr_amount,cr_quantity,cr_amount))
+        #日付順（同じ日付はrecordの順）
+        if any(map(gt,datetimes,datetimes[1:])):
+            order = sorted(range(len(datetimes)),key=datetimes.__getitem__)
+            datetimes = [datetimes[i] for i in order]
+            rows = [rows[i] for i in order]
+        self.opening = opening
+        self.datetimes = datetimes
+        self.cums = [list(accumulate(column,initial=0)) for column in zip(*rows)] if len(rows)>0 else [[0],[0],[0],[0]]
+        self.has_operator = has_operator
+
+    def get_sums(self,dt_start_datetime=None,dt_end_datetime=None):
+        # get_tb_sumsと同じ並びの集計結果
+        if dt_start_datetime is None:
+            start = 0
+        else:
+            start = bisect_left(self.datetimes,dt_start_datetime)
+        if dt_end_datetime is None:
+            end = len(self.datetimes)
+        else:
+            end = max(start,bisect_left(self.datetimes,dt_end_datetime))
+        dq,da,cq,ca = self.cums
+        return (self.opening[0],self.opening[1],dq[start],da[start],cq[start],ca[start],dq[end]-dq[start],da[end]-da[start],cq[end]-cq[start],ca[end]-ca[start])
+
+class TBIndex:
+    # 日付で二分探索できる試算表のインデックス
+    # (account,sub_account,item)ごとにTBKeyIndexを持ち、任意の期間の試算表・残高を O(項目数・log n) で求める
+    # recordの数量・金額を直接書き換えた場合は build() で作り直す
+    
+    def __init__(self,accInfo,get_datetime):
+        self.accInfo = accInfo
+        self.get_datetime = get_datetime
+        self.keys = {}
+        self.dirty_keys = set() ## 作り直しが必要なkey
+        self.accinfo_state = None ## 作成したときのAccountInfo（Ledgers.get_tb_indexで使用）
+        
+    def build(self,records):
+        self.keys = {}
+        self.dirty_keys = set()
+        for record in records:
+            self.add(record)
+        self.update()
+
+    def add(self,record):
+        account = record.get("account",None)
+        sub_account = record.get("sub_account",None)
+        item = record.get("item",None)
+        if account is None or sub_account is None or item is None:
+            return
+        if record.get("datetime",None) is None:
+            return
+        key = (account,sub_account,item)
+        key_index = self.keys.get(key,None)
+        if key_index is None:
+            key_index = TBKeyIndex(self.accInfo.get_item_side(account,sub_account,item))
+            self.keys[key] = key_index
+        key_index.records.append(record)
+        self.dirty_keys.add(key)
+
+    def mark_operator_keys(self):
+        # OP_***が残っているkey（recalc_allで数量・金額が決まるkey）を作り直しの対象にする
+        for key,key_index in self.keys.items():
+            if key_index.has_operator:
+                self.dirty_keys.add(key)
+
+    def update(self):
+        # 作り直しが必要なkeyだけを作り直す
+        for key in self.dirty_keys:
+            self.keys[key].build(self.get_datetime)
+        self.dirty_keys = set()
+
+    def get_tb_sums(self,dt_start_datetime=None,dt_end_datetime=None):
+        # Ledgers.get_tb_sums と同じ並び {(account,sub_account,item):(side,sums)}
+        tb_sums = {}
+        for key,key_index in self.keys.items():
+            tb_sums[key] = (key_index.side,key_index.get_sums(dt_start_datetime,dt_end_datetime))
+        return tb_sums
+
+    def get_balance(self,key,dt_datetime=None):
+        # dt_datetimeより前（dt_datetimeを含まない）の残高(quantity,amount)
+        key_index = self.keys.get(key,None)
+        if key_index is None:
+            return (0,0)
+        sums = key_index.get_sums(None,dt_datetime)
+        if key_index.side == "Dr":
+            return (sums[0]+sums[6]-sums[8],sums[1]+sums[7]-sums[9])
+        elif key_index.side == "Cr":
+            return (sums[0]+sums[8]-sums[6],sums[1]+sums[9]-sums[7])
+        return (None,None)
+
+class RecordColumns:
+    # Ledgers.get_record_dfのキャッシュ
+    # recordsを列ごとのリストにして持ち、recordsに追加されたrecordだけを読んで列を伸ばす
+    # memo_str memo_number はkeyごとの列に展開する（値がないrecordはNaN）
+    key_list = ["entry_id","counts_dr_cr","order_id","line_no","datetime","account","sub_account","item","partner","person_in_charge","memo","memo_str","memo_number","memo_number_unit","price","quantity","quantity_unit","amount","amount_unit","dr_quantity","dr_amount","cr_quantity","cr_amount","remarks"]
+    
+    def __init__(self,records):
+        self.records = records
+        self.n_records = 0
+        self.columns = {key:[] for key in self.key_list}
+        self.memo_str = {} ## memoのkey -> {recordの位置:値}
+        self.memo_number = {}
+        self.df = None
+        
+    def extend(self):
+        new_records = self.records[self.n_records:]
+        if len(new_records)==0:
+            return False
+        for key,column in self.columns.items():
+            if key=="memo_str" or key=="memo_number":
+                #列の値は辞書の文字列表現
+                column.extend([str(record.get(key,None)) for record in new_records])
+            else:
+                #keyがないrecordはNaN（DataFrame.from_recordsと同じ）
+                column.extend([record.get(key,np.nan) for record in new_records])
+        for memo_key,memo_columns in (("memo_str",self.memo_str),("memo_number",self.memo_number)):
+            for pos,record in enumerate(new_records,self.n_records):
+                memo = record.get(memo_key,None)
+                if not memo:
+                    continue
+                for k,v in memo.items():
+                    memo_column = memo_columns.get(k,None)
+                    if memo_column is None:
+                        memo_column = {}
+                        memo_columns[k] = memo_column
+                    memo_column[pos] = v
+        self.n_records = len(self.records)
+        return True
+
+    def get_memo_df(self,memo_columns):
+        data = {}
+        for k,memo_column in memo_columns.items():
+            column = [np.nan]*self.n_records
+            for pos,v in memo_column.items():
+                column[pos] = v
+            data[k] = column
+        return pd.DataFrame(data)
+
+    def get_df(self):
+        # 追加されたrecordがなければ前回のDataFrameを返す
+        if self.extend() or self.df is None:
+            rec_df = pd.DataFrame(self.columns,columns=self.key_list)
+            rec_df = rec_df.join(self.get_memo_df(self.memo_str),how="outer")
+            rec_df = rec_df.join(self.get_memo_df(self.memo_number),how="outer")
+            self.df = rec_df
+        return self.df.copy(deep=False)
+
+class RecordIndex:
+    # Ledgers.recordsの索引（転置リスト）
+    # account、(account,sub_account)、(account,sub_account,item)、partner、person_in_charge、memoのkey・値ごとに
+    # recordのrecords内の位置（昇順）のリストを持つ　検索は該当するrecordの数に比例する時間で済む
+    # registerで追加し、sort_recordsで作り直す　recordのaccount・partnerなどを直接書き換えた場合は build() で作り直す
+    
+    def __init__(self,records):
+        self.build(records)
+
+    def build(self,records):
+        self.records = records
+        self.n_records = 0
+        self.accounts = {}
+        self.sub_accounts = {}
+        self.items = {}
+        self.partners = {}
+        self.person_in_charges = {}
+        self.memos = {} ## memoのkey -> {値:位置のリスト}
+        for record in records:
+            self.add(record)
+
+    def add(self,record):
+        # recordはrecordsの末尾に追加済みであること
+        pos = self.n_records
+        self.n_records += 1
+        account = record.get("account",None)
+        sub_account = record.get("sub_account",None)
+        item = record.get("item",None)
+        self.accounts.setdefault(account,[]).append(pos)
+        self.sub_accounts.setdefault((account,sub_account),[]).append(pos)
+        self.items.setdefault((account,sub_account,item),[]).append(pos)
+        partner = record.get("partner",None)
+        if partner is not None:
+            self.partners.setdefault(partner,[]).append(pos)
+        person_in_charge = record.get("person_in_charge",None)
+        if person_in_charge is not None:
+            self.person_in_charges.setdefault(person_in_charge,[]).append(pos)
+        memo = record.get("memo",None)
+        if memo is not None:
+            for k,v in memo.items():
+                if v is None:
+                    continue
+                memo_values = self.memos.get(k,None)
+                if memo_values is None:
+                    memo_values = {}
+                    self.memos[k] = memo_values
+                memo_values.setdefault(v,[]).append(pos)
+
+    def is_valid(self,records):
+        return self.records is records and self.n_records==len(records)
+
+    def get_field_positions(self,field):
+        # fieldの値 -> 位置のリスト　索引がないfieldはNone
+        if field=="account":
+            return self.accounts
+        if field=="partner":
+            return self.partners
+        if field=="person_in_charge":
+            return self.person_in_charges
+        return None
+
+    def union(self,positions_list):
+        # 位置のリストの和（昇順）
+        positions_list = [positions for positions in positions_list if len(positions)>0]
+        if len(positions_list)==0:
+            return []
+        if len(positions_list)==1:
+            return positions_list[0]
+        return sorted(chain.from_iterable(positions_list))
+
+class ReportCache:
+    # Ledgersのレポート（get_tb,tb_to_dfなど）の結果のキャッシュ
+    # key: (メソッド名,引数,...)　最近使っていないものから削除する（LRU）
+    # max_entries 件数の上限　max_bytes 大きさ（見積り）の上限
+    # stateが変わった場合（register,recalc_all,AccountInfoの変更）はすべて削除する
+    # 結果はコピーを返すので、返した値を書き換えてもキャッシュは変わらない
+    
+    def __init__(self,max_entries=128,max_bytes=256*1024*1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() ## key -> (value,size)
+        self.state = None
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0 ## キャッシュできない引数（rec_cond_funcなど）で呼ばれた回数
+        
+    def make_key(self,name,*args):
+        # 引数からkeyを作る　キャッシュできない場合はNone
+        # list -> tuple　rec_cond_funcなどの関数は cache_key を持つ場合だけキャッシュする
+        key = [name]
+        for arg in args:
+            if type(arg) is list:
+                arg = tuple(arg)
+            elif callable(arg):
+                cache_key = getattr(arg,"cache_key",None)
+                if cache_key is None:
+                    return None
+                arg = ("cache_key",cache_key)
+            key.append(arg)
+        key = tuple(key)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self,key,state):
+        # キャッシュにない場合はNone
+        if key is None:
+            self.bypasses += 1
+            return None
+        if state != self.state:
+            self.clear()
+            self.state = state
+        entry = self.entries.get(key,None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return self.copy_value(entry[0])
+
+    def put(self,key,state,value):
+        # valueを登録し、valueのコピーを返す
+        if key is None or value is None:
+            return value
+        if state != self.state:
+            self.clear()
+            self.state = state
+        size = self.get_size(value)
+        if size > self.max_bytes:
+            return value
+        old_entry = self.entries.pop(key,None)
+        if old_entry is not None:
+            self.n_bytes -= old_entry[1]
+        self.entries[key] = (value,size)
+        self.n_bytes += size
+        while len(self.entries) > self.max_entries or self.n_bytes > self.max_bytes:
+            old_key,(old_value,old_size) = self.entries.popitem(last=False)
+            self.n_bytes -= old_size
+        return self.copy_value(value)
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+
+    def get_info(self):
+        return {"hits":self.hits,"misses":self.misses,"bypasses":self.bypasses,"entries":len(self.entries),"bytes":self.n_bytes}
+
+    def copy_value(self,value):
+        # DataFrameは浅いコピー（Copy-on-Write）、dict・listは中身もコピーする
+        if isinstance(value,pd.DataFrame):
+            return value.copy(deep=False)
+        if type(value) is dict:
+            return {k:self.copy_value(v) for k,v in value.items()}
+        if type(value) is list:
+            return [self.copy_value(v) for v in value]
+        return value
+
+    def get_size(self,value):
+        # 大きさの見積り（バイト）
+        if isinstance(value,pd.DataFrame):
+            return int(value.memory_usage(index=True,deep=True).sum())
+        if type(value) is dict:
+            return sys.getsizeof(value)+sum(self.get_size(k)+self.get_size(v) for k,v in value.items())
+        if type(value) is list or type(value) is tuple:
+            return sys.getsizeof(value)+sum(self.get_size(v) for v in value)
+        return sys.getsizeof(value)
+
+class RecordFilter:
+    # recordの抽出条件（rec_cond_funcの代わりに指定できる）
+    # 関数と同じく record を引数として呼び出すと True/False を返す
+    # Ledgersは索引で絞り込める条件（get_positions）を先に使い、残りの条件だけをrecordごとに調べる
+    # & | ~ で組み合わせる　cache_key はReportCacheのkeyに使う
+    #  例 FieldIn("partner",["A社","B社"]) & MemoIn("KIND",["ADJUSTING"]) & DatetimeRange("2022-04-01","2022-07-01")
+    cache_key = None
+    
+    def __call__(self,record):
+        return True
+
+    def get_positions(self,ledgers):
+        # 条件に合うrecordのledgers.records内の位置（昇順のリスト）　索引で求められない場合はNone
+        return None
+
+    def __and__(self,other):
+        return And(self,other)
+
+    def __or__(self,other):
+        return Or(self,other)
+
+    def __invert__(self):
+        return Not(self)
+
+class FieldIn(RecordFilter):
+    # record[field] が values のいずれか（Noneを含めると、fieldがないrecordも対象）
+    # field account,sub_account,item,partner,person_in_charge など
+    def __init__(self,field,values):
+        self.field = field
+        self.values = frozenset(values)
+        self.cache_key = ("FieldIn",field,self.values)
+
+    def __call__(self,record):
+        return record.get(self.field,None) in self.values
+
+    def get_positions(self,ledgers):
+        if None in self.values:
+            return None
+        record_index = ledgers.get_record_index()
+        field_positions = record_index.get_field_positions(self.field)
+        if field_positions is None:
+            return None
+        return record_index.union([field_positions.get(value,[]) for value in self.values])
+
+class MemoIn(RecordFilter):
+    # memoのmemo_keyの値が values のいずれか（Noneを含めると、memo_keyがないrecordも対象）
+    #  例 MemoIn("KIND",["ADJUSTING"]) 決算整理仕訳
+    def __init__(self,memo_key,values):
+        self.memo_key = memo_key
+        self.values = frozenset(values)
+        self.cache_key = ("MemoIn",memo_key,self.values)
+
+    def __call__(self,record):
+        memo = record.get("memo",None)
+        if memo is None:
+            return False
+        return memo.get(self.memo_key,None) in self.values
+
+    def get_positions(self,ledgers):
+        if None in self.values:
+            return None
+        record_index = ledgers.get_record_index()
+        memo_values = record_index.memos.get(self.memo_key,{})
+        return record_index.union([memo_values.get(value,[]) for value in self.values])
+
+class AccountPrefix(RecordFilter):
+    # accountがprefixで始まる
+    def __init__(self,prefix):
+        self.prefix = prefix
+        self.cache_key = ("AccountPrefix",prefix)
+
+    def __call__(self,record):
+        account = record.get("account",None)
+        return type(account) is str and account.startswith(self.prefix)
+
+    def get_positions(self,ledgers):
+        record_index = ledgers.get_record_index()
+        return record_index.union([positions for account,positions in record_index.accounts.items() if type(account) is str and account.startswith(self.prefix)])
+
+class DatetimeRange(RecordFilter):
+    # start_datetime <= 日付 < end_datetime（get_tbと同じ）　Noneの場合は制限なし
+    def __init__(self,start_datetime=None,end_datetime=None):
+        self.start_datetime = start_datetime
+        self.end_datetime = end_datetime
+        self.dt_start_datetime = datetime.datetime.fromisoformat(start_datetime) if start_datetime is not None else None
+        self.dt_end_datetime = datetime.datetime.fromisoformat(end_datetime) if end_datetime is not None else None
+        self.cache_key = ("DatetimeRange",start_datetime,end_datetime)
+
+    def __call__(self,record):
+        date_or_datetime = record.get("datetime",None)
+        if date_or_datetime is None:
+            return False
+        dt_datetime = datetime.datetime.fromisoformat(date_or_datetime)
+        if self.dt_start_datetime is not None and dt_datetime < self.dt_start_datetime:
+            return False
+        if self.dt_end_datetime is not None and not dt_datetime < self.dt_end_datetime:
+            return False
+        return True
+
+    def get_positions(self,ledgers):
+        # recordsが日付順の場合は二分探索
+        datetimes = ledgers.get_sorted_datetimes()
+        if datetimes is None:
+            return None
+        start = 0 if self.dt_start_datetime is None else bisect_left(datetimes,self.dt_start_datetime)
+        end = len(datetimes) if self.dt_end_datetime is None else max(start,bisect_left(datetimes,self.dt_end_datetime))
+        return range(start,end)
+
+class And(RecordFilter):
+    def __init__(self,*filters):
+        self.filters = filters
+        self.cache_key = ("And",)+tuple(f.cache_key for f in filters)
+        if None in self.cache_key:
+            self.cache_key = None
+
+    def __call__(self,record):
+        for f in self.filters:
+            if not f(record):
+                return False
+        return True
+
+    def get_positions(self,ledgers):
+        # 索引で求められる条件の共通部分を求め、残りの条件はrecordごとに調べる
+        positions = None
+        rest = []
+        for f in self.filters:
+            f_positions = f.get_positions(ledgers) if isinstance(f,RecordFilter) else None
+            if f_positions is None:
+                rest.append(f)
+            elif positions is None:
+                positions = f_positions
+            elif type(positions) is range and type(f_positions) is range:
+                positions = range(max(positions.start,f_positions.start),max(positions.start,f_positions.start,min(positions.stop,f_positions.stop)))
+            elif type(f_positions) is range:
+                positions = [i for i in positions if f_positions.start <= i < f_positions.stop]
+            elif type(positions) is range:
+                positions = [i for i in f_positions if positions.start <= i < positions.stop]
+            else:
+                f_positions = set(f_positions)
+                positions = [i for i in positions if i in f_positions]
+        if positions is None:
+            return None
+        if len(rest)==0:
+            return positions
+        records = ledgers.records
+        return [i for i in positions if all(f(records[i]) for f in rest)]
+
+class Or(RecordFilter):
+    def __init__(self,*filters):
+        self.filters = filters
+        self.cache_key = ("Or",)+tuple(f.cache_key for f in filters)
+        if None in self.cache_key:
+            self.cache_key = None
+
+    def __call__(self,record):
+        for f in self.filters:
+            if f(record):
+                return True
+        return False
+
+    def get_positions(self,ledgers):
+        # すべての条件が索引で求められる場合だけ和集合
+        positions = set()
+        for f in self.filters:
+            f_positions = f.get_positions(ledgers) if isinstance(f,RecordFilter) else None
+            if f_positions is None:
+                return None
+            positions.update(f_positions)
+        return sorted(positions)
+
+class Not(RecordFilter):
+    def __init__(self,f):
+        self.f = f
+        self.cache_key = ("Not",f.cache_key) if f.cache_key is not None else None
+
+    def __call__(self,record):
+        return not self.f(record)
+
+class ReportBatch:
+    # 複数のレポート（月次の帳票一式など）をまとめて作成する（Ledgers.run_reports）
+    # specs レポートの指定（dict）のリスト
+    #  report "tb" "tb_partner_vs_end" "tb_person_in_charge_vs_end" "tb_memo_vs_end" "tb_periods" "simple_ledger"
+    #  name レポートの名前（省略した場合は *_to_excel のファイル名と同じ　期間を指定した場合は期間を付ける）
+    #  start_datetime end_datetime memo_key periods account sub_account item rec_cond_func　*_to_dfの引数
+    # 同じ期間（同じrec_cond_func）の試算表・取引先別・担当者別・memo別の試算表は、recordsを一度だけ走査して集計する
+    # 元帳はLedgersの索引で求める　report_cacheにあるレポートは作成しない（作成したレポートはreport_cacheに登録する）
+    # timings 走査ごと・レポートごとの時間（秒）
+    base_names = {"tb":"TB","tb_partner_vs_end":"TB_partner_vs_end","tb_person_in_charge_vs_end":"TB_person_in_charge_vs_end","tb_memo_vs_end":"TB_memo_vs_end","tb_periods":"TB_periods","simple_ledger":None}
+    scan_reports = ("tb","tb_partner_vs_end","tb_person_in_charge_vs_end","tb_memo_vs_end")
+    
+    def __init__(self,ledgers,specs):
+        self.ledgers = ledgers
+        self.specs = {} ## name -> spec
+        for spec in specs:
+            report = spec.get("report",None)
+            if report not in self.base_names:
+                raise ValueError("ReportBatch: unknown report '%s'." % report)
+            if report=="tb_memo_vs_end" and spec.get("memo_key",None) is None:
+                raise ValueError("ReportBatch: 'memo_key' is required for 'tb_memo_vs_end'.")
+            if report=="tb_periods" and spec.get("periods",None) is None:
+                raise ValueError("ReportBatch: 'periods' is required for 'tb_periods'.")
+            if report=="simple_ledger" and spec.get("account",None) is None:
+                raise ValueError("ReportBatch: 'account' is required for 'simple_ledger'.")
+            name = spec.get("name",None)
+            if name is None:
+                name = self.get_default_name(spec)
+            if name in self.specs:
+                raise ValueError("ReportBatch: duplicate report name '%s'." % name)
+            self.specs[name] = spec
+        self.dfs = {} ## name -> DataFrame（specsの順）
+        self.timings = {"scans":[],"reports":{},"writes":{}}
+
+    def get_default_name(self,spec):
+        report = spec["report"]
+        if report=="simple_ledger":
+            #simple_ledger_to_excelと同じ
+            account = spec["account"]
+            sub_account = spec.get("sub_account",None)
+            item = spec.get("item",None)
+            name = account
+            if sub_account is not None:
+                name += "_"+sub_account
+            if item is not None:
+                name += "_"+item
+            method = self.ledgers.accInfo.get_item_method(account,sub_account,item)
+            if method is not None:
+                name += "_"+method
+            return name
+        name = self.base_names[report]
+        if report=="tb_memo_vs_end":
+            name += "_"+spec["memo_key"]
+        start_datetime = spec.get("start_datetime",None)
+        end_datetime = spec.get("end_datetime",None)
+        if start_datetime is not None or end_datetime is not None:
+            name += "_"+(start_datetime or "")+"_"+(end_datetime or "")
+        return name.replace(":","")
+
+    def get_cache_key(self,spec):
+        # 同じレポートを作成するLedgersのメソッドと同じkey
+        report_cache = self.ledgers.report_cache
+        report = spec["report"]
+        start_datetime = spec.get("start_datetime",None)
+        end_datetime = spec.get("end_datetime",None)
+        if report=="tb":
+            return report_cache.make_key("tb_to_df",start_datetime,end_datetime,spec.get("rec_cond_func",None))
+        if report=="tb_memo_vs_end":
+            return report_cache.make_key("tb_memo_vs_end_to_df",spec["memo_key"],start_datetime,end_datetime)
+        return report_cache.make_key(report+"_to_df",start_datetime,end_datetime)
+
+    def plan(self):
+        # 試算表のレポートを (start_datetime,end_datetime,rec_cond_func) ごとにまとめる
+        # 戻り値 {(start_datetime,end_datetime,rec_cond_func):[name,...]}　report_cacheにあるレポートは除く
+        scans = {}
+        lgs = self.ledgers
+        for name,spec in self.specs.items():
+            if spec["report"] not in self.scan_reports:
+                continue
+            df = lgs.report_cache.get(self.get_cache_key(spec),lgs.get_cache_state())
+            if df is not None:
+                self.dfs[name] = df
+                self.timings["reports"][name] = 0.0
+                continue
+            rec_cond_func = spec.get("rec_cond_func",None) if spec["report"]=="tb" else None
+            scan_key = (spec.get("start_datetime",None),spec.get("end_datetime",None),rec_cond_func)
+            scans.setdefault(scan_key,[]).append(name)
+        return scans
+
+    def get_views(self,names):
+        # 走査で集計するview（get_tb_sums_views）　同じviewは一度だけ集計する
+        # 戻り値 {viewの名前:(group_func,groups)}
+        lgs = self.ledgers
+        views = {}
+        for name in names:
+            spec = self.specs[name]
+            report = spec["report"]
+            if report=="tb":
+                views["tb"] = (None,None)
+            elif report=="tb_partner_vs_end":
+                views["partner"] = (lambda rec: rec.get("partner",None),lgs.get_partner_list()+[None])
+            elif report=="tb_person_in_charge_vs_end":
+                views["person_in_charge"] = (lambda rec: rec.get("person_in_charge",None),lgs.get_person_in_charge_list()+[None])
+            elif report=="tb_memo_vs_end":
+                memo_key = spec["memo_key"]
+                #get_tb_with_memoと同じ
+                views[("memo",memo_key)] = ((lambda memo_key: lambda rec: rec["memo"].get(memo_key,None) if rec.get("memo",None) is not None else ())(memo_key),lgs.get_memo_list(memo_key)+[None])
+        return views
+
+    def get_view_name(self,spec):
+        report = spec["report"]
+        if report=="tb":
+            return "tb"
+        if report=="tb_partner_vs_end":
+            return "partner"
+        if report=="tb_person_in_charge_vs_end":
+            return "person_in_charge"
+        return ("memo",spec["memo_key"])
+
+    def run(self):
+        # すべてのレポートを作成し、{name:DataFrame}を返す
+        lgs = self.ledgers
+        dfs = {}
+        self.dfs = dfs
+        self.timings = {"scans":[],"reports":{},"writes":{}}
+        scans = self.plan()
+        for (start_datetime,end_datetime,rec_cond_func),names in scans.items():
+            t = time.perf_counter()
+            dt_start_datetime = datetime.datetime.fromisoformat(start_datetime) if start_datetime is not None else None
+            dt_end_datetime = datetime.datetime.fromisoformat(end_datetime) if end_datetime is not None else None
+            views = self.get_views(names)
+            records = lgs.select_records(rec_cond_func)
+            if len(views)==1:
+                #集計方法が1つだけの場合は get_tb_sums
+                group_func,groups = list(views.values())[0]
+                tb_sums_list = [lgs.get_tb_sums(records,dt_start_datetime,dt_end_datetime,group_func,set(groups) if groups is not None else None)]
+            else:
+                tb_sums_list = lgs.get_tb_sums_views(records,dt_start_datetime,dt_end_datetime,list(views.values()))
+            view_tb_sums = dict(zip(views.keys(),tb_sums_list))
+            self.timings["scans"].append({"start_datetime":start_datetime,"end_datetime":end_datetime,"views":len(views),"reports":len(names),"seconds":time.perf_counter()-t})
+            tbs = {}
+            disp_cats = {}
+            for name in names:
+                t = time.perf_counter()
+                spec = self.specs[name]
+                view_name = self.get_view_name(spec)
+                tb = tbs.get(view_name,None)
+                if tb is None:
+                    if view_name=="tb":
+                        tb = lgs.tb_sums_to_tb(view_tb_sums[view_name],disp_cats)
+                    else:
+                        tb = lgs.tb_sums_to_tb_grouped(view_tb_sums[view_name],views[view_name][1],disp_cats)
+                    tbs[view_name] = tb
+                if view_name=="tb":
+                    df = lgs.tb_dic_to_df(tb)
+                else:
+                    df = lgs.tb_grouped_vs_end_to_df(tb)
+                dfs[name] = lgs.report_cache.put(self.get_cache_key(spec),lgs.get_cache_state(),df)
+                self.timings["reports"][name] = time.perf_counter()-t
+        for name,spec in self.specs.items():
+            report = spec["report"]
+            if report in self.scan_reports:
+                continue
+            t = time.perf_counter()
+            if report=="tb_periods":
+                #期間別の試算表は個別に走査する
+                dfs[name] = lgs.tb_periods_to_df(spec["periods"],spec.get("start_datetime",None),spec.get("end_datetime",None),spec.get("rec_cond_func",None))
+            elif report=="simple_ledger":
+                dfs[name] = lgs.simple_ledger_to_df(spec["account"],spec.get("sub_account",None),spec.get("item",None))
+            self.timings["reports"][name] = time.perf_counter()-t
+        self.dfs = {name:dfs[name] for name in self.specs if name in dfs}
+        return self.dfs
+
+    def write(self,writer=None):
+        # writer(name,df) でレポートを書き出す　省略した場合はwrite_excel
+        if writer is None:
+            writer = self.write_excel
+        for name,df in self.dfs.items():
+            if df is None:
+                continue
+            t = time.perf_counter()
+            writer(name,df)
+            self.timings["writes"][name] = time.perf_counter()-t
+
+    def write_excel(self,name,df):
+        # <name>.xlsx に書き出す（*_to_excelと同じ）
+        filename = os.path.join(Path().resolve(),name+".xlsx")
+        with pd.ExcelWriter(filename) as writer:  
+            df.to_excel(writer,sheet_name=name[:31],index_label=name)
+
+    def timings_to_df(self):
+        # timingsを1行ずつのDataFrameにする　列 kind,name,seconds
+        rows = []
+        for scan in self.timings["scans"]:
+            rows.append({"kind":"scan","name":"%s_%s" % (scan["start_datetime"] or "",scan["end_datetime"] or ""),"seconds":scan["seconds"]})
+        for kind in ("reports","writes"):
+            for name,seconds in self.timings[kind].items():
+                rows.append({"kind":kind[:-1],"name":name,"seconds":seconds})
+        return pd.DataFrame(rows,columns=["kind","name","seconds"])
 
 class Ledgers:
-    def __init__(self):
+    def __init__(self,fixed_point=None):
         #self.memo_dict ={}
         #self.gb ={"partner":None,"item":None,"person_in_charge":None,"memo":{}}
         #抽出条件をどのように指定するか
@@ -1055,6 +2356,17 @@ class Ledgers:
         self.records=[]
         self.global_header = {}
         self.accInfo = AccountInfo()
+        self.ledger_accInfo = None ## Ledger（元帳）が使う既定のAccountInfo　get_out_prices_paで一度だけ作成
+        self.cost_flow = None ## CostFlowIndex recalc_all(trace_cost_flow=True)で作成
+        self.fixed_point = fixed_point ## FixedPoint 指定した場合、recordの数量・金額はscaleを掛けた整数で保持する
+        self.datetime_cache = {} ## 日付の文字列 -> datetime get_tbで使用
+        self.record_columns = None ## RecordColumns get_record_dfのキャッシュ
+        self.version = 0 ## recordsを変更するたびに増える（register,sort_records,recalc_all）
+        self.report_cache = ReportCache() ## get_tb,tb_to_dfなどの結果のキャッシュ
+        self.sorted_datetimes = None ## get_sorted_datetimes
+        self.sorted_datetimes_version = None
+        self.tb_index = None ## TBIndex get_tb_index()で作成し、register・recalc_allで差分を更新する
+        self.record_index = RecordIndex(self.records) ## account・partnerなどごとのrecordの位置 registerで追加しsort_recordsで作り直す
         
         #fieldnames=["id","entry_id","kind","datetime","account","sub_account","借方担当者","借方税区分","借方金額","借方税額","借方金額単位","借方数量","借方数量単位","借方取引先","借方品目","借方メモ","借方摘要","貸方勘定科目","貸方補助科目","貸方部門","貸方担当者","貸方税区分","貸方金額","貸方税額","貸方金額単位","貸方数量","貸方数量単位","貸方取引先","貸方品目","貸方メモ","貸方摘要","摘要"]
         #self.records = pd.DataFrame(index=[],columns=fieldnames)
@@ -1064,6 +2376,55 @@ class Ledgers:
         # ３　journal:debit/creditが含まれないjournal_entryのheaderで指定した場合（変更されるまでその値を保持）
         # 同じitem 取引先　memoのキー　が指定されている場合の優先順位　１＞２＞３　で上書きして適用
 
+    def select_records(self,rec_cond_func=None):
+        # rec_cond_funcに合うrecordのリスト（recordsの順）
+        # RecordFilterの場合は索引で絞り込んでから残りの条件を調べる　関数の場合はすべてのrecordを調べる
+        if rec_cond_func is None:
+            return self.records
+        if isinstance(rec_cond_func,RecordFilter):
+            positions = rec_cond_func.get_positions(self)
+            if positions is not None:
+                records = self.records
+                return [records[i] for i in positions]
+        return [record for record in self.records if rec_cond_func(record)]
+
+    def get_record_index(self):
+        # recordsを直接置き換えた場合は作り直す
+        if not self.record_index.is_valid(self.records):
+            self.record_index.build(self.records)
+        return self.record_index
+
+    def get_sorted_datetimes(self):
+        # recordsの日付（datetime）のリスト　recordsが日付順でない場合はNone
+        # recordsを変更するまで（self.version）キャッシュする
+        if self.sorted_datetimes_version != self.version:
+            datetimes = []
+            for record in self.records:
+                date_or_datetime = record.get("datetime",None)
+                if date_or_datetime is None:
+                    datetimes = None
+                    break
+                datetimes.append(self.get_datetime(date_or_datetime))
+            if datetimes is not None and any(map(gt,datetimes,datetimes[1:])):
+                datetimes = None
+            self.sorted_datetimes = datetimes
+            self.sorted_datetimes_version = self.version
+        return self.sorted_datetimes
+
+    def run_reports(self,specs,write=False,writer=None):
+        # 複数のレポートをまとめて作成する（ReportBatch）
+        # write=True の場合は writer(name,df)（省略した場合はExcelファイル）で書き出す
+        # 戻り値 ReportBatch　batch.dfs {name:DataFrame}　batch.timings 時間
+        batch = ReportBatch(self,specs)
+        batch.run()
+        if write:
+            batch.write(writer)
+        return batch
+
+    def get_cache_state(self):
+        # report_cacheが有効かどうかの判定に使う（recordsとAccountInfoの状態）
+        return (self.version,id(self.accInfo),self.accInfo.version)
+
     def get_record_df(self):
         #レコードのデータをdataframeとして取得
         #分析用
@@ -1085,21 +2446,14 @@ class Ledgers:
         # dr_amount
         # cr_quantity
         # cr_amount
-        key_list = ["entry_id","counts_dr_cr","order_id","line_no","datetime","account","sub_account","item","partner","person_in_charge","memo","memo_str","memo_number","memo_number_unit","price","quantity","quantity_unit","amount","amount_unit","dr_quantity","dr_amount","cr_quantity","cr_amount","remarks"]
-        rec_df = pd.DataFrame.from_records(self.records,columns=key_list)
-        #df_memo = df['memo'].apply(lambda x: pd.Series(literal_eval(x)))
-
-        rec_df['memo_str']=rec_df['memo_str'].astype(str)
-        df_memo_str = rec_df['memo_str'].apply(lambda x: pd.Series(x,dtype=object))
-        df_memo_str = df_memo_str[0].apply(lambda x: pd.Series(literal_eval(x),dtype=object))
-
-        rec_df['memo_number']=rec_df['memo_number'].astype(str)
-        df_memo_number = rec_df['memo_number'].apply(lambda x: pd.Series(x,dtype=object))
-        df_memo_number = df_memo_number[0].apply(lambda x: pd.Series(literal_eval(x),dtype=object))
-
-        rec_df = rec_df.join(df_memo_str,how="outer")
-        rec_df = rec_df.join(df_memo_number,how="outer")
+        # recordを列ごとのリストにしたもの(RecordColumns)をキャッシュし、追加されたrecordだけを読む
+        # recalc_all（sort_records）の後は作り直す　recordを直接書き換えた場合は self.record_columns = None とする
+        if self.record_columns is None or self.record_columns.records is not self.records:
+            self.record_columns = RecordColumns(self.records)
+        rec_df = self.record_columns.get_df()
         
+        if self.fixed_point is not None:
+            rec_df = self.fixed_point.from_df(rec_df)
         return rec_df
     
     def get_records(self,account,sub_account=None,item=None):
@@ -1108,14 +2462,18 @@ class Ledgers:
         
         if account is None:
             return None
-        if sub_account is None:
-            records = [record for record in self.records if record["account"]==account]
-        else:
-            if item is None:
-                records = [record for record in self.records if record["account"]==account and record["sub_account"]==sub_account]
-            else:
-                records = [record for record in self.records if record["account"]==account and record["sub_account"]==sub_account and record["item"]==item]
+        positions = self.get_record_positions(account,sub_account,item)
+        records = [self.records[pos] for pos in positions]
         return records
+
+    def get_record_positions(self,account,sub_account=None,item=None):
+        # get_recordsのrecordのrecords内の位置（昇順）のリスト（索引のリストなので書き換えないこと）
+        record_index = self.get_record_index()
+        if sub_account is None:
+            return record_index.accounts.get(account,[])
+        if item is None:
+            return record_index.sub_accounts.get((account,sub_account),[])
+        return record_index.items.get((account,sub_account,item),[])
     
     def get_ledger(self,account,sub_account=None,item=None):
         #sub_account がNoneのときは総勘定元帳を返す
@@ -1123,10 +2481,14 @@ class Ledgers:
         records = self.get_records(account,sub_account,item)
         if records is None:
             return None
-        return Ledger(account,sub_account,item,records)
+        return Ledger(account,sub_account,item,records,self.fixed_point)
 
     def simple_ledger_to_df(self,account,sub_account=None,item=None):
         #records
+        cache_key = self.report_cache.make_key("simple_ledger_to_df",account,sub_account,item)
+        out_df = self.report_cache.get(cache_key,self.get_cache_state())
+        if out_df is not None:
+            return out_df
         records = self.get_records(account,sub_account,item)
         if records is None:
             return None
@@ -1139,8 +2501,10 @@ class Ledgers:
         
         #out_df = pd.DataFrame(columns=key_list)
         out_df = pd.DataFrame.from_records(records,columns=key_list)
+        if self.fixed_point is not None:
+            out_df = self.fixed_point.from_df(out_df)
         
-        return out_df
+        return self.report_cache.put(cache_key,self.get_cache_state(),out_df)
     
     def simple_ledger_to_excel(self,account,sub_account=None,item=None,filename=None):
 
@@ -1173,25 +2537,13 @@ class Ledgers:
             out_df.to_excel(writer, sheet_name=sheet_name,index_label=basename)
 
     def tb_partner_vs_end_to_df(self,start_datetime=None,end_datetime=None):
+        cache_key = self.report_cache.make_key("tb_partner_vs_end_to_df",start_datetime,end_datetime)
+        df = self.report_cache.get(cache_key,self.get_cache_state())
+        if df is not None:
+            return df
         tb_partners = self.get_tb_with_partner(start_datetime,end_datetime)
-        #partners = tb_partners.keys()
-        #df = pd.DataFrame(columns=partners)
-        mindex = pd.MultiIndex.from_tuples([],names=('disp_cat','account', 'sub_account','item'))
-        df = pd.DataFrame(index=mindex)
-        for partner,tb in tb_partners.items():
-            #(表示カテゴリ、account,sub_account_item)をdfのインデックスにする
-            keys = [(self.accInfo.get_item_disp_cat(*key),key[0],key[1],key[2]) for key in tb.keys()]
-            index = pd.MultiIndex.from_tuples(keys,names=('disp_cat','account', 'sub_account','item'))
-            if partner is None:
-                partner="OTHERS"
-            columns = [partner+"_end_quanitiy",partner+"_end_amount"]
-            q_data = [v.get("end_quantity",None) for v in tb.values()]
-            a_data = [v.get("end_amount",None) for v in tb.values()]
-            data = zip(q_data,a_data)
-            df2 = pd.DataFrame(data,index=index,columns=columns)
-            df = pd.merge(df, df2, on = ('disp_cat','account', 'sub_account','item'),how='outer')
-        df = df.sort_index()
-        return df
+        df = self.tb_grouped_vs_end_to_df(tb_partners)
+        return self.report_cache.put(cache_key,self.get_cache_state(),df)
     
     def tb_partner_vs_end_to_excel(self,filename=None,start_datetime=None,end_datetime=None):
         #filename
@@ -1209,25 +2561,13 @@ class Ledgers:
             out_df.to_excel(writer, sheet_name=sheet_name,index_label=basename)            
 
     def tb_person_in_charge_vs_end_to_df(self,start_datetime=None,end_datetime=None):
+        cache_key = self.report_cache.make_key("tb_person_in_charge_vs_end_to_df",start_datetime,end_datetime)
+        df = self.report_cache.get(cache_key,self.get_cache_state())
+        if df is not None:
+            return df
         tb_person_in_charges = self.get_tb_with_person_in_charge(start_datetime,end_datetime)
-        #person_in_charges = tb_person_in_charges.keys()
-        #df = pd.DataFrame(columns=person_in_charges)
-        mindex = pd.MultiIndex.from_tuples([],names=('disp_cat','account', 'sub_account','item'))
-        df = pd.DataFrame(index=mindex)
-        for person_in_charge,tb in tb_person_in_charges.items():
-            #(表示カテゴリ、account,sub_account_item)をdfのインデックスにする
-            keys = [(self.accInfo.get_item_disp_cat(*key),key[0],key[1],key[2]) for key in tb.keys()]
-            index = pd.MultiIndex.from_tuples(keys,names=('disp_cat','account', 'sub_account','item'))
-            if person_in_charge is None:
-                person_in_charge="OTHERS"
-            columns = [person_in_charge+"_end_quanitiy",person_in_charge+"_end_amount"]
-            q_data = [v.get("end_quantity",None) for v in tb.values()]
-            a_data = [v.get("end_amount",None) for v in tb.values()]
-            data = zip(q_data,a_data)
-            df2 = pd.DataFrame(data,index=index,columns=columns)
-            df = pd.merge(df, df2, on = ('disp_cat','account', 'sub_account','item'),how='outer')
-        df = df.sort_index()
-        return df
+        df = self.tb_grouped_vs_end_to_df(tb_person_in_charges)
+        return self.report_cache.put(cache_key,self.get_cache_state(),df)
 
     def tb_person_in_charge_vs_end_to_excel(self,filename=None,start_datetime=None,end_datetime=None):
         #filename
@@ -1245,26 +2585,112 @@ class Ledgers:
             out_df.to_excel(writer, sheet_name=sheet_name,index_label=basename)            
 
     def tb_memo_vs_end_to_df(self,memo_key,start_datetime=None,end_datetime=None):
+        cache_key = self.report_cache.make_key("tb_memo_vs_end_to_df",memo_key,start_datetime,end_datetime)
+        df = self.report_cache.get(cache_key,self.get_cache_state())
+        if df is not None:
+            return df
         tb_memos = self.get_tb_with_memo(memo_key,start_datetime,end_datetime)
-        #memos = tb_memos.keys()
-        #df = pd.DataFrame(columns=memos)
-        mindex = pd.MultiIndex.from_tuples([],names=('disp_cat','account', 'sub_account','item'))
-        df = pd.DataFrame(index=mindex)
-        for memo,tb in tb_memos.items():
-            #(表示カテゴリ、account,sub_account_item)をdfのインデックスにする
-            keys = [(self.accInfo.get_item_disp_cat(*key),key[0],key[1],key[2]) for key in tb.keys()]
-            index = pd.MultiIndex.from_tuples(keys,names=('disp_cat','account', 'sub_account','item'))
-            if memo is None:
-                memo="OTHERS"
-            columns = [memo+"_end_quanitiy",memo+"_end_amount"]
-            q_data = [v.get("end_quantity",None) for v in tb.values()]
-            a_data = [v.get("end_amount",None) for v in tb.values()]
-            data = zip(q_data,a_data)
-            df2 = pd.DataFrame(data,index=index,columns=columns)
-            df = pd.merge(df, df2, on = ('disp_cat','account', 'sub_account','item'),how='outer')
+        df = self.tb_grouped_vs_end_to_df(tb_memos)
+        return self.report_cache.put(cache_key,self.get_cache_state(),df)
+
+    def tb_grouped_vs_end_to_df(self,tb_grouped):
+        # {group:tb}（get_tb_groupedの結果）を、groupごとの期末残高を横に並べたDataFrameにする
+        # 列は groupの順に <group>_end_quanitiy,<group>_end_amount　groupがNoneの場合は""（_end_quanitiy,_end_amount）
+        #  "OTHERS"などの名前の取引先等と列名が重ならないように、Noneは空の文字列にする
+        # (表示カテゴリ、account,sub_account_item)をdfのインデックスにする
+        # group×項目ごとに1行の長い形式のDataFrameを作り、一度のpivotで横に並べる
+        long_df = self.tb_grouped_to_long_df(tb_grouped)
+        groups = list(tb_grouped.keys())
+        columns = []
+        for group in groups:
+            if group is None:
+                group=""
+            columns += [group+"_end_quanitiy",group+"_end_amount"]
+        group_columns = [(name,code) for code in range(len(groups)) for name in ("end_quantity","end_amount")]
+        if len(long_df)==0:
+            df = pd.DataFrame(index=long_df.index,columns=columns)
+        else:
+            df = long_df.pivot(columns="group",values=["end_quantity","end_amount"])
+            df = df.reindex(columns=pd.MultiIndex.from_tuples(group_columns))
+            # groupの値がすべてintで欠損がない列はint、recordがないgroupの列はobjectにする
+            # （groupごとにDataFrameを作ってmergeしていた場合と同じdtype）
+            for code,tb in enumerate(tb_grouped.values()):
+                for name in ("end_quantity","end_amount"):
+                    if len(tb)==0:
+                        df[(name,code)] = df[(name,code)].astype(object)
+                    elif all(type(v.get(name,None)) is int for v in tb.values()) and not df[(name,code)].isna().any():
+                        df[(name,code)] = df[(name,code)].astype("int64")
+            df.columns = columns
         df = df.sort_index()
         return df
 
+    def tb_cube_to_df(self,memo_key=None,start_datetime=None,end_datetime=None,wide=False):
+        # 取引先×担当者（×memo_keyの値）ごとの期末残高
+        # recordがある組合せだけを持つので、組合せが多くても大きくならない
+        # wide=False 組合せ×項目ごとに1行の長い形式
+        #  index (disp_cat,account,sub_account,item)　列 partner,person_in_charge,(memo_key),end_quantity,end_amount
+        # wide=True 組合せを列(partner,person_in_charge,(memo_key),end_quantity/end_amount)に並べた疎なDataFrame（pd.SparseDtype）
+        # None は ""　memo_keyの値が文字列でない場合も ""（tb_grouped_vs_end_to_dfと同じ）
+        names = ["partner","person_in_charge"]
+        if memo_key is None:
+            group_func = lambda rec: (rec.get("partner",None),rec.get("person_in_charge",None))
+        else:
+            names.append(memo_key)
+            def group_func(rec):
+                memo = rec.get("memo",None)
+                value = memo.get(memo_key,None) if memo is not None else None
+                if type(value) is not str:
+                    value = None
+                return (rec.get("partner",None),rec.get("person_in_charge",None),value)
+        tb_cube = self.get_tb_grouped(group_func,None,start_datetime,end_datetime)
+        groups = [tuple("" if value is None else value for value in group) for group in tb_cube.keys()]
+        
+        long_df = self.tb_grouped_to_long_df(tb_cube)
+        codes = long_df["group"].to_numpy()
+        if not wide:
+            group_df = pd.DataFrame(groups,columns=names)
+            for i,name in enumerate(names):
+                long_df.insert(i,name,group_df[name].to_numpy()[codes] if len(groups)>0 else [])
+            return long_df.drop(columns="group").sort_index()
+        
+        index = long_df.index.unique().sort_values()
+        positions = index.get_indexer(long_df.index)
+        order = np.argsort(codes,kind="stable")
+        bounds = np.searchsorted(codes[order],np.arange(len(groups)+1))
+        values = {name:pd.to_numeric(long_df[name]).to_numpy(dtype=float,na_value=np.nan) for name in ("end_quantity","end_amount")}
+        data = {}
+        for code,group in enumerate(groups):
+            rows = order[bounds[code]:bounds[code+1]]
+            for name in ("end_quantity","end_amount"):
+                dense = np.full(len(index),np.nan)
+                dense[positions[rows]] = values[name][rows]
+                data[group+(name,)] = pd.arrays.SparseArray(dense,fill_value=np.nan)
+        df = pd.DataFrame(data,index=index)
+        df.columns = pd.MultiIndex.from_tuples(list(data.keys()),names=names+["measure"])
+        return df
+
+    def tb_grouped_to_long_df(self,tb_grouped):
+        # {group:tb} をgroup×項目ごとに1行のDataFrameにする
+        # index (disp_cat,account,sub_account,item)　列 group（tb_groupedでの順番）,end_quantity,end_amount
+        # disp_catは項目ごとに一度だけ求める
+        disp_cats = {}
+        keys = []
+        group_codes = []
+        q_data = []
+        a_data = []
+        for code,tb in enumerate(tb_grouped.values()):
+            for key,v in tb.items():
+                disp_cat = disp_cats.get(key,None)
+                if disp_cat is None:
+                    disp_cat = self.accInfo.get_item_disp_cat(*key)
+                    disp_cats[key] = disp_cat
+                keys.append((disp_cat,key[0],key[1],key[2]))
+                group_codes.append(code)
+                q_data.append(v.get("end_quantity",None))
+                a_data.append(v.get("end_amount",None))
+        index = pd.MultiIndex.from_tuples(keys,names=('disp_cat','account', 'sub_account','item'))
+        return pd.DataFrame({"group":group_codes,"end_quantity":q_data,"end_amount":a_data},index=index)
+
     def tb_memo_vs_end_to_excel(self,memo_key,filename=None,start_datetime=None,end_datetime=None):
         #filename
         basename ="TB_memo_vs_end"+"_"+memo_key
@@ -1282,8 +2708,16 @@ class Ledgers:
 
     def tb_to_df(self,start_datetime=None,end_datetime=None,rec_cond_func=None):
         #tb_dics
+        cache_key = self.report_cache.make_key("tb_to_df",start_datetime,end_datetime,rec_cond_func)
+        out_df = self.report_cache.get(cache_key,self.get_cache_state())
+        if out_df is not None:
+            return out_df
         tb = self.get_tb(start_datetime,end_datetime,rec_cond_func)
-        
+        out_df = self.tb_dic_to_df(tb)
+        return self.report_cache.put(cache_key,self.get_cache_state(),out_df)
+
+    def tb_dic_to_df(self,tb):
+        # get_tbの結果をDataFrameにする（tb_to_df）
         tb_dics = [{**{"account":k[0],"sub_account":k[1],"item":k[2]},**v} for k,v in tb.items()]
                 
         #DataFrame
@@ -1291,7 +2725,6 @@ class Ledgers:
         key_list = ["account","sub_account","item","start_quantity","start_amount","sum_dr_quantity","sum_dr_amount","sum_cr_quantity","sum_cr_amount","end_quantity","end_amount"]
 
         out_df = pd.DataFrame.from_records(tb_dics,columns=key_list)
-
         return out_df
     
     def tb_to_excel(self,filename=None,start_datetime=None,end_datetime=None,rec_cond_func=None):
@@ -1313,73 +2746,131 @@ class Ledgers:
             out_df.to_excel(writer, sheet_name=sheet_name,index_label=basename)            
     
     
+    def tb_periods_to_df(self,periods,start_datetime=None,end_datetime=None,rec_cond_func=None):
+        # 期間別（月次・四半期など）の試算表を横に並べたDataFrame
+        # periods 期間の区切りの日付（ISO 8601 format　の文字列）のリスト 又は "M" "Q" "Y"（get_period_boundaries）
+        cache_key = self.report_cache.make_key("tb_periods_to_df",periods,start_datetime,end_datetime,rec_cond_func)
+        out_df = self.report_cache.get(cache_key,self.get_cache_state())
+        if out_df is not None:
+            return out_df
+        if type(periods) is str:
+            periods = self.get_period_boundaries(periods,start_datetime,end_datetime)
+        tb = self.get_tb_periods(periods,rec_cond_func=rec_cond_func)
+        
+        tb_dics = [{**{"account":k[0],"sub_account":k[1],"item":k[2]},**v} for k,v in tb.items()]
+        
+        #DataFrame
+        key_list = ["account","sub_account","item","start_quantity","start_amount"]
+        for period_start in periods[:-1]:
+            key_list += [period_start+"_sum_dr_quantity",period_start+"_sum_dr_amount",period_start+"_sum_cr_quantity",period_start+"_sum_cr_amount"]
+        key_list += ["end_quantity","end_amount"]
+
+        out_df = pd.DataFrame.from_records(tb_dics,columns=key_list)
+
+        return self.report_cache.put(cache_key,self.get_cache_state(),out_df)
+
+    def tb_periods_to_excel(self,periods,filename=None,start_datetime=None,end_datetime=None,rec_cond_func=None):
+
+        out_df = self.tb_periods_to_df(periods,start_datetime,end_datetime,rec_cond_func)
+        
+        #filename
+        basename ="TB_periods"
+        basename_and_ext = basename +".xlsx"
+        if filename is None:
+            # filename = os.path.join(os.path.dirname(__file__), basename)
+            filename = os.path.join(Path().resolve(), basename_and_ext)
+            
+        #sheet_name
+        sheet_name = basename
+        
+        with pd.ExcelWriter(filename) as writer:  
+            out_df.to_excel(writer, sheet_name=sheet_name,index_label=basename)            
+    
     # memo:[]
     
     def get_partner_list(self):
-        partners =set()
-        for record in self.records:
-            partner = record.get("partner",None)
-            if partner is not None:
-                partners.add(partner)
-        partners_lst = sorted(list(partners))
+        partners_lst = sorted(self.get_record_index().partners.keys())
         return partners_lst
 
     def get_person_in_charge_list(self):
-        person_in_charges =set()
-        for record in self.records:
-            person_in_charge = record.get("person_in_charge",None)
-            if person_in_charge is not None:
-                person_in_charges.add(person_in_charge)
-        person_in_charges_lst = sorted(list(person_in_charges))
+        person_in_charges_lst = sorted(self.get_record_index().person_in_charges.keys())
         return person_in_charges_lst
     
     def get_memo_list(self,memo_key):
-        values = set()
-        for record in self.records:
-            memo = record.get("memo",None)
-            if memo is not None:
-                value = memo.get(memo_key,None)
-                if value is not None:
-                    if type(value) is str:
-                        values.add(value)
-        values_lst = sorted(list(values))
+        memo_values = self.get_record_index().memos.get(memo_key,{})
+        values_lst = sorted([value for value in memo_values.keys() if type(value) is str])
         return values_lst
     
     def get_tb_with_partner(self,start_datetime=None,end_datetime=None):
+        cache_key = self.report_cache.make_key("get_tb_with_partner",start_datetime,end_datetime)
+        tb_with_partner = self.report_cache.get(cache_key,self.get_cache_state())
+        if tb_with_partner is not None:
+            return tb_with_partner
         partners = self.get_partner_list()
         partners.append(None)
-        tb_with_partner={}
-        
-        for partner in partners:
-            rec_cond_func = lambda rec: rec.get("partner",None)==partner
-            tb = self.get_tb(start_datetime,end_datetime,rec_cond_func)
-            tb_with_partner[partner]=tb
-        return tb_with_partner
+        tb_with_partner = self.get_tb_grouped(lambda rec: rec.get("partner",None),partners,start_datetime,end_datetime)
+        return self.report_cache.put(cache_key,self.get_cache_state(),tb_with_partner)
 
     def get_tb_with_person_in_charge(self,start_datetime=None,end_datetime=None):
+        cache_key = self.report_cache.make_key("get_tb_with_person_in_charge",start_datetime,end_datetime)
+        tb_with_pic = self.report_cache.get(cache_key,self.get_cache_state())
+        if tb_with_pic is not None:
+            return tb_with_pic
         pics = self.get_person_in_charge_list()
         pics.append(None)
-        tb_with_pic={}
-        
-        for pic in pics:
-            rec_cond_func = lambda rec: rec.get("person_in_charge",None)==pic
-            tb = self.get_tb(start_datetime,end_datetime,rec_cond_func)
-            tb_with_pic[pic]=tb
-        return tb_with_pic
+        tb_with_pic = self.get_tb_grouped(lambda rec: rec.get("person_in_charge",None),pics,start_datetime,end_datetime)
+        return self.report_cache.put(cache_key,self.get_cache_state(),tb_with_pic)
     
     def get_tb_with_memo(self,memo_key,start_datetime=None,end_datetime=None):
+        cache_key = self.report_cache.make_key("get_tb_with_memo",memo_key,start_datetime,end_datetime)
+        tb_with_memo = self.report_cache.get(cache_key,self.get_cache_state())
+        if tb_with_memo is not None:
+            return tb_with_memo
         memos = self.get_memo_list(memo_key)
         memos.append(None)
-        tb_with_memo={}
-        
-        for memo in memos:
-            rec_cond_func = lambda rec: (rec.get("memo",None) is not None) and (rec["memo"].get(memo_key,None) == memo)
-            tb = self.get_tb(start_datetime,end_datetime,rec_cond_func)
-            tb_with_memo[memo]=tb
-        return tb_with_memo
+        #memoがない場合は()を返し、どのmemoにも集計しない
+        tb_with_memo = self.get_tb_grouped(lambda rec: rec["memo"].get(memo_key,None) if rec.get("memo",None) is not None else (),memos,start_datetime,end_datetime)
+        return self.report_cache.put(cache_key,self.get_cache_state(),tb_with_memo)
+    
+    def get_tb_grouped(self,group_func,groups=None,start_datetime=None,end_datetime=None):
+        # recordsを一度だけ走査して、groupごとの試算表を作成する
+        # group_func recordを引数とし、recordのgroup（partnerなど）を返す関数
+        # groups groupのリスト　戻り値はこの順の {group:tb}（recordがないgroupは空のtb）
+        #  group_func(record)がgroupsに含まれないrecordは集計しない
+        #  groupsがNoneの場合は、recordがあるすべてのgroup（recordに現れた順）
+        # get_tb(start_datetime,end_datetime,lambda rec: group_func(rec)==group) をgroupごとに求めたものと同じ
+        if start_datetime is not None:
+            dt_start_datetime = datetime.datetime.fromisoformat(start_datetime)
+        else:
+            dt_start_datetime  = None
+        if end_datetime is not None:    
+            dt_end_datetime = datetime.datetime.fromisoformat(end_datetime)
+        else:
+            dt_end_datetime  = None
+        if groups is not None:
+            tb_sums = self.get_tb_sums(self.records,dt_start_datetime,dt_end_datetime,group_func,set(groups))
+        else:
+            tb_sums = self.get_tb_sums(self.records,dt_start_datetime,dt_end_datetime,group_func)
+        return self.tb_sums_to_tb_grouped(tb_sums,groups)
+
+    def tb_sums_to_tb_grouped(self,tb_sums,groups=None,disp_cats=None):
+        # (group,account,sub_account,item)ごとの集計結果から {group:tb} を作成する（get_tb_grouped）
+        if groups is not None:
+            group_tb_sums = {group:{} for group in groups}
+        else:
+            group_tb_sums = {}
+        for (group,account,sub_account,item),tb_sum in tb_sums.items():
+            if group not in group_tb_sums:
+                group_tb_sums[group] = {}
+            group_tb_sums[group][(account,sub_account,item)] = tb_sum
+        tb_grouped = {}
+        if disp_cats is None:
+            disp_cats = {}
+        for group,group_tb_sum in group_tb_sums.items():
+            tb_grouped[group] = self.tb_sums_to_tb(group_tb_sum,disp_cats)
+        return tb_grouped
     
     def get_tb(self,start_datetime=None,end_datetime=None,rec_cond_func=None):
-        tb = {}       
         # start_datetime <= 仕訳の日付　< end_datetime
         # を集計
         # end_datetimeは集計範囲に含まれないので注意
@@ -1388,6 +2879,10 @@ class Ledgers:
         # opening_*** 繰越
         # before_start_*** 集計期間より前
         # sum_dr_quantity sum_dr_amount sum_cr_quantity sum_cr_amount 集計期間中
+        cache_key = self.report_cache.make_key("get_tb",start_datetime,end_datetime,rec_cond_func)
+        tb = self.report_cache.get(cache_key,self.get_cache_state())
+        if tb is not None:
+            return tb
         if start_datetime is not None:
             dt_start_datetime = datetime.datetime.fromisoformat(start_datetime)
         else:
@@ -1397,11 +2892,164 @@ class Ledgers:
             dt_end_datetime = datetime.datetime.fromisoformat(end_datetime)
         else:
             dt_end_datetime  = None
-            
-        for record in self.records:
-            if rec_cond_func is not None:
-                if not rec_cond_func(record):
-                    continue
+
+        records = self.select_records(rec_cond_func)
+        tb_sums = self.get_tb_sums(records,dt_start_datetime,dt_end_datetime)
+        tb = self.tb_sums_to_tb(tb_sums)
+        return self.report_cache.put(cache_key,self.get_cache_state(),tb)
+
+    def get_tb_index(self):
+        # 日付で二分探索できる試算表のインデックス
+        # 初回はすべてのrecordから作成し、以降は追加・再計算された項目だけを作り直す
+        # accInfoを変更した場合は作り直す　recordを直接書き換えた場合は self.tb_index.build(self.records) で作り直す
+        accinfo_state = (id(self.accInfo),self.accInfo.version)
+        if self.tb_index is None or self.tb_index.accinfo_state != accinfo_state:
+            self.tb_index = TBIndex(self.accInfo,self.get_datetime)
+            self.tb_index.accinfo_state = accinfo_state
+            self.tb_index.build(self.records)
+        else:
+            self.tb_index.update()
+        return self.tb_index
+
+    def get_tb_indexed(self,start_datetime=None,end_datetime=None):
+        # get_tbと同じ試算表を、TBIndexの二分探索で求める（recordを走査しない）
+        # 期間の合計は累積和の差なので、floatの場合は get_tb と末尾の桁が異なることがある
+        if start_datetime is not None:
+            dt_start_datetime = datetime.datetime.fromisoformat(start_datetime)
+        else:
+            dt_start_datetime  = None
+        if end_datetime is not None:    
+            dt_end_datetime = datetime.datetime.fromisoformat(end_datetime)
+        else:
+            dt_end_datetime  = None
+        tb_sums = self.get_tb_index().get_tb_sums(dt_start_datetime,dt_end_datetime)
+        return self.tb_sums_to_tb(tb_sums)
+
+    def get_balance_as_of(self,account,sub_account="",item="",as_of_datetime=None):
+        # as_of_datetimeより前（as_of_datetimeを含まない）の残高 (quantity,amount)
+        # as_of_datetimeがNoneの場合は全期間の残高
+        if as_of_datetime is not None:
+            dt_as_of_datetime = datetime.datetime.fromisoformat(as_of_datetime)
+        else:
+            dt_as_of_datetime = None
+        quantity,amount = self.get_tb_index().get_balance((account,sub_account,item),dt_as_of_datetime)
+        if self.fixed_point is not None and quantity is not None:
+            quantity = self.fixed_point.from_quantity(quantity)
+            amount = self.fixed_point.from_amount(amount)
+        return (quantity,amount)
+
+    def get_period_boundaries(self,freq,start_datetime=None,end_datetime=None):
+        # 期間の区切りの日付のリスト
+        # freq "M" 月次 "Q" 四半期 "Y" 年次
+        # start_datetimeを指定しない場合は、最初の仕訳の月初から
+        # end_datetimeを指定しない場合は、最後の仕訳を含む期間まで
+        months = {"M":1,"Q":3,"Y":12}.get(freq,None)
+        if months is None:
+            raise ValueError("get_period_boundaries: freq must be 'M', 'Q' or 'Y'.")
+        if start_datetime is None:
+            if self.start_date is None:
+                return []
+            dt_start_datetime = datetime.datetime.fromisoformat(self.start_date)
+            first = datetime.date(dt_start_datetime.year,dt_start_datetime.month,1)
+        else:
+            first = datetime.datetime.fromisoformat(start_datetime).date()
+        if end_datetime is None:
+            if self.end_date is None:
+                return []
+            #最後の仕訳の日付より後の区切りまで
+            last_date = datetime.datetime.fromisoformat(self.end_date).date()
+            include_last = True
+        else:
+            last_date = datetime.datetime.fromisoformat(end_datetime).date()
+            include_last = False
+        boundary = first
+        boundaries = [first]
+        while boundary < last_date or (include_last and boundary == last_date):
+            #月末より後の日は月末にする（1/31の次は2/28,3/31）
+            year,month = divmod(first.month-1+months*len(boundaries),12)
+            year += first.year
+            boundary = datetime.date(year,month+1,min(first.day,calendar.monthrange(year,month+1)[1]))
+            boundaries.append(boundary)
+        return [boundary.isoformat() for boundary in boundaries]
+
+    def get_tb_periods(self,periods,start_datetime=None,end_datetime=None,rec_cond_func=None):
+        # 期間別の試算表　recordsを一度だけ走査して、各recordを期間に振り分ける
+        # periods 期間の区切りの日付（ISO 8601 format　の文字列）のリスト 又は "M" "Q" "Y"
+        #  [b0,b1,...,bk] の場合、期間は b0 <= 日付 < b1 , ... , bk-1 <= 日付 < bk
+        #  b0より前は start_*** に、bk以降は集計しない（get_tb(b0,bk)と同じ）
+        # 戻り値 {(account,sub_account,item):{"start_quantity":..,"start_amount":..,"<期間の開始日>_sum_dr_quantity":..,..,"end_quantity":..,"end_amount":..}}
+        cache_key = self.report_cache.make_key("get_tb_periods",periods,start_datetime,end_datetime,rec_cond_func)
+        tb = self.report_cache.get(cache_key,self.get_cache_state())
+        if tb is not None:
+            return tb
+        if type(periods) is str:
+            boundaries = self.get_period_boundaries(periods,start_datetime,end_datetime)
+        else:
+            boundaries = list(periods)
+        if len(boundaries) < 2:
+            raise ValueError("get_tb_periods: at least 2 period boundaries must be specified.")
+        dt_boundaries = [datetime.datetime.fromisoformat(boundary) for boundary in boundaries]
+        n_periods = len(boundaries)-1
+        
+        records = self.select_records(rec_cond_func)
+        # sums 0,1 opening 2-5 before_start 6-9 集計期間全体 10- 期間ごと（dr_quantity,dr_amount,cr_quantity,cr_amount）
+        tb_sums = self.get_tb_sums_views(records,dt_boundaries=dt_boundaries)[0]
+        
+        tb = {}
+        for key,(side,sums) in tb_sums.items():
+            tb_item = {}
+            if side == "Dr" or side == "Cr":
+                oq,oa,bdq,bda,bcq,bca,dq,da,cq,ca = sums[:10]
+                if side == "Dr":
+                    tb_item["start_quantity"]=oq+bdq-bcq
+                    tb_item["start_amount"]=oa+bda-bca
+                else:
+                    tb_item["start_quantity"]=oq+bcq-bdq
+                    tb_item["start_amount"]=oa+bca-bda
+            for i,period_start in enumerate(boundaries[:-1]):
+                pos = 10+4*i
+                tb_item[period_start+"_sum_dr_quantity"]=sums[pos]
+                tb_item[period_start+"_sum_dr_amount"]=sums[pos+1]
+                tb_item[period_start+"_sum_cr_quantity"]=sums[pos+2]
+                tb_item[period_start+"_sum_cr_amount"]=sums[pos+3]
+            if side == "Dr":
+                tb_item["end_quantity"]=tb_item["start_quantity"]+dq-cq
+                tb_item["end_amount"]=tb_item["start_amount"]+da-ca
+            elif side == "Cr":
+                tb_item["end_quantity"]=tb_item["start_quantity"]+cq-dq
+                tb_item["end_amount"]=tb_item["start_amount"]+ca-da
+            tb[key] = tb_item
+        
+        #sort 表示カテゴリ順にソート
+        tb_lst = sorted(tb.items(),key = lambda x:self.accInfo.get_item_disp_cat(*x[0]))
+        tb = dict((x, y) for x, y in tb_lst)
+        
+        if self.fixed_point is not None:
+            tb = self.fixed_point.from_tb(tb)
+        return self.report_cache.put(cache_key,self.get_cache_state(),tb)
+
+    def get_datetime(self,date_or_datetime):
+        # ISO 8601 format　の文字列をdatetimeに変換する
+        # 同じ文字列は一度だけ変換する
+        dt_datetime = self.datetime_cache.get(date_or_datetime,None)
+        if dt_datetime is None:
+            dt_datetime = datetime.datetime.fromisoformat(date_or_datetime)
+            self.datetime_cache[date_or_datetime] = dt_datetime
+        return dt_datetime
+
+    def get_tb_sums(self,records,dt_start_datetime=None,dt_end_datetime=None,group_func=None,groups=None):
+        # recordsを一度だけ走査して(account,sub_account,item)ごとに集計する
+        # 戻り値 {(account,sub_account,item):[side,sums]}
+        # group_funcを指定した場合は (group_func(record),account,sub_account,item) ごとに集計する
+        #  group_func(record)がgroupsに含まれないrecordは集計しない
+        # sums 
+        #  0 opening_quantity 1 opening_amount
+        #  2 before_start_sum_dr_quantity 3 before_start_sum_dr_amount 4 before_start_sum_cr_quantity 5 before_start_sum_cr_amount
+        #  6 sum_dr_quantity 7 sum_dr_amount 8 sum_cr_quantity 9 sum_cr_amount
+        tb_sums = {}
+        sides = {} ## (account,sub_account,item) -> side
+        datetime_cache = self.datetime_cache
+        for record in records:
             account = record.get("account",None)
             if account is None:
                 continue
@@ -1419,110 +3067,245 @@ class Ledgers:
             date_or_datetime = record.get("datetime",None)
             if date_or_datetime is None:
                 continue
-            dt_datetime_rec = datetime.datetime.fromisoformat(date_or_datetime)
+            dt_datetime_rec = datetime_cache.get(date_or_datetime,None)
+            if dt_datetime_rec is None:
+                dt_datetime_rec = self.get_datetime(date_or_datetime)
             
+            #はじめての項目の場合
+            if group_func is None:
+                key = (account,sub_account,item)
+            else:
+                group = group_func(record)
+                if groups is not None and group not in groups:
+                    continue
+                key = (group,account,sub_account,item)
+            tb_sum = tb_sums.get(key,None)
+            if tb_sum is None:
+                #side
+                side = sides.get((account,sub_account,item),None)
+                if side is None:
+                    side = self.accInfo.get_item_side(account,sub_account,item)
+                    sides[(account,sub_account,item)] = side
+                tb_sum = [side,[0,0,0,0,0,0,0,0,0,0]]
+                tb_sums[key] = tb_sum
+            side,sums = tb_sum
             
             # 期首残高は、memo　key:KIND　value:OPENINGを指定して表現  &KIND::OPENING
-            # 決算整理は、meno key:KIND　value:ADJUSTINGを指定して表現  &KIND::ADJUSTING                
             memo = record.get("memo",None)
             #開始仕訳
-            opening=False
             if "KIND" in memo and memo["KIND"]=="OPENING":
-                opening= True
-            adjusting=False
-            #決算整理仕訳
-            if "KIND" in memo and memo["KIND"]=="ADJUSTING":
-                adjusting= True
-            
-            #はじめての項目の場合
-            key = (account,sub_account,item)
-            if key not in tb:
-                tb.update({key:{"opening_quantity":0,"opening_amount":0,"before_start_sum_dr_quantity":0,"before_start_sum_dr_amount":0,"before_start_sum_cr_quantity":0,"before_start_sum_cr_amount":0,"sum_dr_quantity":0,"sum_dr_amount":0,"sum_cr_quantity":0,"sum_cr_amount":0}})
-            
-            #side
-            side = self.accInfo.get_item_side(account,sub_account,item)
-            
-            #dr_quantityの集計
-            dr_quantity = record.get("dr_quantity",None)
+                if side == "Dr":
+                    sign = 1
+                elif side == "Cr":
+                    sign = -1
+                else:
+                    continue
+                dr_quantity = record.get("dr_quantity",None)
+                if (type(dr_quantity) is int) or (type(dr_quantity) is float):
+                    if sign == 1:
+                        sums[0] += dr_quantity
+                    else:
+                        sums[0] -= dr_quantity
+                dr_amount = record.get("dr_amount",None)
+                if (type(dr_amount) is int) or (type(dr_amount) is float):
+                    if sign == 1:
+                        sums[1] += dr_amount
+                    else:
+                        sums[1] -= dr_amount
+                cr_quantity = record.get("cr_quantity",None)
+                if (type(cr_quantity) is int) or (type(cr_quantity) is float):
+                    if sign == 1:
+                        sums[0] -= cr_quantity
+                    else:
+                        sums[0] += cr_quantity
+                cr_amount = record.get("cr_amount",None)
+                if (type(cr_amount) is int) or (type(cr_amount) is float):
+                    if sign == 1:
+                        sums[1] -= cr_amount
+                    else:
+                        sums[1] += cr_amount
+                continue
+            elif (dt_start_datetime is not None) and (dt_datetime_rec<dt_start_datetime):
+                #集計期間より前
+                pos = 2
+            elif (dt_end_datetime is None) or (dt_datetime_rec<dt_end_datetime):
+                #集計期間中
+                pos = 6
+            else:
+                continue
+
             #None（記載なし）は集計しない
+            dr_quantity = record.get("dr_quantity",None)
             if (type(dr_quantity) is int) or (type(dr_quantity) is float):
-                #開始仕訳の集計
-                if opening:
-                    if side == "Dr":
-                        tb[key]["opening_quantity"] += dr_quantity
-                    if side == "Cr":
-                        tb[key]["opening_quantity"] -= dr_quantity                
-                elif (start_datetime is not None) and (dt_datetime_rec<dt_start_datetime):
-                        tb[key]["before_start_sum_dr_quantity"] += dr_quantity   
-                elif (end_datetime is None) or (dt_datetime_rec<dt_end_datetime):
-                        tb[key]["sum_dr_quantity"] += dr_quantity                     
-                else:
-                    pass
-                
-            #dr_amountの集計
+                sums[pos] += dr_quantity
             dr_amount = record.get("dr_amount",None)
-            #None（記載なし）は集計しない
             if (type(dr_amount) is int) or (type(dr_amount) is float):
-                #開始仕訳の集計
-                if opening:
-                    if side == "Dr":
-                        tb[key]["opening_amount"] += dr_amount
-                    if side == "Cr":
-                        tb[key]["opening_amount"] -= dr_amount                
-                elif (start_datetime is not None) and (dt_datetime_rec<dt_start_datetime):
-                        tb[key]["before_start_sum_dr_amount"] += dr_amount
-                elif (end_datetime is None) or (dt_datetime_rec<dt_end_datetime):
-                        tb[key]["sum_dr_amount"] += dr_amount   
-                else:
-                    pass
-                
-            #cr_quantityの集計
+                sums[pos+1] += dr_amount
             cr_quantity = record.get("cr_quantity",None)
-            #None（記載なし）は集計しない
             if (type(cr_quantity) is int) or (type(cr_quantity) is float):
-                #開始仕訳の集計
-                if opening:
-                    if side == "Dr":
-                        tb[key]["opening_quantity"] -= cr_quantity
-                    if side == "Cr":
-                        tb[key]["opening_quantity"] += cr_quantity
-                elif (start_datetime is not None) and (dt_datetime_rec<dt_start_datetime):
-                        tb[key]["before_start_sum_cr_quantity"] += cr_quantity   
-                elif (end_datetime is None) or (dt_datetime_rec<dt_end_datetime):
-                        tb[key]["sum_cr_quantity"] += cr_quantity                     
-                else:
-                    pass
-                
-            #cr_amountの集計
+                sums[pos+2] += cr_quantity
             cr_amount = record.get("cr_amount",None)
-            #None（記載なし）は集計しない
             if (type(cr_amount) is int) or (type(cr_amount) is float):
-                #開始仕訳の集計
-                if opening:
-                    if side == "Dr":
-                        tb[key]["opening_amount"] -= cr_amount
-                    if side == "Cr":
-                        tb[key]["opening_amount"] += cr_amount                
-                elif (start_datetime is not None) and (dt_datetime_rec<dt_start_datetime):
-                        tb[key]["before_start_sum_cr_amount"] += cr_amount
-                elif (end_datetime is None) or (dt_datetime_rec<dt_end_datetime):
-                        tb[key]["sum_cr_amount"] += cr_amount  
-  
+                sums[pos+3] += cr_amount
+        return tb_sums
+
+    def get_tb_sums_views(self,records,dt_start_datetime=None,dt_end_datetime=None,views=((None,None),),dt_boundaries=None):
+        # get_tb_sumsと同じ集計を、複数の集計方法（view）・複数の期間についてrecordsを一度だけ走査して行う
+        # 1つの期間・1つの集計方法だけの場合は、速いget_tb_sumsを使う
+        # views (group_func,groups) のリスト　group_funcがNoneの場合は (account,sub_account,item) ごと
+        # dt_boundaries 期間の区切りのdatetimeのリスト [b0,b1,...,bk]（get_tb_periods）
+        #  指定した場合は dt_start_datetime=b0 dt_end_datetime=bk とし、
+        #  sumsの 10+4*(j-1) から bj-1 <= 日付 < bj の dr_quantity,dr_amount,cr_quantity,cr_amount を加える
+        # 戻り値 viewsの順のtb_sumsのリスト
+        views = [(group_func,set(groups) if groups is not None else None) for group_func,groups in views]
+        tb_sums_list = [{} for view in views]
+        view_list = [(group_func,groups,tb_sums) for (group_func,groups),tb_sums in zip(views,tb_sums_list)]
+        if dt_boundaries is not None:
+            dt_start_datetime = dt_boundaries[0]
+            dt_end_datetime = dt_boundaries[-1]
+            n_sums = 10+4*(len(dt_boundaries)-1)
+        else:
+            n_sums = 10
+        period_pos_cache = {} ## 日付の文字列 -> 期間ごとの集計の位置
+        sides = {} ## (account,sub_account,item) -> side
+        datetime_cache = self.datetime_cache
+        for record in records:
+            account = record.get("account",None)
+            if account is None:
+                continue
+            #sub_accountは指定されている必要がある
+            #sub_accountを指定しない場合は{"sub_account":""}としておく
+            sub_account = record.get("sub_account",None)
+            if sub_account is None:
+                continue
+            #itemは指定されている必要がある
+            #itemを指定しない場合は{"item":""}としておく
+            item = record.get("item",None)
+            if item is None:
+                continue
+            date_or_datetime = record.get("datetime",None)
+            if date_or_datetime is None:
+                continue
+            dt_datetime_rec = datetime_cache.get(date_or_datetime,None)
+            if dt_datetime_rec is None:
+                dt_datetime_rec = self.get_datetime(date_or_datetime)
+            key = (account,sub_account,item)
+            
+            # 期首残高は、memo　key:KIND　value:OPENINGを指定して表現  &KIND::OPENING
+            memo = record.get("memo",None)
+            period_pos = None
+            if "KIND" in memo and memo["KIND"]=="OPENING":
+                #開始仕訳　sideが不明な場合は集計しない
+                pos = 0
+                if key not in sides:
+                    sides[key] = self.accInfo.get_item_side(account,sub_account,item)
+                side = sides[key]
+                if side == "Dr":
+                    sign = 1
+                elif side == "Cr":
+                    sign = -1
+                else:
+                    pos = -1
+            elif (dt_start_datetime is not None) and (dt_datetime_rec<dt_start_datetime):
+                #集計期間より前
+                pos = 2
+            elif (dt_end_datetime is None) or (dt_datetime_rec<dt_end_datetime):
+                #集計期間中
+                pos = 6
+                if dt_boundaries is not None:
+                    period_pos = period_pos_cache.get(date_or_datetime,None)
+                    if period_pos is None:
+                        period_pos = 10+4*(bisect_right(dt_boundaries,dt_datetime_rec)-1)
+                        period_pos_cache[date_or_datetime] = period_pos
+            else:
+                pos = -1
+            if pos >= 0:
+                #None（記載なし）・OP_***は集計しない（0を加える）
+                dr_quantity = record.get("dr_quantity",None)
+                if (type(dr_quantity) is not int) and (type(dr_quantity) is not float):
+                    dr_quantity = 0
+                dr_amount = record.get("dr_amount",None)
+                if (type(dr_amount) is not int) and (type(dr_amount) is not float):
+                    dr_amount = 0
+                cr_quantity = record.get("cr_quantity",None)
+                if (type(cr_quantity) is not int) and (type(cr_quantity) is not float):
+                    cr_quantity = 0
+                cr_amount = record.get("cr_amount",None)
+                if (type(cr_amount) is not int) and (type(cr_amount) is not float):
+                    cr_amount = 0
+            
+            for group_func,groups,tb_sums in view_list:
+                if group_func is None:
+                    view_key = key
+                else:
+                    group = group_func(record)
+                    if groups is not None and group not in groups:
+                        continue
+                    view_key = (group,account,sub_account,item)
+                tb_sum = tb_sums.get(view_key,None)
+                if tb_sum is None:
+                    #sideは項目ごとに一度だけ求める
+                    if key not in sides:
+                        sides[key] = self.accInfo.get_item_side(account,sub_account,item)
+                    tb_sum = [sides[key],[0]*n_sums]
+                    tb_sums[view_key] = tb_sum
+                if pos < 0:
+                    continue
+                sums = tb_sum[1]
+                if pos == 0:
+                    if sign == 1:
+                        sums[0] += dr_quantity
+                        sums[1] += dr_amount
+                        sums[0] -= cr_quantity
+                        sums[1] -= cr_amount
+                    else:
+                        sums[0] -= dr_quantity
+                        sums[1] -= dr_amount
+                        sums[0] += cr_quantity
+                        sums[1] += cr_amount
+                    continue
+                sums[pos] += dr_quantity
+                sums[pos+1] += dr_amount
+                sums[pos+2] += cr_quantity
+                sums[pos+3] += cr_amount
+                if period_pos is not None:
+                    sums[period_pos] += dr_quantity
+                    sums[period_pos+1] += dr_amount
+                    sums[period_pos+2] += cr_quantity
+                    sums[period_pos+3] += cr_amount
+        return tb_sums_list
+
+    def tb_sums_to_tb(self,tb_sums,disp_cats=None):
+        # get_tb_sumsの集計結果からTBを作成する
+        # start_*** end_*** は項目ごとに一度だけ計算する
+        # disp_cats (account,sub_account,item) -> 表示カテゴリ のキャッシュ（複数のTBで共有する場合に指定）
+        if disp_cats is None:
+            disp_cats = {}
+        tb = {}
+        for key,(side,sums) in tb_sums.items():
+            oq,oa,bdq,bda,bcq,bca,dq,da,cq,ca = sums
+            tb_item = {"opening_quantity":oq,"opening_amount":oa,"before_start_sum_dr_quantity":bdq,"before_start_sum_dr_amount":bda,"before_start_sum_cr_quantity":bcq,"before_start_sum_cr_amount":bca,"sum_dr_quantity":dq,"sum_dr_amount":da,"sum_cr_quantity":cq,"sum_cr_amount":ca}
             if side == "Dr":
-                tb[key]["start_quantity"]=tb[key]["opening_quantity"]+tb[key]["before_start_sum_dr_quantity"]-tb[key]["before_start_sum_cr_quantity"]
-                tb[key]["start_amount"]=tb[key]["opening_amount"]+tb[key]["before_start_sum_dr_amount"]-tb[key]["before_start_sum_cr_amount"]        
-                tb[key]["end_quantity"]=tb[key]["start_quantity"]+tb[key]["sum_dr_quantity"]-tb[key]["sum_cr_quantity"]
-                tb[key]["end_amount"]=tb[key]["start_amount"]+tb[key]["sum_dr_amount"]-tb[key]["sum_cr_amount"]
+                tb_item["start_quantity"]=oq+bdq-bcq
+                tb_item["start_amount"]=oa+bda-bca
+                tb_item["end_quantity"]=tb_item["start_quantity"]+dq-cq
+                tb_item["end_amount"]=tb_item["start_amount"]+da-ca
             elif side == "Cr":
-                tb[key]["start_quantity"]=tb[key]["opening_quantity"]+tb[key]["before_start_sum_cr_quantity"]-tb[key]["before_start_sum_dr_quantity"]
-                tb[key]["start_amount"]=tb[key]["opening_amount"]+tb[key]["before_start_sum_cr_amount"]-tb[key]["before_start_sum_dr_amount"]
-                tb[key]["end_quantity"]=tb[key]["start_quantity"]+tb[key]["sum_cr_quantity"]-tb[key]["sum_dr_quantity"]
-                tb[key]["end_amount"]=tb[key]["start_amount"]+tb[key]["sum_cr_amount"]-tb[key]["sum_dr_amount"]
+                tb_item["start_quantity"]=oq+bcq-bdq
+                tb_item["start_amount"]=oa+bca-bda
+                tb_item["end_quantity"]=tb_item["start_quantity"]+cq-dq
+                tb_item["end_amount"]=tb_item["start_amount"]+ca-da
+            tb[key] = tb_item
         
         #sort 表示カテゴリ順にソート
-        tb_lst = sorted(tb.items(),key = lambda x:self.accInfo.get_item_disp_cat(*x[0]))
+        for key in tb:
+            if key not in disp_cats:
+                disp_cats[key] = self.accInfo.get_item_disp_cat(*key)
+        tb_lst = sorted(tb.items(),key = lambda x:disp_cats[x[0]])
         tb = dict((x, y) for x, y in tb_lst)
         
+        if self.fixed_point is not None:
+            tb = self.fixed_point.from_tb(tb)
         #return tb_lst
         return tb
 
@@ -1796,9 +3579,31 @@ class Ledgers:
         
          #d4 = self.recalc(d3)
         d4 = self.fill_qa(d3,"Dr")
+        d4 = self.to_fixed_point(d4)
         d5 = self.add_memo_type(d4)
         #print("d4",d4)
         self.records.append(d5)
+        self.record_index.add(d5)
+        self.version += 1
+        if self.tb_index is not None:
+            self.tb_index.add(d5)
+
+    def to_fixed_point(self,dic):
+        #dic　を書き換えるので注意
+        #fixed_pointが指定されている場合、数量・金額をscaleを掛けた整数にする
+        if self.fixed_point is None:
+            return dic
+        for name in ("dr_quantity","cr_quantity"):
+            dic[name] = self.fixed_point.to_quantity(dic[name])
+        for name in ("dr_amount","cr_amount"):
+            dic[name] = self.fixed_point.to_amount(dic[name])
+        return dic
+
+    def get_out_amount(self,quantity,out_price):
+        #払出し数量×払出し価格　fixed_pointが指定されている場合は丸めた整数
+        if self.fixed_point is None:
+            return quantity * out_price
+        return self.fixed_point.round_fraction(quantity * out_price)
 
     def add_memo_type(self,dic):
         #dic　を書き換えるので注意
@@ -1838,8 +3643,13 @@ class Ledgers:
         c3 = self.mearge_dic(self.global_header,c2)
         
         c4 = self.fill_qa(c3,"Cr")
+        c4 = self.to_fixed_point(c4)
         c5 = self.add_memo_type(c4)
         self.records.append(c5)
+        self.record_index.add(c5)
+        self.version += 1
+        if self.tb_index is not None:
+            self.tb_index.add(c5)
     
     def get_balance_quantity(self,idx,side="Dr"):
         dr_quantity = [record["dr_quantity"] for record in self.records[:idx]]
@@ -1893,6 +3703,105 @@ class Ledgers:
         
         return out_price
     
+    def get_out_prices_pa(self):
+        # 総平均法の払出し価格を、keyごとにまとめて計算する
+        # 戻り値 key:(account,sub_account,item) value:払出し価格
+        # get_out_price_paと同じ値になるのは、受入側の数量・金額が再計算で変わらない場合なので、
+        # 受入側に演算子がある、受入数量の合計が0のkeyは含めない（get_out_price_paで計算する）
+        # 受入側(side)は、get_out_price_paと同様にLedgerのAccountInfoで判断する
+        #  Ledgerは既定のAccountInfo()（account_info.csv）を使い、self.accInfoのset_item_infoで変えたsideは使わない
+        #  get_out_price_paと同じ値にするため、ここでも既定のAccountInfoを使う（ファイルの読み込みは一度だけ）
+        if self.ledger_accInfo is None:
+            self.ledger_accInfo = AccountInfo()
+        ledger_info = self.ledger_accInfo
+        props = {}
+        key_codes = {}
+        keys = []
+        excluded = set()
+        has_float = set()
+        codes = []
+        in_quantities = []
+        in_amounts = []
+        for record in self.records:
+            account = record.get("account",None)
+            sub_account = record.get("sub_account",None)
+            item = record.get("item",None)
+            key = (account,sub_account,item)
+            prop = props.get(key,None)
+            if prop is None:
+                prop = (self.accInfo.get_item_method(account,sub_account,item),ledger_info.get_item_side(account,sub_account,item))
+                props[key] = prop
+            method,side = prop
+            if method!="PA":
+                continue
+            code = key_codes.get(key,None)
+            if code is None:
+                code = len(keys)
+                key_codes[key] = code
+                keys.append(key)
+            if side=="Dr":
+                in_quantity = record["dr_quantity"]
+                in_amount = record["dr_amount"]
+            elif side=="Cr":
+                in_quantity = record["cr_quantity"]
+                in_amount = record["cr_amount"]
+            else:
+                excluded.add(code)
+                continue
+            if type(in_quantity) is str or type(in_amount) is str:
+                excluded.add(code)
+                continue
+            if (type(in_quantity) is not int) and (type(in_quantity) is not float):
+                in_quantity = None
+            if (type(in_amount) is not int) and (type(in_amount) is not float):
+                in_amount = None
+            if type(in_quantity) is float or type(in_amount) is float:
+                has_float.add(code)
+            codes.append(code)
+            in_quantities.append(in_quantity)
+            in_amounts.append(in_amount)
+        if len(keys)==0:
+            return {}
+
+        #整数だけのkeyはNumPyで合計する（2**53以下なら正確）
+        #floatを含むkeyは、get_out_price_paのsumと同じ順に足す
+        np_codes = np.array(codes,dtype=np.int64)
+        is_int_record = np.array([code not in has_float for code in codes],dtype=bool)
+        int_codes = np_codes[is_int_record]
+        q_values = np.array([0 if v is None else v for v in in_quantities],dtype=object)[is_int_record].astype(np.float64)
+        a_values = np.array([0 if v is None else v for v in in_amounts],dtype=object)[is_int_record].astype(np.float64)
+        sum_quantities = np.bincount(int_codes,weights=q_values,minlength=len(keys))
+        sum_amounts = np.bincount(int_codes,weights=a_values,minlength=len(keys))
+        abs_sums = np.bincount(int_codes,weights=np.abs(q_values)+np.abs(a_values),minlength=len(keys))
+        float_values = {}
+        for code,in_quantity,in_amount in zip(codes,in_quantities,in_amounts):
+            if code in has_float:
+                values = float_values.setdefault(code,([],[]))
+                if in_quantity is not None:
+                    values[0].append(in_quantity)
+                if in_amount is not None:
+                    values[1].append(in_amount)
+
+        out_prices = {}
+        for code,key in enumerate(keys):
+            if code in excluded:
+                continue
+            if code in has_float:
+                all_in_quantity = sum(float_values[code][0])
+                all_in_amount = sum(float_values[code][1])
+            else:
+                if abs_sums[code] > 2**53:
+                    continue
+                all_in_quantity = int(sum_quantities[code])
+                all_in_amount = int(sum_amounts[code])
+            if all_in_quantity==0:
+                continue
+            if self.fixed_point is None:
+                out_prices[key] = all_in_amount/all_in_quantity
+            else:
+                out_prices[key] = Fraction(all_in_amount,all_in_quantity)
+        return out_prices
+
     def get_equal_idx(self,from_entry_id,from_line_no,from_idx):
         equal_idx = None
         for (idx,record) in enumerate(self.records):
@@ -1918,6 +3827,9 @@ class Ledgers:
     def sort_records(self):
         # recordsを日付順（昇順）にソートする　日付が同じ場合は、仕訳番号順（昇順）とする
         self.records = sorted(self.records,key=lambda record : (record.get("datetime",""),record.get("entry_id",0)))
+        self.record_columns = None
+        self.record_index.build(self.records)
+        self.version += 1
     
                               #<record>
     # 期首残高は、memo　key:KIND　value:OPENINGを指定して表現   &KIND::OPENING
@@ -1937,12 +3849,25 @@ class Ledgers:
     # dr_amount
     # cr_quantity
     # cr_amount        
-    def recalc_all(self):
+    def recalc_all(self,trace_cost_flow=False,valuation_backend="python"):
+        # trace_cost_flow: Trueの場合、移動平均法・先入先出法の払出し(OP_AUTO_AMOUNT)と
+        #   それに充てられた受入の対応をself.cost_flowに記録する（参照はself.recordsのindex）
+        # valuation_backend: "numpy"の場合、総平均法の払出し価格をNumPyでまとめて計算する
+        #   （結果は"python"と同じ　移動平均法は払出しごとに在庫金額が決まるので、常に"python"で計算する）
         #再計算前に日付順・仕訳番号にソートする
         self.sort_records()
         
-        q_ma = ItemQueueMA()
-        q_fifo = ItemQueueFIFO()
+        if trace_cost_flow:
+            self.cost_flow = CostFlowIndex()
+        else:
+            self.cost_flow = None
+        q_ma = ItemQueueMA(self.cost_flow,self.fixed_point)
+        q_fifo = ItemQueueFIFO(self.cost_flow,self.fixed_point)
+        out_prices_pa = {}
+        if valuation_backend=="numpy":
+            out_prices_pa = self.get_out_prices_pa()
+        elif valuation_backend!="python":
+            raise ValueError("recalc_all: valuation_backend must be 'python' or 'numpy'.")
         entry_id = -1
         for (idx,record) in enumerate(self.records):
             last_entry_id = entry_id
@@ -1991,44 +3916,46 @@ class Ledgers:
             if method=="LPC":
                 if dr_amount=="OP_AUTO_AMOUNT":
                     out_price = self.get_out_price_lpc(account,sub_account,item)
-                    self.records[idx]["dr_amount"] = dr_quantity * out_price
+                    self.records[idx]["dr_amount"] = self.get_out_amount(dr_quantity,out_price)
             elif method=="PA":
                 if dr_amount=="OP_AUTO_AMOUNT":
-                    out_price = self.get_out_price_pa(account,sub_account,item)
-                    self.records[idx]["dr_amount"] = dr_quantity * out_price
+                    out_price = out_prices_pa.get((account,sub_account,item),None)
+                    if out_price is None:
+                        out_price = self.get_out_price_pa(account,sub_account,item)
+                    self.records[idx]["dr_amount"] = self.get_out_amount(dr_quantity,out_price)
             elif method=="MA":
                 if dr_amount=="OP_AUTO_AMOUNT":
                     if side == "Dr":
-                        out_quantity,out_amount = q_ma.get(account,sub_account,item,-dr_quantity)
+                        out_quantity,out_amount = q_ma.get(account,sub_account,item,-dr_quantity,idx)
                         self.records[idx]["dr_quantity"]=-out_quantity
                         self.records[idx]["dr_amount"]=-out_amount                        
                     elif side =="Cr":
-                        out_quantity,out_amount = q_ma.get(account,sub_account,item,dr_quantity)
+                        out_quantity,out_amount = q_ma.get(account,sub_account,item,dr_quantity,idx)
                         self.records[idx]["dr_quantity"]=out_quantity
                         self.records[idx]["dr_amount"]=out_amount
                 elif (type(dr_amount) is int) or (type(dr_amount) is float):
                     if side == "Dr":
-                        q_ma.put(account,sub_account,item,dr_quantity,dr_amount)
+                        q_ma.put(account,sub_account,item,dr_quantity,dr_amount,idx)
                     elif side =="Cr":
-                        q_ma.put(account,sub_account,item,-dr_quantity,-dr_amount)
+                        q_ma.put(account,sub_account,item,-dr_quantity,-dr_amount,idx)
                 else:
                     #dr_amount is None
                     pass
             elif method=="FIFO":
                 if dr_amount=="OP_AUTO_AMOUNT":
                     if side == "Dr":
-                        out_quantity,out_amount = q_fifo.get(account,sub_account,item,-dr_quantity)
+                        out_quantity,out_amount = q_fifo.get(account,sub_account,item,-dr_quantity,idx)
                         self.records[idx]["dr_quantity"]=-out_quantity
                         self.records[idx]["dr_amount"]=-out_amount                        
                     elif side =="Cr":
-                        out_quantity,out_amount = q_fifo.get(account,sub_account,item,dr_quantity)
+                        out_quantity,out_amount = q_fifo.get(account,sub_account,item,dr_quantity,idx)
                         self.records[idx]["dr_quantity"]=out_quantity
                         self.records[idx]["dr_amount"]=out_amount
                 elif (type(dr_amount) is int) or (type(dr_amount) is float):
                     if side == "Dr":
-                        q_fifo.put(account,sub_account,item,dr_quantity,dr_amount)
+                        q_fifo.put(account,sub_account,item,dr_quantity,dr_amount,idx)
                     elif side =="Cr":
-                        q_fifo.put(account,sub_account,item,-dr_quantity,-dr_amount)
+                        q_fifo.put(account,sub_account,item,-dr_quantity,-dr_amount,idx)
                 else:
                     #dr_amount is None
                     pass
@@ -2040,26 +3967,28 @@ class Ledgers:
             if method=="LPC":
                 if cr_amount=="OP_AUTO_AMOUNT":
                     out_price = self.get_out_price_lpc(account,sub_account,item)
-                    self.records[idx]["cr_amount"] = cr_quantity * out_price
+                    self.records[idx]["cr_amount"] = self.get_out_amount(cr_quantity,out_price)
             elif method=="PA":
                 if cr_amount=="OP_AUTO_AMOUNT":
-                    out_price = self.get_out_price_pa(account,sub_account,item)
-                    self.records[idx]["cr_amount"] = cr_quantity * out_price
+                    out_price = out_prices_pa.get((account,sub_account,item),None)
+                    if out_price is None:
+                        out_price = self.get_out_price_pa(account,sub_account,item)
+                    self.records[idx]["cr_amount"] = self.get_out_amount(cr_quantity,out_price)
             elif method=="MA":
                 if cr_amount=="OP_AUTO_AMOUNT":
                     if side == "Dr":
-                        out_quantity,out_amount = q_ma.get(account,sub_account,item,cr_quantity)
+                        out_quantity,out_amount = q_ma.get(account,sub_account,item,cr_quantity,idx)
                         self.records[idx]["cr_quantity"]=out_quantity
                         self.records[idx]["cr_amount"]=out_amount                        
                     elif side =="Cr":
-                        out_quantity,out_amount = q_ma.get(account,sub_account,item,-cr_quantity)
+                        out_quantity,out_amount = q_ma.get(account,sub_account,item,-cr_quantity,idx)
                         self.records[idx]["cr_quantity"]=-out_quantity
                         self.records[idx]["cr_amount"]=-out_amount
                 elif (type(cr_amount) is int) or (type(cr_amount) is float):
                     if side == "Dr":
-                        q_ma.put(account,sub_account,item,-cr_quantity,-cr_amount)
+                        q_ma.put(account,sub_account,item,-cr_quantity,-cr_amount,idx)
                     elif side =="Cr":
-                        q_ma.put(account,sub_account,item,cr_quantity,cr_amount)
+                        q_ma.put(account,sub_account,item,cr_quantity,cr_amount,idx)
                 else:
                     #cr_amount is None
                     pass
@@ -2067,18 +3996,18 @@ class Ledgers:
             elif method=="FIFO":
                 if cr_amount=="OP_AUTO_AMOUNT":
                     if side == "Dr":
-                        out_quantity,out_amount = q_fifo.get(account,sub_account,item,cr_quantity)
+                        out_quantity,out_amount = q_fifo.get(account,sub_account,item,cr_quantity,idx)
                         self.records[idx]["cr_quantity"]=out_quantity
                         self.records[idx]["cr_amount"]=out_amount                        
                     elif side =="Cr":
-                        out_quantity,out_amount = q_fifo.get(account,sub_account,item,-cr_quantity)
+                        out_quantity,out_amount = q_fifo.get(account,sub_account,item,-cr_quantity,idx)
                         self.records[idx]["cr_quantity"]=-out_quantity
                         self.records[idx]["cr_amount"]=-out_amount
                 elif (type(cr_amount) is int) or (type(cr_amount) is float):
                     if side == "Dr":
-                        q_fifo.put(account,sub_account,item,-cr_quantity,-cr_amount)
+                        q_fifo.put(account,sub_account,item,-cr_quantity,-cr_amount,idx)
                     elif side =="Cr":
-                        q_fifo.put(account,sub_account,item,cr_quantity,cr_amount)
+                        q_fifo.put(account,sub_account,item,cr_quantity,cr_amount,idx)
                 else:
                     #cr_amount is None
                     pass
@@ -2151,6 +4080,12 @@ class Ledgers:
                 diff_amount = self.calc_diff_amount(entry_id,to_amount)
                 self.records[to_idx][to_amount]=diff_amount
 
+        self.version += 1
+        #OP_***で数量・金額が決まった項目だけTBIndexを作り直す
+        if self.tb_index is not None:
+            self.tb_index.mark_operator_keys()
+            self.tb_index.update()
+
 class  InterpretBaseTree(Interpreter):
     
     def param_pair(self, tree):
@@ -2459,9 +4394,9 @@ class  InterpretJournalTree(InterpretBaseTree):
         self.entry_id =0
         pass
 
-    def get_ledgers(self,tree_journal):
+    def get_ledgers(self,tree_journal,fixed_point=None):
         
-        lgs = Ledgers()
+        lgs = Ledgers(fixed_point)
         
         #get journal ref_memo filled
         journal = self.visit(tree_journal)
@@ -2734,9 +4669,197 @@ class  InterpretJournalTree(InterpretBaseTree):
             return None
 
 
+class  InterpretJournalDic:
+    # journal_dic（QTYJournalTreeToDic・CSVTreeToJournalDicの形式）から、テキスト・構文木を作らずにLedgersを作成する
+    # memo・ref_memoの扱いはInterpretJournalTreeと同じ
+    #  ref_memoは 行のmemo -> 仕訳のheaderのmemo -> それまでのheaderだけの仕訳のmemo の順に探す
+    #  仕訳はdatetimeの順（同じ場合は元の順）に処理し、entry_idは0から順に付ける
+    # 値の形式
+    #  datetime: "2022-01-01" または ["DATETIME","2022-01-01"]
+    #  quantity: number | "OP_***" | {"op_quantity":"OP_***"} | {"ref_memo":key}
+    #  amount: number | "OP_***" | {"op_amount":"OP_***"} | {"ref_memo":key}
+    #  memo: {key:str} | {key:(number,unit)}（JSONのリストも可）　それ以外の値は無視する
+    def __init__(self):
+        self.entry_id =0
+        self.memo_global={}
+        self.memo_journal_entry={}
+        self.memo_local={}
+
+    def get_ledgers(self,journal_dic,fixed_point=None):
+        # journal_dic {"journal":[...]} または要素のiterable（JournalJSONLines.iter_elements()など）
+        lgs = Ledgers(fixed_point)
+        journal = self.journal(journal_dic)
+        for journal_entry in journal["journal_entries"]:
+            lgs.register(journal_entry)
+        lgs.recalc_all()
+        return lgs
+
+    def get_str_datetime_from_journal_entry_dic(self,journal_entry_dic):
+        entry_header_dic = journal_entry_dic.get("entry_header",None) or {}
+        datetime = self.get_datetime(entry_header_dic.get("datetime",None))
+        if datetime is None:
+            return ''
+        return datetime
+
+    def get_datetime(self,datetime):
+        #"2022-01-01" ["DATETIME","2022-01-01"]
+        if type(datetime) is list or type(datetime) is tuple:
+            return datetime[-1]
+        return datetime
+
+    def journal(self,journal_dic):
+        #{journal_entries:[{},{},...],"texts":["Hello","Hi",...]}
+        self.memo_global={}
+        journal = {"journal_entries":[],"texts":[]}
+        if type(journal_dic) is dict:
+            elements = journal_dic.get("journal",[])
+        else:
+            elements = journal_dic
+        journal_entry_dics = []
+        for element in elements:
+            if type(element) is str:
+                journal["texts"].append(element)
+            elif type(element) is dict:
+                journal_entry_dic = element.get("journal_entry",None)
+                if journal_entry_dic is not None and journal_entry_dic.get("entry_header",None) is not None:
+                    journal_entry_dics.append(journal_entry_dic)
+
+        sorted_journal_entry_dics = sorted(journal_entry_dics,key = self.get_str_datetime_from_journal_entry_dic)
+        for journal_entry_dic in sorted_journal_entry_dics:
+            journal_entry = self.journal_entry(journal_entry_dic)
+            if ("debit" not in journal_entry) and ("credit" not in journal_entry):
+                #headerだけの仕訳のmemoは、以降の仕訳のref_memoで参照する
+                self.memo_global.update(self.memo_journal_entry)
+            journal_entry["entry_header"]["entry_id"] = self.entry_id
+            journal["journal_entries"].append(journal_entry)
+            self.entry_id +=1
+        return journal
+
+    def journal_entry(self,journal_entry_dic):
+        # InterpretJournalTree.journal_entryと同じ形式
+        self.memo_journal_entry ={}
+        journal_entry = {}
+        order_id = 0
+        line_no = {"debit":0,"credit":0}
+        journal_entry["entry_header"] = self.entry_header(journal_entry_dic["entry_header"])
+        for debit_or_credit in journal_entry_dic.get("body",[]):
+            for side in ("debit","credit"):
+                debit_or_credit_dic = debit_or_credit.get(side,None)
+                #勘定科目の指定がないものは無視する（JournalDicToTextと同じ）
+                if debit_or_credit_dic is None or debit_or_credit_dic.get("account",None) is None:
+                    continue
+                line = self.debit_or_credit(debit_or_credit_dic)
+                line["order_id"]=order_id
+                line["line_no"]=line_no[side]
+                order_id += 1
+                line_no[side] += 1
+                if side not in journal_entry:
+                    journal_entry[side]=[line]
+                else:
+                    journal_entry[side].append(line)
+        journal_entry["entry_footer"] = {}
+        return journal_entry
+
+    def get_memo(self,memo_dic):
+        # 文字列と(数値,単位)だけ
+        memo = {}
+        for k,v in (memo_dic or {}).items():
+            if type(v) is str:
+                memo[k] = v
+            elif (type(v) is tuple or type(v) is list) and len(v)>=2:
+                memo[k] = (v[0],v[1])
+        return memo
+
+    def set_params(self,target,dic):
+        # partner person_in_charge memo remarks
+        for key in ("partner","person_in_charge"):
+            value = dic.get(key,None)
+            if type(value) is dict:
+                if "ref_memo" in value:
+                    target[key] = self.getMemoValue(value["ref_memo"])
+            elif value is not None:
+                target[key] = value
+        memo = self.get_memo(dic.get("memo",None))
+        if memo:
+            target["memo"] = memo
+        remarks = dic.get("remarks",None)
+        if remarks is not None:
+            target["remarks"] = remarks
+        return target
+
+    def entry_header(self,entry_header_dic):
+        # headerのref_memoは、headerのmemo -> memo_globalの順に探す
+        self.memo_local = {}
+        self.memo_journal_entry.update(self.get_memo(entry_header_dic.get("memo",None)))
+        entry_header = {}
+        datetime = self.get_datetime(entry_header_dic.get("datetime",None))
+        if datetime is not None:
+            entry_header["datetime"] = datetime
+        return self.set_params(entry_header,entry_header_dic)
+
+    def debit_or_credit(self,debit_or_credit_dic):
+        ## memoを先に求めて、ref_memoに使う
+        self.memo_local = self.get_memo(debit_or_credit_dic.get("memo",None))
+        line = {"account":debit_or_credit_dic["account"]}
+        for key in ("sub_account","item"):
+            value = debit_or_credit_dic.get(key,None)
+            if type(value) is dict:
+                if "ref_memo" in value:
+                    value = self.getMemoValue(value["ref_memo"])
+                    if type(value) is not str:
+                        raise ValueError('%s must be string.' % key)
+                    line[key] = value
+            elif type(value) is str:
+                line[key] = value
+        price = self.get_number(debit_or_credit_dic.get("price",None),"price")
+        if price is not None:
+            line["price"] = price
+        quantity = self.get_number(debit_or_credit_dic.get("quantity",None),"quantity","op_quantity")
+        if quantity is not None:
+            line["quantity"] = quantity
+        if debit_or_credit_dic.get("quantity_unit",None) is not None:
+            line["quantity_unit"] = debit_or_credit_dic["quantity_unit"]
+        amount = self.get_number(debit_or_credit_dic.get("amount",None),"amount","op_amount")
+        if amount is not None:
+            line["amount"] = amount
+        if debit_or_credit_dic.get("amount_unit",None) is not None:
+            line["amount_unit"] = debit_or_credit_dic["amount_unit"]
+        return self.set_params(line,debit_or_credit_dic)
+
+    def get_number(self,value,name,op_key=None):
+        #number | "OP_***" | {op_key:"OP_***"} | {"ref_memo":key}
+        if value is None:
+            return None
+        if (type(value) is int) or (type(value) is float):
+            return value
+        if type(value) is str and op_key is not None:
+            return value
+        if type(value) is dict:
+            if op_key is not None and op_key in value:
+                return value[op_key]
+            if "ref_memo" in value:
+                ref_memo = self.getMemoValue(value["ref_memo"])
+                if type(ref_memo) is tuple and len(ref_memo)>=2:
+                    if (type(ref_memo[0]) is float) or (type(ref_memo[0]) is int):
+                        # unit is ignored
+                        return ref_memo[0]
+        raise ValueError('%s must be number%s.' % (name," or operator" if op_key is not None else ""))
+
+    def getMemoValue(self,key):
+        if key in self.memo_local:
+            return self.memo_local[key]
+        elif key in self.memo_journal_entry:
+            return self.memo_journal_entry[key]
+        elif key in self.memo_global:
+            return self.memo_global[key]
+        else:
+            return None
+
+
 class QTYJournalDicToTree:
     def __init__(self):
         self.default_json_filename="QTYjournalDic.json"
+        self.default_jsonl_filename="QTYjournalDic.jsonl"
         
     def save_json(self,journal_dic,filename=None):
         if filename is None:
@@ -2755,6 +4878,33 @@ class QTYJournalDicToTree:
             
         return journal_dic
 
+    def save_jsonl(self,journal_dic,filename=None):
+        # JSON Lines形式で保存する（1行に1つのjournal_entryまたはtext）　書き出した行数を返す
+        # journal_dic {"journal":[...]} または要素のiterable
+        if filename is None:
+            filename = os.path.join(Path().resolve(), self.default_jsonl_filename)
+        if type(journal_dic) is dict:
+            elements = journal_dic.get("journal",[])
+        else:
+            elements = journal_dic
+        return JournalJSONLines(filename).write(elements)
+
+    def get_jsonl(self,filename=None):
+        # JSON Lines形式のファイル（iter_elements(start,stop)で順に読む・[i]で索引を使ってi番目を読む）
+        if filename is None:
+            filename = os.path.join(Path().resolve(), self.default_jsonl_filename)
+        return JournalJSONLines(filename)
+
+    def load_jsonl(self,filename=None):
+        # load_jsonと同じ {"journal":[...]}
+        return {"journal":list(self.get_jsonl(filename).iter_elements())}
+
+    def load_jsonl_to_tree(self,filename=None):
+        # journal_entryを1行ずつ読んでTreeにする
+        journal_jsonl = self.get_jsonl(filename)
+        children = self.make_children_from_journai_list(journal_jsonl.iter_elements())
+        return Tree(Token("RULE","journal"),children)
+
     def load_json_to_tree(self,filename=None):
         
         journal_dic = self.load_json(filename)
@@ -3054,14 +5204,14 @@ class JournalDicToText:
     def __init__(self):
         self.default_journal_filename="journal.txt"
 
-    def save_journal_text(self,csv_tree,filename=None):
-        journal_text = self.get_journal_text(csv_tree)
+    def save_journal_text(self,journal_dic,filename=None):
+        # journal_dic {"journal":[...]} または要素のiterable　仕訳ごとに書き出す（全体の文字列は作らない）
         if filename is None:
             # filename = os.path.join(os.path.dirname(__file__), ACCOUNT_INFO_FILENAME)
             filename = os.path.join(Path().resolve(), self.default_journal_filename)
 
         with open(filename, 'w', newline=None,encoding='utf-8') as f:
-            f.write(journal_text)
+            return self.write_text_from_journal_dic(journal_dic,f)
     
     def get_op_quantity_mark(self,signature):
         op_quantity_dic = {"OP_BALANCE_QUANTITY":"*B","OP_DIFF_QUANTITY":"*D","OP_EQUAL_QUANTITY":"*E"}
@@ -3254,43 +5404,52 @@ class JournalDicToText:
         
         return entry_text
     
-    def get_text_from_journal_dic(self,journal_dic):
-        journal_text =""
-        journal = journal_dic.get("journal",[])
+    def get_entry_text(self,journal_entry):
+        # journal_entryのテキスト　headerがない場合はNone
+        entry_header = journal_entry.get("entry_header",None)
+        if entry_header is None:
+            return None
+        lines = [self.get_header_text(entry_header)]
+        #body
+        #headerのみで、bodyがない場合もある
+        body = journal_entry.get("body",[])
+        for entry in body:
+            debit_or_credit_text = self.get_debit_or_credit_text_from_entry(entry)
+            if debit_or_credit_text is not None:
+                lines.append(debit_or_credit_text)
+        #footer
+        #entry_footer = journal_entry.get("entry_footer",None)
+        #フッターの有無にかかわらす、_ENTRY_END_MARKを入れる
+        lines.append(">>\n")
+        return "\n".join(lines)
+
+    def iter_text_from_journal_dic(self,journal_dic):
+        # 仕訳ごとのテキストを順に返す
+        # journal_dic {"journal":[...]} または要素のiterable（JournalJSONLines.iter_elements()など）
+        if type(journal_dic) is dict:
+            journal = journal_dic.get("journal",[])
+        else:
+            journal = journal_dic
         for entry in journal:
-            entry_text =""
             if type(entry) is not dict:
                 continue
-            if "journal_entry" not in entry:
-                continue
             journal_entry = entry.get("journal_entry",None)
             if journal_entry is None:
                 continue
-                
-            #header
-            entry_header = journal_entry.get("entry_header",None)
-            if entry_header is None:
-                continue
-            entry_text  = self.get_header_text(entry_header)   
-            entry_text += "\n"
-            
-            #body
-            #headerのみで、bodyがない場合もある
-            body = journal_entry.get("body",[])
-            for entry in body:
-                debit_or_credit_text = self.get_debit_or_credit_text_from_entry(entry)
-                if debit_or_credit_text is not None:
-                    entry_text += debit_or_credit_text
-                    entry_text += "\n"
-                    
-            #footer
-            #entry_footer = journal_entry.get("entry_footer",None)
-            #フッターの有無にかかわらす、_ENTRY_END_MARKを入れる
-            entry_text += ">>\n"
-            
-            journal_text += entry_text
-        
-        return journal_text
+            entry_text = self.get_entry_text(journal_entry)
+            if entry_text is not None:
+                yield entry_text
+
+    def write_text_from_journal_dic(self,journal_dic,f):
+        # 仕訳ごとにファイルfに書き出す　書き出した仕訳の数を返す
+        count = 0
+        for entry_text in self.iter_text_from_journal_dic(journal_dic):
+            f.write(entry_text)
+            count += 1
+        return count
+
+    def get_text_from_journal_dic(self,journal_dic):
+        return "".join(self.iter_text_from_journal_dic(journal_dic))
 
 
 def main():
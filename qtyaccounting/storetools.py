@@ -0,0 +1,707 @@
+# Copyright (c) 2022 Kenichi Nakatani
+# This file is part of QTYAccounting.
+# QTYAccounting is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# QTYAccounting is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with QTYAccounting. If not, see <https://www.gnu.org/licenses/>.
+import os
+import json
+import mmap
+import pickle
+import sqlite3
+import datetime
+from pathlib import Path
+import numpy as np
+from .qtytools import Ledgers,FixedPoint
+
+EPOCH = datetime.datetime(1970,1,1)
+
+def to_epoch_microseconds(date_or_datetime):
+    # ISO 8601 format　の文字列を1970-01-01からのマイクロ秒（整数）にする
+    # タイムゾーンがある場合はUTCにする
+    if date_or_datetime is None:
+        return None
+    dt_datetime = datetime.datetime.fromisoformat(date_or_datetime)
+    if dt_datetime.tzinfo is not None:
+        dt_datetime = dt_datetime.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (dt_datetime - EPOCH) // datetime.timedelta(microseconds=1)
+
+def to_json(value):
+    # recordの値（memoなど）・global_headerをJSONの文字列にする（NaN・infもそのまま）
+    return json.dumps(value,ensure_ascii=False)
+
+def from_json_value(value):
+    # recordの値にlistはない（memoの(数値,単位)はtuple）ので、JSONのlistはtupleに戻す
+    if type(value) is list:
+        return tuple(from_json_value(v) for v in value)
+    if type(value) is dict:
+        return {k:from_json_value(v) for k,v in value.items()}
+    return value
+
+def from_json(text):
+    return from_json_value(json.loads(text))
+
+class SQLiteLedgersStore:
+    """
+    recalc_all後のLedgersのrecordsをSQLiteのデータベースに保存する
+    get_records・get_tb・get_partner_listなどは、Ledgersを作らずに索引を使ったSQLで求める
+    load_ledgers()でLedgersに戻す（構文解析・recalc_allは不要）
+    recordの値は型ごとの列に保存し、列の型に合わない値（OP_***・NaNなど）はextras（JSON）に保存する
+    """
+    format_version = 2
+    string_keys = ("datetime","account","sub_account","item","partner","person_in_charge","remarks")
+    int_keys = ("entry_id","line_no","order_id","counts_dr_cr")
+    number_keys = ("dr_quantity","dr_amount","cr_quantity","cr_amount","quantity","amount")
+    tb_number_keys = ("dr_quantity","dr_amount","cr_quantity","cr_amount")
+    json_keys = ("memo","memo_str","memo_number","memo_number_unit")
+    column_keys = string_keys+int_keys+number_keys+json_keys
+    int_min,int_max = -2**63,2**63-1 ## SQLiteのINTEGERの範囲
+
+    def __init__(self,filename=None):
+        if filename is None:
+            filename = os.path.join(Path().resolve(),"Ledgers.sqlite3")
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.ledgers = None ## 保存したAccountInfo・FixedPointを持つLedgers（recordsは空）　get_tbで使用
+        self.key_orders = None ## key_orderのコード -> recordのkeyの順と、各keyの値の列の位置
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def create_tables(self):
+        # 数量・金額の列は型を指定しない（int・floatをそのまま保存する）　memoなどはJSON
+        # key_orderはrecordのkeyの順（record_keysのコード）　値がNoneのkeyは列がNULLになるので、keyの有無もここで区別する
+        self.connection.executescript("""
+            DROP TABLE IF EXISTS records;
+            DROP TABLE IF EXISTS record_keys;
+            DROP TABLE IF EXISTS memos;
+            DROP TABLE IF EXISTS item_info;
+            DROP TABLE IF EXISTS meta;
+            CREATE TABLE records(pos INTEGER PRIMARY KEY,key_order INTEGER,ts INTEGER,opening INTEGER,
+                datetime TEXT,account TEXT,sub_account TEXT,item TEXT,partner TEXT,person_in_charge TEXT,remarks TEXT,
+                entry_id INTEGER,line_no INTEGER,order_id INTEGER,counts_dr_cr INTEGER,
+                dr_quantity,dr_amount,cr_quantity,cr_amount,quantity,amount,
+                memo TEXT,memo_str TEXT,memo_number TEXT,memo_number_unit TEXT,extras TEXT);
+            CREATE TABLE record_keys(code INTEGER PRIMARY KEY,keys TEXT);
+            CREATE TABLE memos(pos INTEGER,memo_key TEXT,value TEXT,number,unit TEXT);
+            CREATE TABLE item_info(account TEXT,sub_account TEXT,item TEXT,info TEXT);
+            CREATE TABLE meta(key TEXT PRIMARY KEY,value TEXT);
+        """)
+
+    def create_indexes(self):
+        self.connection.executescript("""
+            CREATE INDEX records_key ON records(account,sub_account,item,pos);
+            CREATE INDEX records_ts ON records(ts);
+            CREATE INDEX records_entry_id ON records(entry_id,line_no);
+            CREATE INDEX records_partner ON records(partner);
+            CREATE INDEX records_person_in_charge ON records(person_in_charge);
+            CREATE INDEX memos_key_value ON memos(memo_key,value,pos);
+        """)
+
+    def get_record_row(self,pos,record,key_orders):
+        # key_orders: recordのkeyの順 -> コード（保存中に追加する）
+        int_min,int_max = self.int_min,self.int_max
+        values = {}
+        extras = {}
+        for k,v in record.items():
+            if v is None:
+                continue
+            if k in self.string_keys:
+                is_column = type(v) is str
+            elif k in self.int_keys:
+                is_column = type(v) is int and int_min <= v <= int_max
+            elif k in self.number_keys:
+                #OP_***・NaN（SQLiteではNULLになる）はextras（get_tbで集計しない）
+                is_column = (type(v) is int and int_min <= v <= int_max) or (type(v) is float and v == v)
+            elif k in self.json_keys:
+                is_column = True
+                v = to_json(v)
+            else:
+                is_column = False
+            if is_column:
+                values[k] = v
+            else:
+                extras[k] = v
+        memo = record.get("memo",None) or {}
+        opening = 1 if memo.get("KIND",None)=="OPENING" else 0
+        key_order = key_orders.setdefault(tuple(record),len(key_orders))
+        row = [pos,key_order,to_epoch_microseconds(record.get("datetime",None)),opening]
+        row += [values.get(key,None) for key in self.column_keys]
+        row.append(to_json(extras) if extras else None)
+        return row
+
+    def get_memo_rows(self,pos,record):
+        memo = record.get("memo",None) or {}
+        for k,v in memo.items():
+            if type(v) is tuple:
+                yield (pos,k,None,v[0],v[1])
+            elif type(v) is str:
+                yield (pos,k,v,None,None)
+
+    def save(self,ledgers):
+        # ledgersのrecords・AccountInfo・FixedPoint・global_header・start_date・end_dateを保存する（前に保存したものは削除する）
+        connection = self.connection
+        with connection:
+            self.create_tables()
+            records = ledgers.records
+            key_orders = {}
+            connection.executemany("INSERT INTO records VALUES (%s)" % ",".join(["?"]*(len(self.column_keys)+5)),(self.get_record_row(pos,record,key_orders) for pos,record in enumerate(records)))
+            connection.executemany("INSERT INTO record_keys VALUES (?,?)",((code,to_json(keys)) for keys,code in key_orders.items()))
+            connection.executemany("INSERT INTO memos VALUES (?,?,?,?,?)",(row for pos,record in enumerate(records) for row in self.get_memo_rows(pos,record)))
+            connection.executemany("INSERT INTO item_info VALUES (?,?,?,?)",((key[0],key[1],key[2],json.dumps(info,ensure_ascii=False)) for key,info in ledgers.accInfo.item_info.items()))
+            fixed_point = ledgers.fixed_point
+            if fixed_point is not None:
+                fixed_point_info = {"amount_scale":fixed_point.amount_scale,"quantity_scale":fixed_point.quantity_scale,"rounding":fixed_point.rounding}
+            else:
+                fixed_point_info = None
+            meta = {"format_version":str(self.format_version),"fixed_point":json.dumps(fixed_point_info),"global_header":to_json(ledgers.global_header),"start_date":to_json(ledgers.start_date),"end_date":to_json(ledgers.end_date)}
+            connection.executemany("INSERT INTO meta VALUES (?,?)",meta.items())
+            self.create_indexes()
+        self.ledgers = None
+        self.key_orders = None
+
+    def get_meta(self,key):
+        row = self.connection.execute("SELECT value FROM meta WHERE key=?",(key,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def get_ledgers(self):
+        # AccountInfo・FixedPointだけを持つLedgers（recordsは空）
+        if self.ledgers is None:
+            format_version = self.get_meta("format_version")
+            if format_version is None:
+                raise ValueError("SQLiteLedgersStore: '%s' has no saved ledgers." % self.filename)
+            if int(format_version) != self.format_version:
+                raise ValueError("SQLiteLedgersStore: unsupported format version %s." % format_version)
+            fixed_point_info = json.loads(self.get_meta("fixed_point"))
+            lgs = Ledgers(fixed_point=FixedPoint(**fixed_point_info) if fixed_point_info is not None else None)
+            lgs.accInfo.item_info = {(account,sub_account,item):json.loads(info) for account,sub_account,item,info in self.connection.execute("SELECT account,sub_account,item,info FROM item_info")}
+            lgs.accInfo.version += 1
+            lgs.global_header = from_json(self.get_meta("global_header"))
+            lgs.start_date = from_json(self.get_meta("start_date"))
+            lgs.end_date = from_json(self.get_meta("end_date"))
+            self.ledgers = lgs
+        return self.ledgers
+
+    def get_key_orders(self):
+        # key_orderのコード -> [(key,値の列の位置（列がないkeyはNone）,JSONの列か),...]
+        if self.key_orders is None:
+            self.get_ledgers()
+            positions = {key:i+1 for i,key in enumerate(self.column_keys)}
+            self.key_orders = {code:[(key,positions.get(key,None),key in self.json_keys) for key in json.loads(keys)] for code,keys in self.connection.execute("SELECT code,keys FROM record_keys")}
+        return self.key_orders
+
+    def iter_records(self,where="",params=()):
+        # SELECTした行からrecord（dict）を復元する（extrasの値は列の値より優先）
+        key_orders = self.get_key_orders()
+        extras_position = len(self.column_keys)+1
+        for row in self.connection.execute("SELECT key_order,%s,extras FROM records %s ORDER BY pos" % (",".join(self.column_keys),where),params):
+            extras = row[extras_position]
+            extras = from_json(extras) if extras is not None else {}
+            record = {}
+            for key,position,is_json in key_orders[row[0]]:
+                if key in extras:
+                    record[key] = extras[key]
+                elif position is None:
+                    record[key] = None
+                else:
+                    value = row[position]
+                    if is_json and value is not None:
+                        value = from_json(value)
+                    record[key] = value
+            yield record
+
+    def load_ledgers(self):
+        # 保存したLedgersを作成する
+        records = list(self.iter_records())
+        lgs = self.get_ledgers()
+        self.ledgers = None
+        lgs.records = records
+        lgs.version += 1
+        return lgs
+
+    def get_records(self,account,sub_account=None,item=None):
+        # Ledgers.get_recordsと同じ
+        if account is None:
+            return None
+        if sub_account is None:
+            return list(self.iter_records("WHERE account=?",(account,)))
+        elif item is None:
+            return list(self.iter_records("WHERE account=? AND sub_account=?",(account,sub_account)))
+        else:
+            return list(self.iter_records("WHERE account=? AND sub_account=? AND item=?",(account,sub_account,item)))
+
+    def get_partner_list(self):
+        return [partner for (partner,) in self.connection.execute("SELECT DISTINCT partner FROM records WHERE partner IS NOT NULL ORDER BY partner")]
+
+    def get_person_in_charge_list(self):
+        return [person_in_charge for (person_in_charge,) in self.connection.execute("SELECT DISTINCT person_in_charge FROM records WHERE person_in_charge IS NOT NULL ORDER BY person_in_charge")]
+
+    def get_memo_list(self,memo_key):
+        return [value for (value,) in self.connection.execute("SELECT DISTINCT value FROM memos WHERE memo_key=? AND value IS NOT NULL ORDER BY value",(memo_key,))]
+
+    def get_tb(self,start_datetime=None,end_datetime=None):
+        # Ledgers.get_tbと同じ（floatの合計は加算の順が違うため、最後の桁が異なる場合がある）
+        # (account,sub_account,item)ごとに、開始仕訳・集計期間より前・集計期間中の合計をSQLで求める
+        lgs = self.get_ledgers()
+        ts_start = to_epoch_microseconds(start_datetime)
+        ts_end = to_epoch_microseconds(end_datetime)
+        has_key = "account IS NOT NULL AND sub_account IS NOT NULL AND item IS NOT NULL AND ts IS NOT NULL"
+        before_start = "opening=0 AND ts<:start" if ts_start is not None else "0"
+        in_period = "opening=0" + (" AND ts>=:start" if ts_start is not None else "") + (" AND ts<:end" if ts_end is not None else "")
+        sums = []
+        for cond in ("opening=1",before_start,in_period):
+            sums += ["SUM(CASE WHEN %s THEN %s END)" % (cond,key) for key in self.tb_number_keys]
+        where = has_key + (" AND (opening=1 OR ts<:end)" if ts_end is not None else "")
+        params = {"start":ts_start,"end":ts_end}
+        rows = {}
+        for row in self.connection.execute("SELECT account,sub_account,item,%s FROM records WHERE %s GROUP BY account,sub_account,item" % (",".join(sums),where),params):
+            rows[row[:3]] = [value if value is not None else 0 for value in row[3:]]
+        # recordに現れた順（同じ表示カテゴリの中の順）
+        tb_sums = {}
+        for key in self.connection.execute("SELECT account,sub_account,item FROM records WHERE %s GROUP BY account,sub_account,item ORDER BY MIN(pos)" % has_key):
+            side = lgs.accInfo.get_item_side(*key)
+            odq,oda,ocq,oca,bdq,bda,bcq,bca,dq,da,cq,ca = rows.get(key,[0]*12)
+            if side == "Dr":
+                opening = [odq-ocq,oda-oca]
+            elif side == "Cr":
+                opening = [ocq-odq,oca-oda]
+            else:
+                opening = [0,0]
+            tb_sums[key] = [side,opening+[bdq,bda,bcq,bca,dq,da,cq,ca]]
+        return lgs.tb_sums_to_tb(tb_sums)
+
+class MappedLedgersFile:
+    """
+    recalc_all後のLedgersのrecordsを固定長の列（NumPy配列）と文字列表のバイナリファイルに保存する
+    open()はmmap（読み取り専用）で開き、列をNumPyのviewとして使う（読み込み・復元なし）
+    複数のプロセスで同じファイルを開いても、列のメモリはOSのページキャッシュで共有される
+    """
+    magic = b"QTYLGRS\0"
+    format_version = 2
+    alignment = 8
+    string_keys = ("datetime","account","sub_account","item","partner","person_in_charge")
+    int_keys = ("entry_id","line_no","order_id","counts_dr_cr")
+    number_keys = ("dr_quantity","dr_amount","cr_quantity","cr_amount","quantity","amount")
+    tb_number_keys = ("dr_quantity","dr_amount","cr_quantity","cr_amount")
+    # 文字列の列のコード
+    CODE_OTHER = -1 ## 列にない（extrasに保存）
+    CODE_NONE = -2 ## None
+    # 整数・数値の列の種類（<name>_kind）
+    KIND_OTHER = 0 ## 列にない（extrasに保存）
+    KIND_NONE = 1
+    KIND_INT = 2
+    KIND_FLOAT = 3
+    KIND_OP = 4 ## OP_***などの文字列（<name>は文字列表opsのコード）
+    TS_NONE = np.iinfo(np.int64).min
+
+    def __init__(self,filename=None):
+        if filename is None:
+            filename = os.path.join(Path().resolve(),"Ledgers.qtylgrs")
+        self.filename = filename
+        self.file = None
+        self.mmap = None
+        self.header = None
+        self.columns = {} ## 列名 -> NumPy配列（mmapのview）
+        self.strings = {} ## 文字列表の名前 -> 復元した文字列のキャッシュ {code:str}
+        self.extras_cache = {} ## extrasのコード -> 復元したdictのpickle（recordごとに別のdictを作るため）
+        self.ledgers = None ## 保存したAccountInfo・FixedPointを持つLedgers（recordsは空）　get_tbで使用
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+    def close(self):
+        # get_columnで受け取った配列が残っている場合、mmapはそれらが解放されたときに閉じられる
+        self.columns = {}
+        self.strings = {}
+        self.extras_cache = {}
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                pass
+            self.mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    @staticmethod
+    def make_string_table(strings):
+        # 文字列のリスト -> (offsets,data)　i番目の文字列は data[offsets[i]:offsets[i+1]]
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded)+1,dtype=np.int64)
+        if encoded:
+            offsets[1:] = np.cumsum([len(b) for b in encoded])
+        return offsets,b"".join(encoded)
+
+    def encode_records(self,records):
+        # recordsを列（NumPy配列）と文字列表にする
+        n = len(records)
+        tables = {name:{} for name in self.string_keys+("ops","extras")} ## 文字列 -> コード（現れた順）
+        keys = {} ## (account,sub_account,item) -> コード（現れた順）
+        columns = {}
+        for name in self.string_keys:
+            columns[name] = np.full(n,self.CODE_OTHER,dtype=np.int32)
+        for name in self.int_keys:
+            columns[name] = np.zeros(n,dtype=np.int64)
+            columns[name+"_kind"] = np.zeros(n,dtype=np.int8)
+        for name in self.number_keys:
+            columns[name] = np.zeros(n,dtype=np.int64)
+            columns[name+"_float"] = np.zeros(n,dtype=np.float64)
+            columns[name+"_kind"] = np.zeros(n,dtype=np.int8)
+        columns["ts"] = np.full(n,self.TS_NONE,dtype=np.int64)
+        columns["key"] = np.full(n,-1,dtype=np.int32)
+        columns["opening"] = np.zeros(n,dtype=np.int8)
+        columns["extras"] = np.zeros(n,dtype=np.int32)
+        int_min,int_max = np.iinfo(np.int64).min,np.iinfo(np.int64).max
+        for pos,record in enumerate(records):
+            extras = {}
+            for k,v in record.items():
+                if k in self.string_keys:
+                    if v is None:
+                        columns[k][pos] = self.CODE_NONE
+                    elif type(v) is str:
+                        columns[k][pos] = tables[k].setdefault(v,len(tables[k]))
+                    else:
+                        extras[k] = v
+                elif k in self.int_keys:
+                    if v is None:
+                        columns[k+"_kind"][pos] = self.KIND_NONE
+                    elif type(v) is int and int_min <= v <= int_max:
+                        columns[k][pos] = v
+                        columns[k+"_kind"][pos] = self.KIND_INT
+                    else:
+                        extras[k] = v
+                elif k in self.number_keys:
+                    if v is None:
+                        columns[k+"_kind"][pos] = self.KIND_NONE
+                    elif type(v) is int and int_min <= v <= int_max:
+                        columns[k][pos] = v
+                        columns[k+"_kind"][pos] = self.KIND_INT
+                    elif type(v) is float:
+                        columns[k+"_float"][pos] = v
+                        columns[k+"_kind"][pos] = self.KIND_FLOAT
+                    elif type(v) is str:
+                        columns[k][pos] = tables["ops"].setdefault(v,len(tables["ops"]))
+                        columns[k+"_kind"][pos] = self.KIND_OP
+                    else:
+                        extras[k] = v
+                else:
+                    extras[k] = v
+            dt = record.get("datetime",None)
+            if type(dt) is str:
+                columns["ts"][pos] = to_epoch_microseconds(dt)
+            key = (record.get("account",None),record.get("sub_account",None),record.get("item",None))
+            if all(type(k) is str for k in key):
+                columns["key"][pos] = keys.setdefault(key,len(keys))
+            memo = record.get("memo",None) or {}
+            if memo.get("KIND",None)=="OPENING":
+                columns["opening"][pos] = 1
+            # 列にないkey（memoなど）はJSONの文字列表に保存する（同じ内容は同じコード）
+            extras_json = to_json(extras)
+            columns["extras"][pos] = tables["extras"].setdefault(extras_json,len(tables["extras"]))
+        # (account,sub_account,item)の表（コードはaccount・sub_account・itemの文字列表のコード）
+        for i,name in enumerate(("account","sub_account","item")):
+            columns["key_"+name] = np.array([tables[name][key[i]] for key in keys],dtype=np.int32)
+        return columns,{name:list(table) for name,table in tables.items()}
+
+    def save(self,ledgers):
+        # ledgersのrecords・AccountInfo・FixedPoint・global_header・start_date・end_dateを保存する
+        self.close()
+        columns,tables = self.encode_records(ledgers.records)
+        fixed_point = ledgers.fixed_point
+        if fixed_point is not None:
+            fixed_point_info = {"amount_scale":fixed_point.amount_scale,"quantity_scale":fixed_point.quantity_scale,"rounding":fixed_point.rounding}
+        else:
+            fixed_point_info = None
+        header = {"format_version":self.format_version,"n_records":len(ledgers.records),"columns":{},"strings":{},
+                  "item_info":[[key[0],key[1],key[2],info] for key,info in ledgers.accInfo.item_info.items()],
+                  "fixed_point":fixed_point_info,"global_header":ledgers.global_header,"start_date":ledgers.start_date,"end_date":ledgers.end_date}
+        # 各データの位置（ヘッダーの後、alignmentの倍数の位置）
+        blocks = []
+        for name,array in columns.items():
+            header["columns"][name] = {"dtype":array.dtype.str,"length":len(array),"offset":len(blocks)}
+            blocks.append(array.tobytes())
+        for name,strings in tables.items():
+            offsets,data = self.make_string_table(strings)
+            header["strings"][name] = {"count":len(strings),"offsets":len(blocks),"data":len(blocks)+1}
+            blocks.append(offsets.tobytes())
+            blocks.append(data)
+        # ヘッダーの長さは位置によって変わるので、位置を決めてから書き出す
+        block_offsets = [0]*len(blocks)
+        header_bytes = b""
+        while True:
+            header_size = len(self.magic)+8+len(header_bytes)
+            offset = -(-header_size//self.alignment)*self.alignment
+            new_offsets = []
+            for block in blocks:
+                new_offsets.append(offset)
+                offset += -(-len(block)//self.alignment)*self.alignment
+            header["offsets"] = new_offsets
+            new_header_bytes = json.dumps(header,ensure_ascii=False).encode("utf-8")
+            if new_offsets == block_offsets and len(new_header_bytes) == len(header_bytes):
+                break
+            block_offsets,header_bytes = new_offsets,new_header_bytes
+        with open(self.filename,"wb") as f:
+            f.write(self.magic)
+            f.write(len(header_bytes).to_bytes(8,"little"))
+            f.write(header_bytes)
+            for block_offset,block in zip(block_offsets,blocks):
+                f.write(b"\0"*(block_offset-f.tell()))
+                f.write(block)
+        self.open()
+
+    def open(self):
+        # ファイルをmmapで開き、列をNumPyのviewにする
+        self.close()
+        self.file = open(self.filename,"rb")
+        self.mmap = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        if self.mmap[:len(self.magic)] != self.magic:
+            self.close()
+            raise ValueError("MappedLedgersFile: '%s' is not a ledgers file." % self.filename)
+        header_len = int.from_bytes(self.mmap[len(self.magic):len(self.magic)+8],"little")
+        start = len(self.magic)+8
+        header = json.loads(bytes(self.mmap[start:start+header_len]).decode("utf-8"))
+        if header["format_version"] != self.format_version:
+            self.close()
+            raise ValueError("MappedLedgersFile: unsupported format version %s." % header["format_version"])
+        self.header = header
+        offsets = header["offsets"]
+        for name,info in header["columns"].items():
+            self.columns[name] = np.frombuffer(self.mmap,dtype=np.dtype(info["dtype"]),count=info["length"],offset=offsets[info["offset"]])
+        self.ledgers = None
+        return self
+
+    def get_column(self,name):
+        # 列（読み取り専用のNumPy配列）
+        if self.mmap is None:
+            self.open()
+        return self.columns[name]
+
+    def __len__(self):
+        if self.mmap is None:
+            self.open()
+        return self.header["n_records"]
+
+    def get_string(self,table,code):
+        # 文字列表tableのcode番目の文字列
+        cache = self.strings.setdefault(table,{})
+        string = cache.get(code,None)
+        if string is None:
+            info = self.header["strings"][table]
+            offsets = self.header["offsets"]
+            start,end = np.frombuffer(self.mmap,dtype=np.int64,count=2,offset=offsets[info["offsets"]]+8*int(code))
+            data_offset = offsets[info["data"]]
+            string = self.mmap[data_offset+int(start):data_offset+int(end)].decode("utf-8")
+            cache[code] = string
+        return string
+
+    def get_strings(self,table):
+        if self.mmap is None:
+            self.open()
+        return [self.get_string(table,code) for code in range(self.header["strings"][table]["count"])]
+
+    def get_extras(self,code):
+        # 列にないkeyのdict（呼び出しごとに新しいdict）
+        extras = self.extras_cache.get(code,None)
+        if extras is None:
+            extras = pickle.dumps(from_json(self.get_string("extras",code)),protocol=pickle.HIGHEST_PROTOCOL)
+            self.extras_cache[code] = extras
+        return pickle.loads(extras)
+
+    def get_ledgers(self):
+        # AccountInfo・FixedPointだけを持つLedgers（recordsは空）
+        if self.mmap is None:
+            self.open()
+        if self.ledgers is None:
+            header = self.header
+            fixed_point_info = header["fixed_point"]
+            lgs = Ledgers(fixed_point=FixedPoint(**fixed_point_info) if fixed_point_info is not None else None)
+            lgs.accInfo.item_info = {(account,sub_account,item):info for account,sub_account,item,info in header["item_info"]}
+            lgs.accInfo.version += 1
+            lgs.global_header = from_json_value(header["global_header"])
+            lgs.start_date = header["start_date"]
+            lgs.end_date = header["end_date"]
+            self.ledgers = lgs
+        return self.ledgers
+
+    def get_record(self,pos):
+        # pos番目のrecord（dict）を復元する
+        if self.mmap is None:
+            self.open()
+        columns = self.columns
+        record = self.get_extras(int(columns["extras"][pos]))
+        for name in self.string_keys:
+            code = int(columns[name][pos])
+            if code == self.CODE_NONE:
+                record[name] = None
+            elif code != self.CODE_OTHER:
+                record[name] = self.get_string(name,code)
+        for name in self.int_keys+self.number_keys:
+            kind = columns[name+"_kind"][pos]
+            if kind == self.KIND_NONE:
+                record[name] = None
+            elif kind == self.KIND_INT:
+                record[name] = int(columns[name][pos])
+            elif kind == self.KIND_FLOAT:
+                record[name] = float(columns[name+"_float"][pos])
+            elif kind == self.KIND_OP:
+                record[name] = self.get_string("ops",int(columns[name][pos]))
+        return record
+
+    def load_ledgers(self):
+        # 保存したLedgersを作成する
+        lgs = self.get_ledgers()
+        self.ledgers = None
+        lgs.records = [self.get_record(pos) for pos in range(len(self))]
+        lgs.version += 1
+        return lgs
+
+    def get_key_codes(self,account,sub_account=None,item=None):
+        # 条件に合う(account,sub_account,item)のコード
+        matches = None
+        for name,value in (("account",account),("sub_account",sub_account),("item",item)):
+            if value is None:
+                continue
+            strings = self.get_strings(name)
+            if value not in strings:
+                return np.zeros(0,dtype=np.int32)
+            match = self.columns["key_"+name] == strings.index(value)
+            matches = match if matches is None else matches & match
+        return np.flatnonzero(matches).astype(np.int32)
+
+    def get_positions(self,account,sub_account=None,item=None):
+        # Ledgers.get_recordsのrecordの位置（NumPy配列）
+        if self.mmap is None:
+            self.open()
+        return np.flatnonzero(np.isin(self.columns["key"],self.get_key_codes(account,sub_account,item)))
+
+    def get_records(self,account,sub_account=None,item=None):
+        # Ledgers.get_recordsと同じ
+        if account is None:
+            return None
+        return [self.get_record(pos) for pos in self.get_positions(account,sub_account,item)]
+
+    def get_string_list(self,name):
+        codes = np.unique(self.get_column(name))
+        return sorted(self.get_string(name,int(code)) for code in codes if code >= 0)
+
+    def get_partner_list(self):
+        return self.get_string_list("partner")
+
+    def get_person_in_charge_list(self):
+        return self.get_string_list("person_in_charge")
+
+    def get_memo_list(self,memo_key):
+        # memoはextrasに保存している（同じextrasは一度だけ復元する）
+        values = set()
+        for code in np.unique(self.get_column("extras")):
+            memo = self.get_extras(int(code)).get("memo",None) or {}
+            value = memo.get(memo_key,None)
+            if type(value) is str:
+                values.add(value)
+        return sorted(values)
+
+    def get_sums(self,mask,key_codes,n_keys):
+        # maskのrecordの (account,sub_account,item)ごとの dr_quantity,dr_amount,cr_quantity,cr_amount の合計
+        # Ledgers.get_tbと同じく、整数だけの合計はint、floatを含む合計はfloat
+        columns = self.columns
+        sums = []
+        for name in self.tb_number_keys:
+            kind = columns[name+"_kind"][mask]
+            is_int = kind == self.KIND_INT
+            is_float = kind == self.KIND_FLOAT
+            int_sums = np.zeros(n_keys,dtype=np.int64)
+            np.add.at(int_sums,key_codes[is_int],columns[name][mask][is_int])
+            float_sums = np.bincount(key_codes[is_float],weights=columns[name+"_float"][mask][is_float],minlength=n_keys)
+            has_float = np.bincount(key_codes[is_float],minlength=n_keys) > 0
+            sums.append([int_sum+float_sum if float_flag else int_sum for int_sum,float_sum,float_flag in zip(int_sums.tolist(),float_sums.tolist(),has_float.tolist())])
+        return sums
+
+    def get_tb(self,start_datetime=None,end_datetime=None):
+        # Ledgers.get_tbと同じ（floatの合計は加算の順が違うため、最後の桁が異なる場合がある）
+        lgs = self.get_ledgers()
+        columns = self.columns
+        key = columns["key"]
+        ts = columns["ts"]
+        opening = columns["opening"] == 1
+        valid = (key >= 0) & (ts != self.TS_NONE)
+        n_keys = len(columns["key_account"])
+        ts_start = to_epoch_microseconds(start_datetime)
+        ts_end = to_epoch_microseconds(end_datetime)
+        before_start = np.zeros(len(key),dtype=bool) if ts_start is None else (ts < ts_start)
+        in_period = np.ones(len(key),dtype=bool)
+        if ts_start is not None:
+            in_period &= ts >= ts_start
+        if ts_end is not None:
+            in_period &= ts < ts_end
+        sums = []
+        for mask in (valid & opening,valid & ~opening & before_start,valid & ~opening & in_period):
+            sums += self.get_sums(mask,key[mask],n_keys)
+        # recordに現れた順（keyのコードの順）
+        has_record = np.bincount(key[valid],minlength=n_keys) > 0
+        tb_sums = {}
+        for code in np.flatnonzero(has_record).tolist():
+            tb_key = (self.get_string("account",int(columns["key_account"][code])),self.get_string("sub_account",int(columns["key_sub_account"][code])),self.get_string("item",int(columns["key_item"][code])))
+            side = lgs.accInfo.get_item_side(*tb_key)
+            odq,oda,ocq,oca,bdq,bda,bcq,bca,dq,da,cq,ca = [s[code] for s in sums]
+            if side == "Dr":
+                opening_sums = [odq-ocq,oda-oca]
+            elif side == "Cr":
+                opening_sums = [ocq-odq,oca-oda]
+            else:
+                opening_sums = [0,0]
+            tb_sums[tb_key] = [side,opening_sums+[bdq,bda,bcq,bca,dq,da,cq,ca]]
+        return lgs.tb_sums_to_tb(tb_sums)
+
+class LedgersSnapshot:
+    """
+    recalc_all後のLedgersの状態（records・global_header・start_date・end_date・AccountInfo・索引・キャッシュ）をそのまま保存・復元する
+    ヘッダー（形式のバージョン）の後にpickleで保存する
+    pickleを使うため、信頼できるファイルだけを読み込むこと
+    """
+    magic = b"QTYSNAP\0"
+    format_version = 2
+    pickle_protocol = 5
+
+    def __init__(self,filename=None):
+        if filename is None:
+            filename = os.path.join(Path().resolve(),"Ledgers.qtysnap")
+        self.filename = filename
+
+    def save(self,ledgers):
+        # ファイルの形式
+        # magic(8) ヘッダーの長さ(8) ヘッダー(JSON) pickle
+        header = {"format_version":self.format_version,"pickle_protocol":self.pickle_protocol}
+        header_bytes = json.dumps(header).encode("utf-8")
+        with open(self.filename,"wb") as f:
+            f.write(self.magic)
+            f.write(len(header_bytes).to_bytes(8,"little"))
+            f.write(header_bytes)
+            pickle.dump(ledgers,f,protocol=self.pickle_protocol)
+
+    def read_header(self,f):
+        if f.read(len(self.magic)) != self.magic:
+            raise ValueError("LedgersSnapshot: '%s' is not a ledgers snapshot." % self.filename)
+        header_len = int.from_bytes(f.read(8),"little")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+        if header["format_version"] != self.format_version:
+            raise ValueError("LedgersSnapshot: unsupported format version %s." % header["format_version"])
+        return header
+
+    def load(self):
+        # 保存したLedgersを復元する
+        with open(self.filename,"rb") as f:
+            self.read_header(f)
+            return pickle.load(f)
@@ -0,0 +1,118 @@
+import pytest
+
+def test_ledgers_excel_exporter(tmp_path):
+    #元帳・試算表を1つのブックのシートとして書き出す（simple_ledger_to_dfと同じ値）
+    from qtyaccounting.qtytools import Ledgers
+    from qtyaccounting.exporttools import LedgersExcelExporter
+    import pandas as pd
+    lgs = Ledgers()
+    for entry_id in range(1,4):
+        lgs.register({"entry_header":{"datetime":"2022-04-%02d" % entry_id,"entry_id":entry_id},
+                      "debit":[{"account":"商品","item":"Tシャツ","quantity":entry_id,"amount":100*entry_id,"order_id":0,"line_no":0}],
+                      "credit":[{"account":"現金","amount":100*entry_id,"order_id":1,"line_no":0}]})
+    filename = str(tmp_path / "ledgers.xlsx")
+    sheet_names = LedgersExcelExporter(lgs).export(filename,partner=True)
+    assert sheet_names["TB"]=="TB" and "TB_partner_vs_end" in sheet_names
+    ledger_name = [name for name in sheet_names if name.startswith("商品__Tシャツ")][0]
+    df = pd.read_excel(filename,sheet_name=sheet_names[ledger_name],index_col=0)
+    expected = lgs.simple_ledger_to_df("商品","","Tシャツ")
+    assert list(df.columns)==list(expected.columns)
+    assert df["dr_amount"].tolist()==expected["dr_amount"].tolist()
+    tb_df = pd.read_excel(filename,sheet_name="TB",index_col=0).fillna("")
+    assert tb_df["end_amount"].tolist()==lgs.tb_to_df()["end_amount"].tolist()
+    directory = tmp_path / "ledgers"
+    LedgersExcelExporter(lgs).export(directory=str(directory),tb=False)
+    assert len(list(directory.glob("*.xlsx")))==len(sheet_names)-2
+
+def test_ledgers_arrow_io(tmp_path):
+    #recordsをParquet・Arrowに書き出し、recalc_allをせずに読み込む
+    pytest.importorskip("pyarrow")
+    from qtyaccounting.qtytools import Ledgers
+    from qtyaccounting.exporttools import LedgersArrowIO
+    lgs = Ledgers()
+    lgs.accInfo.set_item_info("商品","","",side="Dr",method="FIFO")
+    lgs.register({"entry_header":{"datetime":"2022-04-01","entry_id":1,"partner":"A社","memo":{"気温":(20,"度")}},
+                  "debit":[{"account":"商品","item":"Tシャツ","quantity":10,"amount":1000,"order_id":0,"line_no":0}],
+                  "credit":[{"account":"現金","amount":1000,"order_id":1,"line_no":0}]})
+    lgs.register({"entry_header":{"datetime":"2022-04-02","entry_id":2,"memo":{"天気":"晴れ"}},
+                  "debit":[{"account":"売上原価","item":"Tシャツ","amount":"OP_EQUAL_AMOUNT","order_id":0,"line_no":0}],
+                  "credit":[{"account":"商品","item":"Tシャツ","quantity":4,"amount":"OP_AUTO_AMOUNT","order_id":1,"line_no":0}]})
+    lgs.recalc_all()
+    lgs.global_header = {"company":"テスト"}
+    for filename in ("records.parquet","records.arrow"):
+        LedgersArrowIO(lgs).save_records(str(tmp_path / filename))
+        loaded = LedgersArrowIO().load_ledgers(str(tmp_path / filename))
+        assert loaded.records==lgs.records
+        assert loaded.get_tb()==lgs.get_tb()
+        assert loaded.accInfo.get_item_method("商品","","Tシャツ")=="FIFO"
+        assert (loaded.global_header,loaded.start_date,loaded.end_date)==(lgs.global_header,lgs.start_date,lgs.end_date)
+    import pyarrow.parquet
+    LedgersArrowIO(lgs).save_tb(str(tmp_path / "tb.parquet"))
+    table = pyarrow.parquet.read_table(str(tmp_path / "tb.parquet"))
+    assert str(table.schema.field("end_quantity").type)=="int64"
+    assert str(table.schema.field("account").type).startswith("dictionary")
+
+def test_ledgers_arrow_io_metadata():
+    #スキーマのメタデータ（JSON）からAccountInfo・FixedPoint・global_header・start_date・end_dateを戻す（pyarrowは不要）
+    from qtyaccounting.qtytools import Ledgers,FixedPoint
+    from qtyaccounting.exporttools import LedgersArrowIO
+    import json
+    lgs = Ledgers(fixed_point=FixedPoint(amount_scale=2))
+    lgs.accInfo.set_item_info("商品","","",side="Dr",method="FIFO")
+    lgs.global_header = {"company":"テスト","期":(1,"期")}
+    lgs.start_date = "2022-04-01"
+    lgs.end_date = "2023-03-31"
+    metadata = json.loads(json.dumps(LedgersArrowIO.ledgers_to_metadata(lgs,"records"),ensure_ascii=False))
+    loaded = LedgersArrowIO.metadata_to_ledgers(metadata)
+    assert (loaded.global_header,loaded.start_date,loaded.end_date)==(lgs.global_header,lgs.start_date,lgs.end_date)
+    assert loaded.accInfo.get_item_method("商品","","Tシャツ")=="FIFO"
+    assert loaded.fixed_point.amount_scale==lgs.fixed_point.amount_scale
+
+def test_ledgers_csv_exporter(tmp_path):
+    #recordsをchunkごとにCSV・TSV（gzip）に書き出す（get_record_dfと同じ列の順）
+    from qtyaccounting.qtytools import Ledgers
+    from qtyaccounting.exporttools import LedgersCSVExporter
+    import gzip
+    lgs = Ledgers()
+    for entry_id in range(1,6):
+        lgs.register({"entry_header":{"datetime":"2022-04-%02d" % entry_id,"entry_id":entry_id,"partner":"A社","memo":{"天気":"晴れ"}},
+                      "debit":[{"account":"現金","amount":100*entry_id,"order_id":0,"line_no":0}],
+                      "credit":[{"account":"売上","amount":100*entry_id,"order_id":1,"line_no":0}]})
+    exporter = LedgersCSVExporter(lgs,chunk_size=3)
+    assert exporter.save_records(str(tmp_path / "records.csv"))==10
+    with open(tmp_path / "records.csv",encoding="utf-8") as f:
+        header = f.readline().rstrip("\r\n").split(",")
+    assert header==list(lgs.get_record_df().columns)
+    assert exporter.save_ledger_records(str(tmp_path / "cash.tsv.gz"),"現金")==5
+    with gzip.open(tmp_path / "cash.tsv.gz","rt",encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert len(lines)==6 and "\t" in lines[0]
+    assert exporter.save_tb_grouped(str(tmp_path / "partner.csv"),lgs.get_tb_with_partner(),("partner",))==2
+
+def test_ledgers_parallel_exporter(tmp_path):
+    #元帳ごとのファイルをプロセスプールで書き出す　同じ内容なら同じバイト列で、2回目は書き込まない
+    from qtyaccounting.qtytools import Ledgers
+    from qtyaccounting.exporttools import LedgersParallelExporter
+    import os
+    import pandas as pd
+    lgs = Ledgers()
+    for entry_id in range(1,6):
+        lgs.register({"entry_header":{"datetime":"2022-04-%02d" % entry_id,"entry_id":entry_id},
+                      "debit":[{"account":"商品","item":"I%d" % (entry_id%2),"quantity":entry_id,"amount":100*entry_id,"order_id":0,"line_no":0}],
+                      "credit":[{"account":"預金","amount":100*entry_id,"order_id":1,"line_no":0}]})
+    progress = []
+    exporter = LedgersParallelExporter(lgs,max_workers=2,progress=lambda *args: progress.append(args))
+    statuses = exporter.export(str(tmp_path))
+    assert len(statuses)==3 and set(statuses.values())=={"written"}
+    assert [p[0] for p in progress]==[1,2,3]
+    filename = exporter.get_ledger_filename(str(tmp_path),"商品","","I1")
+    df = pd.read_excel(filename,index_col=0)
+    assert list(df["dr_quantity"])==[1,3,5]
+    with open(filename,"rb") as f:
+        data = f.read()
+    os.remove(os.path.join(str(tmp_path),LedgersParallelExporter.manifest_filename))
+    statuses = LedgersParallelExporter(lgs,max_workers=1).export(str(tmp_path))
+    assert set(statuses.values())=={"unchanged"}
+    with open(filename,"rb") as f:
+        assert f.read()==data
+    assert set(LedgersParallelExporter(lgs,max_workers=1).export(str(tmp_path)).values())=={"unchanged"}
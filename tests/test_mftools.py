@@ -31,3 +31,41 @@ def test_translate_file():
 
 #def test_visit()
 #    journal_dic = CSVTreeToJournalDic().visit(csv_tree)
+
+def test_mf_csv_to_journal_dic():
+    #csvモジュールで分割し摘要の<<...>>のみLarkで解析する（CSV全体をLarkで解析した場合と同じjournal_dic）
+    from qtyaccounting.mftools import MfCSVToCSVTree,CSVTreeToJournalDic,MfCSVToJournalDic
+    import os
+    sample_filename = os.path.join(os.path.dirname(__file__),"../example/mfsample.csv")
+    journal_dic = MfCSVToJournalDic().translate_file(sample_filename)
+    assert journal_dic==CSVTreeToJournalDic().visit(MfCSVToCSVTree().translate_file(sample_filename))
+    headings = ["取引No","取引日","借方勘定科目","借方補助科目","借方部門","借方取引先","借方税区分","借方インボイス","借方金額(円)","借方税額","貸方勘定科目","貸方補助科目","貸方部門","貸方取引先","貸方税区分","貸方インボイス","貸方金額(円)","貸方税額","摘要","仕訳メモ","タグ"]
+    rows = [{"取引No":"1","取引日":"2023/04/01","借方勘定科目":"商品","借方金額(円)":"1200","貸方勘定科目":"預金","貸方金額(円)":"1200",
+             "摘要":"入荷 <<T10:00:00 Dr #Tシャツ *3個 $得意先A Cr ?E>> 伝票1","仕訳メモ":"<<&天気::晴れ Dr ?E>>","タグ":"A|B"},
+            {"取引No":"1","取引日":"2023/04/01","貸方勘定科目":"預金","貸方金額(円)":"300"},
+            None,
+            {"取引No":"2","取引日":"2023/04/02","借方勘定科目":"売上原価","貸方勘定科目":"商品","摘要":"<<Dr ?E Cr #Tシャツ *1個 ?A>>"}]
+    lines = [",".join('"%s"' % heading for heading in headings)]
+    lines += ["" if row is None else ",".join('"%s"' % row.get(heading,"") for heading in headings) for row in rows]
+    csv_text = "\n".join(lines)+"\n"
+    journal_dic = MfCSVToJournalDic().translate(csv_text)
+    assert journal_dic==CSVTreeToJournalDic().visit(MfCSVToCSVTree().translate(csv_text))
+    entry = journal_dic["journal"][0]["journal_entry"]
+    assert entry["entry_header"]["memo"]["天気"]=="晴れ" and entry["entry_header"]["memo"]["A"]=="1"
+    assert entry["body"][0]["debit"]["item"]=="Tシャツ" and entry["body"][0]["debit"]["remarks"]=="入荷__伝票1"
+    assert len(entry["body"])==3
+
+def test_mf_csv_to_journal_dic_multiple_tekiyou():
+    #<<...>>が2つある欄はCSV全体をLarkで解析する場合と同じくUnexpectedToken
+    from qtyaccounting.mftools import MfCSVToJournalDic
+    from lark.exceptions import UnexpectedToken
+    headings = ["取引No","取引日","借方勘定科目","借方補助科目","借方部門","借方取引先","借方税区分","借方インボイス","借方金額(円)","借方税額","貸方勘定科目","貸方補助科目","貸方部門","貸方取引先","貸方税区分","貸方インボイス","貸方金額(円)","貸方税額","摘要","仕訳メモ","タグ"]
+    row = {"取引No":"1","取引日":"2023/04/01","借方勘定科目":"商品","借方金額(円)":"1200","貸方勘定科目":"預金","貸方金額(円)":"1200"}
+    get_csv_text = lambda tekiyou: ",".join('"%s"' % heading for heading in headings)+"\n"+",".join('"%s"' % dict(row,摘要=tekiyou).get(heading,"") for heading in headings)+"\n"
+    csv_text = get_csv_text("入荷 <<Dr #A>> 伝票")
+    assert MfCSVToJournalDic().translate(csv_text)==CSVTreeToJournalDic().visit(MfCSVToCSVTree().translate(csv_text))
+    csv_text = get_csv_text("入荷 <<Dr #A>> 伝票 <<Cr #B>>")
+    with pytest.raises(UnexpectedToken):
+        CSVTreeToJournalDic().visit(MfCSVToCSVTree().translate(csv_text))
+    with pytest.raises(UnexpectedToken):
+        MfCSVToJournalDic().translate(csv_text)
@@ -2,6 +2,28 @@ import pytest
 from qtyaccounting.qtytools import QTYJournalToTree
 from lark import Tree,Token
 
+def entry_header(entry_id,day,header):
+    #仕訳のヘッダー　headerのpartner・memoなどは、Noneの場合は指定しない
+    return dict({"datetime":day,"entry_id":entry_id},**{k:v for k,v in header.items() if v is not None})
+
+def purchase_entry(entry_id,day,account,item,quantity,amount,credit_account="預金",**header):
+    #仕入の仕訳　Dr account#item *quantity amount / Cr credit_account amount
+    return {"entry_header":entry_header(entry_id,day,header),
+            "debit":[{"account":account,"item":item,"quantity":quantity,"amount":amount,"order_id":0,"line_no":0}],
+            "credit":[{"account":credit_account,"amount":amount,"order_id":1,"line_no":0}]}
+
+def cost_of_sales_entry(entry_id,day,account,item,quantity,**header):
+    #払出しの仕訳　Dr 売上原価 ?E / Cr account#item *quantity ?A
+    return {"entry_header":entry_header(entry_id,day,header),
+            "debit":[{"account":"売上原価","amount":"OP_EQUAL_AMOUNT","order_id":0,"line_no":0}],
+            "credit":[{"account":account,"item":item,"quantity":quantity,"amount":"OP_AUTO_AMOUNT","order_id":1,"line_no":0}]}
+
+def transfer_entry(entry_id,day,debit_account,credit_account,amount,**header):
+    #数量のない仕訳　Dr debit_account amount / Cr credit_account amount
+    return {"entry_header":entry_header(entry_id,day,header),
+            "debit":[{"account":debit_account,"amount":amount,"order_id":0,"line_no":0}],
+            "credit":[{"account":credit_account,"amount":amount,"order_id":1,"line_no":0}]}
+
 def test_translate():
     journal1 = r"""
 <<2022-05-14 ##商品の仕入１
@@ -54,3 +76,350 @@ Cr　預金 6000>>"""
 
 
 
+def test_fifo_get_across_layers():
+    #先入先出法：複数の層にまたがる取り出しと、一部だけ残った層
+    from qtyaccounting.qtytools import ItemQueueFIFO
+    q = ItemQueueFIFO()
+    for i in range(100):
+        q.put("商品","","Tシャツ",10,1000+i)
+    assert q.get("商品","","Tシャツ",255)==(255,25812.5),"25層と一部が取り出されているか"
+    assert q.get("商品","","Tシャツ",5)==(5,512.5),"一部だけ残った層から取り出されているか"
+    assert q.get("商品","","Tシャツ",10)==(10,1026),"次の層から取り出されているか"
+    assert q.get("商品","","Tシャツ",2000)==(730,77599),"足りない場合は取り出し可能な分が返るか"
+    assert q.get("商品","","Tシャツ",1)==(0,0),"何も入っていない場合"
+    assert q.get("商品","","ポロシャツ",1)==(None,None),"登録がない場合"
+
+def test_fifo_get_negative():
+    #先入先出法：マイナスの数量の取り出し
+    from qtyaccounting.qtytools import ItemQueueFIFO
+    q = ItemQueueFIFO()
+    for i in range(40):
+        q.put("商品","","Tシャツ",-2,-300)
+    assert q.get("商品","","Tシャツ",-41)==(-41,-6150.0),"マイナスの層から取り出されているか"
+    assert q.get_all("商品","","Tシャツ")==(-39,-5850.0),"残りが全て取り出されているか"
+
+def test_cost_flow_trace():
+    #払出しと、それに充てられた受入の対応
+    from qtyaccounting.qtytools import Ledgers
+    lgs = Ledgers()
+    lgs.accInfo.set_item_info("商品","","",side="Dr",method="FIFO")
+    lgs.accInfo.set_item_info("貯蔵品","","",side="Dr",method="MA")
+    for account in ("商品","貯蔵品"):
+        lgs.register(purchase_entry(1,"2022-04-01",account,"Tシャツ",10,1000))
+        lgs.register(purchase_entry(2,"2022-04-02",account,"Tシャツ",10,2000))
+        lgs.register(cost_of_sales_entry(3,"2022-04-03",account,"Tシャツ",15))
+    lgs.recalc_all(trace_cost_flow=True)
+    idx = {(r["entry_id"],r["account"]):i for i,r in enumerate(lgs.records)}
+    fifo_sale = idx[(3,"商品")]
+    assert lgs.cost_flow.get_receipts(fifo_sale)==[(idx[(1,"商品")],10,1000),(idx[(2,"商品")],5,1000.0)],"先入先出法の払出しの受入"
+    assert lgs.cost_flow.get_issues(idx[(2,"商品")])==[(fifo_sale,5,1000.0)],"先入先出法の受入の払出し"
+    ma_sale = idx[(3,"貯蔵品")]
+    assert lgs.cost_flow.get_receipts(ma_sale)==[(idx[(1,"貯蔵品")],7.5,750.0),(idx[(2,"貯蔵品")],7.5,1500.0)],"移動平均法の払出しの受入"
+    assert lgs.cost_flow.get_issues(idx[(1,"貯蔵品")])==[(ma_sale,7.5,750.0)],"移動平均法の受入の払出し"
+
+def test_cost_flow_trace_ma_long_history():
+    #移動平均法で払出しと受入を長く繰り返しても、充てられた受入の数量の合計が払出し数量になる
+    from qtyaccounting.qtytools import ItemQueueMA,CostFlowIndex
+    trace = CostFlowIndex()
+    q = ItemQueueMA(trace)
+    q.put("商品","","Tシャツ",1000,100000,ref=0)
+    issued = {}
+    for cycle in range(3000):
+        issued[2*cycle+1] = q.get("商品","","Tシャツ",500,ref=2*cycle+1)[0]
+        q.put("商品","","Tシャツ",500,500*(100+cycle%7),ref=2*cycle+2)
+    from_issues = {}
+    for receipt in range(0,6001,2):
+        for (issue,quantity,amount) in trace.get_issues(receipt):
+            from_issues[issue] = from_issues.get(issue,0)+quantity
+    for issue,quantity in issued.items():
+        receipts = trace.get_receipts(issue)
+        assert abs(sum(r[1] for r in receipts)-quantity)<1e-6,"払出しに充てられた受入の数量の合計"
+        assert len(receipts)<=70,"割合が無視できる受入は読み飛ばす"
+        assert abs(from_issues[issue]-quantity)<1e-6,"受入側から見た払出し数量の合計"
+
+def test_fixed_point():
+    #固定小数点（整数）での計算と端数処理
+    from qtyaccounting.qtytools import Ledgers,FixedPoint
+    from decimal import ROUND_HALF_UP,ROUND_HALF_EVEN,ROUND_DOWN
+    assert FixedPoint(rounding=ROUND_HALF_UP).div_round(-5,2)==-3,"四捨五入"
+    assert FixedPoint(rounding=ROUND_HALF_EVEN).div_round(5,2)==2,"偶数丸め"
+    assert FixedPoint(rounding=ROUND_DOWN).div_round(-7,3)==-2,"切捨て"
+    assert FixedPoint(100,1000).to_amount(12.34)==1234,"金額のscale"
+    lgs = Ledgers(FixedPoint(amount_scale=1,quantity_scale=10))
+    lgs.accInfo.set_item_info("商品","","",side="Dr",method="FIFO")
+    lgs.register(purchase_entry(1,"2022-04-01","商品","Tシャツ",3,1000))
+    lgs.register(cost_of_sales_entry(2,"2022-04-02","商品","Tシャツ",1))
+    lgs.recalc_all()
+    assert lgs.records[-1]["cr_quantity"]==10,"数量は1/10個単位の整数"
+    assert lgs.records[-1]["cr_amount"]==333,"金額は丸めた整数"
+    tb = lgs.get_tb()
+    assert tb[("商品","","Tシャツ")]["end_quantity"]==2,"TBは割り戻した数量"
+    assert tb[("商品","","Tシャツ")]["end_amount"]==667,"TBの金額"
+
+def test_valuation_backend_numpy():
+    #NumPyでの総平均法の払出し金額が、pythonと一致するか（移動平均法はどちらもpythonで計算する）
+    from qtyaccounting.qtytools import Ledgers
+    def make_ledgers():
+        lgs = Ledgers()
+        lgs.accInfo.set_item_info("貯蔵品","","",side="Dr",method="MA")
+        lgs.accInfo.set_item_info("商品","","",side="Dr",method="PA")
+        entry_id = 0
+        for account in ("貯蔵品","商品"):
+            for item in ("Tシャツ","ポロシャツ"):
+                for (quantity,amount) in ((10,1000),(-3,"OP_AUTO_AMOUNT"),(7,1001.5),(-9,"OP_AUTO_AMOUNT"),(-6,"OP_AUTO_AMOUNT")):
+                    entry_id += 1
+                    line = {"account":account,"item":item,"quantity":abs(quantity),"amount":amount,"order_id":0,"line_no":0}
+                    if quantity > 0:
+                        lgs.register({"entry_header":{"datetime":"2022-04-%02d" % entry_id,"entry_id":entry_id},"debit":[line]})
+                    else:
+                        lgs.register({"entry_header":{"datetime":"2022-04-%02d" % entry_id,"entry_id":entry_id},"credit":[line]})
+        return lgs
+    lgs_python = make_ledgers()
+    lgs_python.recalc_all()
+    lgs_numpy = make_ledgers()
+    lgs_numpy.recalc_all(valuation_backend="numpy")
+    assert lgs_numpy.records==lgs_python.records,"recordsが一致するか"
+    assert lgs_numpy.records[4]["cr_quantity"]==5,"在庫を超える払出しは在庫数量まで"
+    assert type(lgs_numpy.records[1]["cr_amount"]) is float,"払出し金額はfloat"
+
+def test_tb_period():
+    #開始仕訳・集計期間より前・集計期間中・集計期間より後の集計
+    from qtyaccounting.qtytools import Ledgers
+    lgs = Ledgers()
+    lgs.accInfo.set_item_info("商品","","",side="Dr")
+    lgs.accInfo.set_item_info("資本金","","",side="Cr")
+    lgs.register(purchase_entry(0,"2022-04-01","商品","Tシャツ",2,200,credit_account="資本金",memo={"KIND":"OPENING"}))
+    for entry_id,day in ((1,"2022-04-02"),(2,"2022-05-01T09:00:00"),(3,"2022-06-01")):
+        lgs.register(purchase_entry(entry_id,day,"商品","Tシャツ",entry_id,100*entry_id))
+    tb = lgs.get_tb("2022-05-01","2022-06-01")
+    t = tb[("商品","","Tシャツ")]
+    assert (t["opening_quantity"],t["start_quantity"],t["sum_dr_quantity"],t["end_quantity"])==(2,3,2,5),"期間ごとの数量"
+    assert tb[("資本金","","")]["end_amount"]==200,"貸方の開始仕訳"
+    assert tb[("預金","","")]["sum_cr_amount"]==200,"集計期間中の貸方"
+
+def test_tb_index():
+    #TBIndexの期間別試算表・残高と、追加・再計算後の差分更新
+    from qtyaccounting.qtytools import Ledgers
+    lgs = Ledgers()
+    lgs.accInfo.set_item_info("商品","","",side="Dr",method="FIFO")
+    lgs.register(purchase_entry(1,"2022-04-01","商品","Tシャツ",10,1000))
+    lgs.register(purchase_entry(2,"2022-05-01","商品","Tシャツ",10,1200))
+    lgs.register(cost_of_sales_entry(3,"2022-05-15","商品","Tシャツ",15))
+    lgs.get_tb_index()
+    lgs.register(purchase_entry(4,"2022-06-01","商品","Tシャツ",5,500))
+    lgs.recalc_all()
+    for period in ((None,None),("2022-05-01","2022-06-01"),("2022-05-16",None)):
+        assert lgs.get_tb_indexed(*period)==lgs.get_tb(*period),"get_tbと一致"
+    assert lgs.get_balance_as_of("商品","","Tシャツ","2022-05-15")==(20,2200),"払出し前の残高"
+    assert lgs.get_balance_as_of("商品","","Tシャツ")==(10,1100),"全期間の残高"
+
+def test_tb_periods():
+    #期間別の試算表を一度の走査で求める
+    from qtyaccounting.qtytools import Ledgers
+    lgs = Ledgers()
+    lgs.accInfo.set_item_info("商品","","",side="Dr")
+    for entry_id,day in ((1,"2022-01-10"),(2,"2022-02-10"),(3,"2022-02-20"),(4,"2022-04-01")):
+        lgs.register(purchase_entry(entry_id,day,"商品","Tシャツ",entry_id,100*entry_id))
+    assert lgs.get_period_boundaries("M")==["2022-01-01","2022-02-01","2022-03-01","2022-04-01","2022-05-01"],"月次の区切り"
+    df = lgs.tb_periods_to_df(["2022-02-01","2022-03-01","2022-04-01"])
+    row = df[df["account"]=="商品"].iloc[0]
+    assert (row["start_quantity"],row["2022-02-01_sum_dr_quantity"],row["2022-03-01_sum_dr_quantity"],row["end_quantity"])==(1,5,0,6),"期間ごとの数量"
+    tb = lgs.get_tb("2022-02-01","2022-04-01")
+    assert lgs.get_tb_periods("Q")[("商品","","Tシャツ")]["end_amount"]==lgs.get_tb()[("商品","","Tシャツ")]["end_amount"],"四半期"
+    assert row["end_amount"]==tb[("商品","","Tシャツ")]["end_amount"],"get_tbと一致"
+
+def test_tb_grouped():
+    #取引先・メモごとの試算表を一度の走査で求める
+    from qtyaccounting.qtytools import Ledgers
+    lgs = Ledgers()
+    lgs.accInfo.set_item_info("売掛金","","",side="Dr")
+    for entry_id,partner,weather in ((1,"A社","晴れ"),(2,"B社","雨"),(3,"A社",None),(4,None,"晴れ")):
+        memo = {"天気":weather} if weather is not None else None
+        lgs.register(transfer_entry(entry_id,"2022-04-%02d" % entry_id,"売掛金","売上",100*entry_id,partner=partner,memo=memo))
+    tb_partner = lgs.get_tb_with_partner()
+    assert list(tb_partner)==["A社","B社",None],"取引先の順"
+    for partner,tb in tb_partner.items():
+        assert tb==lgs.get_tb(rec_cond_func=lambda rec: rec.get("partner",None)==partner),"get_tbと一致"
+    assert tb_partner["A社"][("売掛金","","")]["end_amount"]==400,"A社の残高"
+    tb_memo = lgs.get_tb_with_memo("天気")
+    assert tb_memo["晴れ"][("売掛金","","")]["end_amount"]==500,"メモごとの残高"
+    assert tb_memo[None][("売掛金","","")]["end_amount"]==300,"メモがない場合"
+
+def test_tb_vs_end_and_cube():
+    #取引先ごとの期末残高の表と、取引先×担当者の疎な表
+    from qtyaccounting.qtytools import Ledgers
+    lgs = Ledgers()
+    lgs.accInfo.set_item_info("売掛金","","",side="Dr")
+    for entry_id,partner,person in ((1,"A社","佐藤"),(2,"B社","佐藤"),(3,"A社","鈴木"),(4,"A社","佐藤")):
+        lgs.register(transfer_entry(entry_id,"2022-04-%02d" % entry_id,"売掛金","売上",100*entry_id,partner=partner,person_in_charge=person))
+    df = lgs.tb_partner_vs_end_to_df()
+    assert list(df.columns)==["A社_end_quanitiy","A社_end_amount","B社_end_quanitiy","B社_end_amount","_end_quanitiy","_end_amount"],"列の順"
+    row = df.xs("売掛金",level="account").iloc[0]
+    assert (row["A社_end_amount"],row["B社_end_amount"])==(800,200),"取引先ごとの残高"
+    assert df["_end_amount"].isna().all(),"recordがない取引先"
+    cube = lgs.tb_cube_to_df(wide=True)
+    assert cube.shape==(2,6) and str(cube.dtypes.iloc[0]).startswith("Sparse"),"recordがある組合せだけの疎な列"
+    assert cube.xs("売掛金",level="account")[("A社","佐藤","end_amount")].iloc[0]==500,"取引先×担当者の残高"
+    long_df = lgs.tb_cube_to_df()
+    assert len(long_df)==6 and list(long_df.columns)==["partner","person_in_charge","end_quantity","end_amount"],"長い形式"
+    #"OTHERS"という取引先と、取引先なし（None）は別の列
+    for entry_id,partner in ((5,"OTHERS"),(6,None)):
+        lgs.register(transfer_entry(entry_id,"2022-04-%02d" % entry_id,"売掛金","売上",100*entry_id,partner=partner,person_in_charge="佐藤"))
+    df = lgs.tb_partner_vs_end_to_df()
+    assert df.columns.is_unique and list(df.columns)[-4:]==["OTHERS_end_quanitiy","OTHERS_end_amount","_end_quanitiy","_end_amount"],"Noneの列"
+    row = df.xs("売掛金",level="account").iloc[0]
+    assert (row["OTHERS_end_amount"],row["_end_amount"])==(500,600),"OTHERSとNoneの残高"
+    cube = lgs.tb_cube_to_df(wide=True)
+    assert cube.columns.is_unique and cube.xs("売掛金",level="account")[("","佐藤","end_amount")].iloc[0]==600,"取引先×担当者の残高（取引先なし）"
+
+def test_record_df_cache():
+    #get_record_dfのメモの列と、recordを追加した場合のキャッシュの更新
+    from qtyaccounting.qtytools import Ledgers
+    lgs = Ledgers()
+    lgs.register(transfer_entry(1,"2022-04-01","現金","売上",100,memo={"天気":"晴れ"}))
+    df = lgs.get_record_df()
+    assert df["天気"].tolist()==["晴れ","晴れ"],"memo_strの列"
+    assert lgs.get_record_df() is not df,"キャッシュのDataFrameそのものは返さない"
+    lgs.register(transfer_entry(2,"2022-04-02","現金","売上",100,memo={"気温":(26,"度")}))
+    df = lgs.get_record_df()
+    assert len(df)==4 and df["気温"].tolist()[2:]==[26,26],"追加したrecordとmemo_numberの列"
+    assert df["memo_str"][0]=="{'天気': '晴れ'}","memo_strは文字列"
+    lgs.recalc_all()
+    assert len(lgs.get_record_df())==4,"再計算後に作り直す"
+
+def test_report_cache():
+    #レポートのキャッシュと、register・AccountInfoの変更による無効化
+    from qtyaccounting.qtytools import Ledgers
+    lgs = Ledgers()
+    lgs.register(transfer_entry(1,"2022-04-01","現金","売上",100))
+    tb = lgs.get_tb()
+    tb[("現金","","")]["end_amount"] = 0
+    assert lgs.get_tb()[("現金","","")]["end_amount"]==100,"返した値を書き換えてもキャッシュは変わらない"
+    assert (lgs.report_cache.hits,lgs.report_cache.misses)==(1,1),"2回目はキャッシュ"
+    lgs.get_tb(rec_cond_func=lambda rec: True)
+    assert lgs.report_cache.bypasses==1,"関数はキャッシュしない"
+    lgs.register(transfer_entry(2,"2022-04-02","現金","売上",100))
+    assert lgs.get_tb()[("現金","","")]["end_amount"]==200,"registerで無効化"
+    lgs.accInfo.set_item_info("現金","","",side="Cr")
+    assert lgs.get_tb()[("現金","","")]["end_amount"]==-200,"AccountInfoの変更で無効化"
+    lgs.report_cache.max_entries = 1
+    lgs.tb_to_df()
+    assert len(lgs.report_cache.entries)==1,"LRUで件数を制限"
+
+def test_record_filter():
+    #RecordFilterによるrecordの抽出（関数と同じ結果）とキャッシュ
+    from qtyaccounting.qtytools import Ledgers,FieldIn,MemoIn,DatetimeRange,AccountPrefix
+    lgs = Ledgers()
+    for entry_id in range(1,7):
+        memo = {"KIND":"ADJUSTING"} if entry_id==3 else {}
+        entry = transfer_entry(entry_id,"2022-%02d-01" % entry_id,"現金","売上",100,memo=memo)
+        #取引先は借方の行だけ
+        entry["debit"][0]["partner"] = "A社" if entry_id % 2 else "B社"
+        lgs.register(entry)
+    lgs.sort_records()
+    f = FieldIn("partner",["A社"]) & DatetimeRange("2022-02-01","2022-06-01")
+    assert [r["datetime"] for r in lgs.select_records(f)]==["2022-03-01","2022-05-01"]
+    assert lgs.select_records(f)==[r for r in lgs.records if f(r)]
+    assert lgs.select_records(~AccountPrefix("現"))==[r for r in lgs.records if r["account"]!="現金"]
+    tb = lgs.get_tb(rec_cond_func=DatetimeRange(end_datetime="2022-04-01"))
+    assert tb[("現金","","")]["end_amount"]==300
+    lgs.get_tb(rec_cond_func=DatetimeRange(end_datetime="2022-04-01"))
+    assert lgs.report_cache.hits==1,"RecordFilterはキャッシュできる"
+    assert len(lgs.select_records(MemoIn("KIND",["ADJUSTING"]) | FieldIn("partner",["B社"])))==5
+
+def test_record_index():
+    #account・partner・memoごとの索引（sort_recordsの後も有効）
+    from qtyaccounting.qtytools import Ledgers,MemoIn
+    lgs = Ledgers()
+    for entry_id,(day,partner,weather) in enumerate([("2022-04-03","A社","晴れ"),("2022-04-01","B社","雨"),("2022-04-02","A社","雨")]):
+        lgs.register(transfer_entry(entry_id,day,"現金","売上",100*(entry_id+1),partner=partner,memo={"天気":weather}))
+    assert [r["dr_amount"] for r in lgs.get_records("現金")]==[100,200,300]
+    lgs.sort_records()
+    assert [r["dr_amount"] for r in lgs.get_records("現金","","")]==[200,300,100],"sort_recordsの後はrecordsの順"
+    assert lgs.get_records("現金") is not lgs.get_records("現金")
+    assert lgs.get_partner_list()==["A社","B社"]
+    assert lgs.get_memo_list("天気")==["晴れ","雨"]
+    assert [r["datetime"] for r in lgs.select_records(MemoIn("天気",["雨"]))]==["2022-04-01","2022-04-01","2022-04-02","2022-04-02"]
+
+def test_run_reports():
+    #複数のレポートをまとめて作成（個別に作成した場合と同じ）
+    from qtyaccounting.qtytools import Ledgers
+    import pandas as pd
+    lgs = Ledgers()
+    for entry_id in range(1,5):
+        lgs.register(transfer_entry(entry_id,"2022-04-%02d" % entry_id,"現金","売上",100*entry_id,partner="A社" if entry_id % 2 else "B社",memo={"部門":"営業"}))
+    specs = [{"report":"tb","end_datetime":"2022-04-03"},{"report":"tb_partner_vs_end","end_datetime":"2022-04-03"},
+             {"report":"tb_memo_vs_end","memo_key":"部門"},{"report":"simple_ledger","account":"現金"}]
+    batch = lgs.run_reports(specs)
+    assert list(batch.dfs.keys())==["TB__2022-04-03","TB_partner_vs_end__2022-04-03","TB_memo_vs_end_部門","現金_LPC"]
+    assert len(batch.timings["scans"])==2,"同じ期間の試算表は一度の走査"
+    lgs.report_cache.clear()
+    pd.testing.assert_frame_equal(batch.dfs["TB__2022-04-03"],lgs.tb_to_df(end_datetime="2022-04-03"))
+    pd.testing.assert_frame_equal(batch.dfs["TB_partner_vs_end__2022-04-03"],lgs.tb_partner_vs_end_to_df(end_datetime="2022-04-03"))
+    pd.testing.assert_frame_equal(batch.dfs["TB_memo_vs_end_部門"],lgs.tb_memo_vs_end_to_df("部門"))
+    written = []
+    batch.write(lambda name,df: written.append(name))
+    assert written==list(batch.dfs.keys())
+    assert lgs.run_reports(specs).timings["scans"]==[],"キャッシュにあるレポートは作成しない"
+
+def test_journal_jsonl(tmp_path):
+    #JSON Lines形式で1行ずつ保存・読み込み、索引でi番目を読む
+    from qtyaccounting.qtytools import QTYJournalTreeToDic,QTYJournalDicToTree
+    import json
+    journal1 = r"""仕入と売上
+<<2022-05-14 ##商品の仕入１
+Dr　商品#Tシャツ *10個 6000円
+Cr　預金 6000>>
+<<2022-05-20 ##商品の売上１
+Dr　預金 5000
+Cr　売上 5000>>"""
+    tree1 = QTYJournalToTree().translate(journal1)
+    journal_dic = json.loads(json.dumps(QTYJournalTreeToDic().transform(tree1)))
+    filename = str(tmp_path / "journal.jsonl")
+    assert QTYJournalTreeToDic().save_jsonl(tree1,filename)==len(journal_dic["journal"])
+    dic_to_tree = QTYJournalDicToTree()
+    assert dic_to_tree.load_jsonl(filename)==journal_dic
+    assert dic_to_tree.load_jsonl_to_tree(filename)==dic_to_tree.translate(journal_dic)
+    journal_jsonl = dic_to_tree.get_jsonl(filename)
+    assert journal_jsonl[-1]==journal_dic["journal"][-1]
+    assert list(journal_jsonl.iter_elements(1))==journal_dic["journal"][1:]
+
+def test_interpret_journal_dic():
+    #journal_dicから構文木を作らずにLedgersを作成する（InterpretJournalTreeと同じrecords）
+    from qtyaccounting.qtytools import QTYJournalTreeToDic,InterpretJournalTree,InterpretJournalDic
+    import json
+    journal1 = r"""
+<<2022-12-14 ##test
+Dr　通信費/[担当者]　#[特売品] @600 ?B円
+Cr　現金 5000 ##test
+Cr　預金 1000>>
+<<
+2022-12-12 &担当者::A君 &特売品::さといも &所持金額:2000円
+>>
+<<2022-12-15 &数:3個 &品::ねぎ $取引先A
+Dr　商品#[品] *[数]個 [所持金額]円 &所持金額:1500円
+Cr　現金 [所持金額]>>"""
+    tree1 = QTYJournalToTree().translate(journal1)
+    lgs_tree = InterpretJournalTree().get_ledgers(tree1)
+    journal_dic = json.loads(json.dumps(QTYJournalTreeToDic().transform(tree1)))
+    lgs_dic = InterpretJournalDic().get_ledgers(journal_dic)
+    assert lgs_dic.records==lgs_tree.records
+    assert [record["amount"] for record in lgs_dic.records if record["account"]=="商品"]==[1500]
+
+def test_journal_dic_to_text_stream(tmp_path):
+    #仕訳ごとにテキストをファイルに書き出す（get_text_from_journal_dicと同じテキスト）
+    from qtyaccounting.qtytools import JournalDicToText
+    journal_dic = {"journal":["text",
+                              {"journal_entry":{"entry_header":{"datetime":"2022-05-14","remarks":"商品の仕入１"},
+                                                "body":[{"debit":{"account":"商品","item":"Tシャツ","quantity":10,"quantity_unit":"個","amount":6000}},
+                                                        {"credit":{"account":"預金","amount":6000}}],"entry_footer":{}}},
+                              {"journal_entry":{"entry_header":{"datetime":"2022-05-20","memo":{"天気":"晴れ"}}}}]}
+    journal_dic_to_text = JournalDicToText()
+    journal_text = journal_dic_to_text.get_text_from_journal_dic(journal_dic)
+    assert journal_text=="<<\n2022-05-14 ##商品の仕入１\n Dr 商品#Tシャツ *10個 6000\n Cr 預金 6000\n>>\n<<\n2022-05-20 &天気::晴れ\n>>\n"
+    filename = str(tmp_path / "journal.txt")
+    assert journal_dic_to_text.save_journal_text(iter(journal_dic["journal"]),filename)==2
+    with open(filename,encoding="utf-8") as f:
+        assert f.read()==journal_text
+    tree = QTYJournalToTree().translate(journal_text)
+    assert len([c for c in tree.children if c.data=="journal_entry"])==2
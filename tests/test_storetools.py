@@ -0,0 +1,95 @@
+import pytest
+
+def test_sqlite_ledgers_store(tmp_path):
+    #recordsをSQLiteに保存し、get_tb・get_recordsなどをSQLで求める（Ledgersと同じ結果）
+    from qtyaccounting.qtytools import Ledgers
+    from qtyaccounting.storetools import SQLiteLedgersStore
+    lgs = Ledgers()
+    for entry_id in range(1,6):
+        lgs.register({"entry_header":{"datetime":"2022-04-%02d" % entry_id,"entry_id":entry_id,"partner":"A社" if entry_id%2 else "B社","memo":{"天気":"晴れ"}},
+                      "debit":[{"account":"現金","amount":100*entry_id,"order_id":0,"line_no":0}],
+                      "credit":[{"account":"売上","amount":100*entry_id,"order_id":1,"line_no":0}]})
+    with SQLiteLedgersStore(str(tmp_path / "Ledgers.sqlite3")) as store:
+        store.save(lgs)
+        assert store.get_tb("2022-04-02","2022-04-05")==lgs.get_tb("2022-04-02","2022-04-05")
+        assert store.get_tb()==lgs.get_tb()
+        assert store.get_records("現金")==lgs.get_records("現金")
+        assert store.get_partner_list()==lgs.get_partner_list()
+        assert store.get_memo_list("天気")==lgs.get_memo_list("天気")
+        loaded = store.load_ledgers()
+    assert loaded.records==lgs.records
+    assert loaded.get_tb()==lgs.get_tb()
+
+def test_sqlite_ledgers_store_float_and_nan(tmp_path):
+    #floatの金額・NaN・OP_***・memoの(数値,単位)も型を変えずに復元する
+    from qtyaccounting.qtytools import Ledgers
+    from qtyaccounting.storetools import SQLiteLedgersStore
+    import math
+    lgs = Ledgers()
+    lgs.register({"entry_header":{"datetime":"2022-04-01","entry_id":1,"memo":{"気温":(20.5,"度")}},
+                  "debit":[{"account":"現金","amount":100.25,"order_id":0,"line_no":0}],
+                  "credit":[{"account":"売上","amount":float("nan"),"order_id":1,"line_no":0}]})
+    lgs.register({"entry_header":{"datetime":"2022-04-02","entry_id":2},
+                  "debit":[{"account":"売上原価","amount":"OP_EQUAL_AMOUNT","order_id":0,"line_no":0}],
+                  "credit":[{"account":"現金","amount":50,"order_id":1,"line_no":0}]})
+    lgs.global_header = {"company":"テスト","期":(1,"期")}
+    with SQLiteLedgersStore(str(tmp_path / "Ledgers.sqlite3")) as store:
+        store.save(lgs)
+        cash = store.get_records("現金")
+        loaded = store.load_ledgers()
+    assert cash==lgs.get_records("現金") and type(cash[0]["amount"]) is float
+    assert loaded.global_header==lgs.global_header
+    nan_record = loaded.records[1]
+    assert math.isnan(nan_record["amount"]) and math.isnan(nan_record["cr_amount"])
+    assert [list(record.items()) for record in loaded.records if record is not nan_record]==[list(record.items()) for record in lgs.records if record is not lgs.records[1]]
+    assert list(nan_record)==list(lgs.records[1])
+
+def test_mapped_ledgers_file(tmp_path):
+    #recordsを固定長の列のファイルに保存し、mmapで開いたNumPyの列からget_tbなどを求める（Ledgersと同じ結果）
+    from qtyaccounting.qtytools import Ledgers
+    from qtyaccounting.storetools import MappedLedgersFile
+    lgs = Ledgers()
+    for entry_id in range(1,6):
+        lgs.register({"entry_header":{"datetime":"2022-04-%02d" % entry_id,"entry_id":entry_id,"partner":"A社" if entry_id%2 else "B社","memo":{"天気":"晴れ","気温":(20+entry_id,"度")}},
+                      "debit":[{"account":"現金","amount":100*entry_id+0.5,"order_id":0,"line_no":0}],
+                      "credit":[{"account":"売上","amount":100*entry_id+0.5,"order_id":1,"line_no":0}]})
+    lgs.global_header = {"company":"テスト","期":(1,"期")}
+    filename = str(tmp_path / "Ledgers.qtylgrs")
+    MappedLedgersFile(filename).save(lgs)
+    with MappedLedgersFile(filename) as mapped:
+        mapped.open()
+        assert len(mapped)==10
+        assert not mapped.get_column("dr_amount_float").flags.writeable
+        assert mapped.get_tb("2022-04-02","2022-04-05")==lgs.get_tb("2022-04-02","2022-04-05")
+        assert mapped.get_records("現金")==lgs.get_records("現金")
+        assert list(mapped.get_positions("売上"))==[i for i,record in enumerate(lgs.records) if record["account"]=="売上"]
+        assert mapped.get_partner_list()==lgs.get_partner_list()
+        assert mapped.get_memo_list("天気")==lgs.get_memo_list("天気")
+        loaded = mapped.load_ledgers()
+    assert loaded.records==lgs.records
+    assert loaded.global_header==lgs.global_header
+
+def test_ledgers_snapshot(tmp_path):
+    #recalc_all後のLedgersを索引・キャッシュごと保存し、そのまま復元する
+    from qtyaccounting.qtytools import Ledgers
+    from qtyaccounting.storetools import LedgersSnapshot
+    lgs = Ledgers()
+    for entry_id in range(1,6):
+        lgs.register({"entry_header":{"datetime":"2022-04-%02d" % entry_id,"entry_id":entry_id,"partner":"A社"},
+                      "debit":[{"account":"現金","amount":100*entry_id,"order_id":0,"line_no":0}],
+                      "credit":[{"account":"売上","amount":100*entry_id,"order_id":1,"line_no":0}]})
+    lgs.recalc_all()
+    lgs.global_header = {"company":"テスト"}
+    df = lgs.get_record_df()
+    snapshot = LedgersSnapshot(str(tmp_path / "Ledgers.qtysnap"))
+    snapshot.save(lgs)
+    restored = snapshot.load()
+    assert restored.records==lgs.records
+    assert restored.global_header=={"company":"テスト"}
+    assert restored.get_record_df().equals(df)
+    assert restored.get_tb()==lgs.get_tb()
+    assert restored.get_partner_list()==["A社"]
+    with open(snapshot.filename,"r+b") as f:
+        f.write(b"XXXXXXXX")
+    with pytest.raises(ValueError):
+        snapshot.load()